@@ -0,0 +1,224 @@
+import numpy as np
+from matcher import l2_normalize as _normalize, top_k as _top_k
+
+CHUNK = 8192  # Rows normalized and assigned at a time while building
+
+
+def _block_size(block):
+    _, embeddings, rows = block
+    return embeddings.shape[0] if rows is None else len(rows)
+
+
+def _chunks(blocks, chunk=CHUNK):
+    """Yield (labels, positions, normalized rows) a chunk at a time.
+
+    ``blocks`` are (labels, embeddings, rows) triples; ``rows`` picks the
+    rows of ``embeddings`` to use, all of them when None. Only one chunk is
+    copied at a time, so a memmapped matrix is never read into memory whole.
+    """
+    for labels, embeddings, rows in blocks:
+        n = embeddings.shape[0] if rows is None else len(rows)
+        for start in range(0, n, chunk):
+            if rows is None:
+                positions = np.arange(start, min(start + chunk, n))
+                data = embeddings[start:start + chunk]
+            else:
+                positions = rows[start:start + chunk]
+                data = embeddings[positions]
+            yield labels, positions, _normalize(data)
+
+
+def _take(blocks, picks):
+    """Normalized copies of the rows at positions ``picks`` of the blocks laid end to end."""
+    out = np.empty((len(picks), blocks[0][1].shape[1]), dtype=np.float32)
+    offset = 0
+    for block in blocks:
+        _, embeddings, rows = block
+        size = _block_size(block)
+        mask = (picks >= offset) & (picks < offset + size)
+        local = picks[mask] - offset
+        out[mask] = embeddings[local if rows is None else rows[local]]
+        offset += size
+    return _normalize(out)
+
+
+class _InvertedList:
+    """Contiguous storage for the templates assigned to one centroid."""
+
+    def __init__(self, dim):
+        self.vectors = np.empty((8, dim), dtype=np.float32)
+        self.labels = []
+
+    def __len__(self):
+        return len(self.labels)
+
+    def append(self, label, vector):
+        size = len(self.labels)
+        if size == self.vectors.shape[0]:
+            grown = np.empty((size * 2, self.vectors.shape[1]), dtype=np.float32)
+            grown[:size] = self.vectors
+            self.vectors = grown
+        self.vectors[size] = vector
+        self.labels.append(label)
+
+    def remove_user(self, user):
+        keep = [i for i, (u, _) in enumerate(self.labels) if u != user]
+        removed = len(self.labels) - len(keep)
+        if removed:
+            self.vectors[:len(keep)] = self.vectors[keep]
+            self.labels = [self.labels[i] for i in keep]
+        return removed
+
+
+class IVFIndex:
+    """Inverted-file ANN index over L2-normalized embeddings.
+
+    Templates are clustered with spherical k-means; a search only scans the
+    ``nprobe`` lists whose centroids are closest to the probe. Raising
+    ``nprobe`` trades latency for recall (``nprobe == nlist`` is exact).
+    """
+
+    def __init__(self, nlist=None, nprobe=8, iterations=10, max_train=100000, seed=0):
+        self.nlist = nlist
+        self.nprobe = nprobe
+        self.iterations = iterations
+        self.max_train = max_train
+        self.seed = seed
+        self.centroids = None
+        self.lists = []
+        self._user_lists = {}  # user -> ids of the lists holding their templates
+
+    def __len__(self):
+        return sum(len(lst) for lst in self.lists)
+
+    def clone_empty(self):
+        """An untrained index with the same parameters."""
+        return IVFIndex(nlist=self.nlist, nprobe=self.nprobe, iterations=self.iterations,
+                        max_train=self.max_train, seed=self.seed)
+
+    @property
+    def is_trained(self):
+        return self.centroids is not None
+
+    def train(self, embeddings):
+        """Fit centroids to a sample of the embeddings."""
+        self._train([(None, embeddings, None)])
+
+    def _train(self, blocks):
+        rng = np.random.default_rng(self.seed)
+        total = sum(_block_size(block) for block in blocks)
+        nlist = self.nlist or max(1, int(np.sqrt(total)))
+        nlist = min(nlist, total)
+        if total > self.max_train:
+            blocks = [(None, _take(blocks, rng.choice(total, self.max_train, replace=False)), None)]
+            total = self.max_train
+
+        centroids = _take(blocks, rng.choice(total, nlist, replace=False))
+        for _ in range(self.iterations):
+            sums = np.zeros_like(centroids)
+            counts = np.zeros(nlist, dtype=np.int64)
+            for _, _, data in _chunks(blocks):
+                assignment = self._assign(data, centroids)
+                np.add.at(sums, assignment, data)
+                counts += np.bincount(assignment, minlength=nlist)
+            empty = counts == 0
+            # Re-seed empty clusters from random points so no list goes unused
+            sums[empty] = _take(blocks, rng.choice(total, int(empty.sum())))
+            centroids = _normalize(sums)
+
+        self.centroids = centroids
+        self.lists = [_InvertedList(centroids.shape[1]) for _ in range(nlist)]
+        self._user_lists = {}
+
+    @staticmethod
+    def _assign(data, centroids, chunk=8192):
+        assignment = np.empty(data.shape[0], dtype=np.int64)
+        for start in range(0, data.shape[0], chunk):
+            scores = data[start:start + chunk] @ centroids.T
+            assignment[start:start + chunk] = np.argmax(scores, axis=1)
+        return assignment
+
+    def build(self, labels, embeddings):
+        """Train on and insert a full set of (user, pose) labels and embeddings."""
+        self.build_blocks([(labels, embeddings, None)])
+
+    def build_blocks(self, blocks):
+        """build() over (labels, embeddings, rows) blocks, e.g. a memmapped base and a tail.
+
+        ``rows`` selects the live rows of a block (all when None). The blocks
+        are read a chunk at a time and never stacked into one matrix.
+        """
+        self._train(blocks)
+        for labels, positions, data in _chunks(blocks):
+            for i, vector, list_id in zip(positions, data, self._assign(data, self.centroids)):
+                self._insert(labels[i], vector, int(list_id))
+
+    def add(self, user, pose, embedding):
+        """Insert one template into the list of its nearest centroid."""
+        if not self.is_trained:
+            raise RuntimeError("IVFIndex must be trained before adding templates")
+        vector = _normalize(embedding)
+        self._insert((user, pose), vector, int(np.argmax(self.centroids @ vector)))
+
+    def _insert(self, label, vector, list_id):
+        self.lists[list_id].append(label, vector)
+        self._user_lists.setdefault(label[0], set()).add(list_id)
+
+    def remove_user(self, user):
+        """Delete every template of a user; returns the number removed."""
+        removed = 0
+        for list_id in self._user_lists.pop(user, ()):
+            removed += self.lists[list_id].remove_user(user)
+        return removed
+
+    def search(self, probe, k=1, nprobe=None):
+        """Return up to k (user, pose, similarity) results, best first."""
+        if not self.is_trained:
+            return []
+        probe = _normalize(probe)
+        nprobe = min(nprobe or self.nprobe, len(self.lists))
+        probed = _top_k(self.centroids @ probe, nprobe)
+
+        labels, scores = [], []
+        for list_id in probed:
+            lst = self.lists[list_id]
+            if len(lst):
+                labels.extend(lst.labels)
+                scores.append(lst.vectors[:len(lst)] @ probe)
+        if not scores:
+            return []
+        scores = np.concatenate(scores)
+        return [(*labels[i], float(scores[i])) for i in _top_k(scores, k)]
+
+    def save(self, path):
+        """Persist centroids and lists to a .npz file."""
+        arrays = {"centroids": self.centroids,
+                  "params": np.array([self.nprobe, self.iterations, self.max_train, self.seed])}
+        for i, lst in enumerate(self.lists):
+            arrays[f"vectors_{i}"] = lst.vectors[:len(lst)]
+            arrays[f"labels_{i}"] = np.array(lst.labels, dtype=str).reshape(-1, 2)
+        np.savez(path, **arrays)
+
+    @classmethod
+    def load(cls, path):
+        """Load an index written by save()."""
+        with np.load(path) as data:
+            nprobe, iterations, max_train, seed = (int(v) for v in data["params"])
+            index = cls(nprobe=nprobe, iterations=iterations, max_train=max_train, seed=seed)
+            index.centroids = data["centroids"]
+            index.nlist = index.centroids.shape[0]
+            index.lists = [_InvertedList(index.centroids.shape[1]) for _ in range(index.nlist)]
+            for list_id in range(index.nlist):
+                for (user, pose), vector in zip(data[f"labels_{list_id}"], data[f"vectors_{list_id}"]):
+                    index._insert((str(user), str(pose)), vector, list_id)
+        return index
+
+
+def measure_recall(index, matcher, probes, k=1, nprobe=None):
+    """Fraction of probes whose exact top-k templates are found by the index."""
+    hits = 0
+    for probe in probes:
+        exact = {(u, p) for u, p, _ in matcher.search(probe, k=k, exact=True)}
+        approx = {(u, p) for u, p, _ in index.search(probe, k=k, nprobe=nprobe)}
+        hits += len(exact & approx)
+    return hits / float(len(probes) * k)
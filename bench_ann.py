@@ -0,0 +1,56 @@
+import argparse
+import time
+import numpy as np
+from ann_index import IVFIndex, measure_recall
+from matcher import FaceMatcher
+
+
+def clustered_embeddings(rng, n, dim, identities):
+    """Synthetic templates: several noisy poses around each identity centre."""
+    centres = rng.standard_normal((identities, dim), dtype=np.float32)
+    owners = rng.integers(0, identities, n)
+    return centres[owners] + 0.5 * rng.standard_normal((n, dim), dtype=np.float32)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Measure IVF recall@k and latency against exact search.")
+    parser.add_argument("--size", type=int, default=100000)
+    parser.add_argument("--dim", type=int, default=4096)
+    parser.add_argument("--nlist", type=int, default=None)
+    parser.add_argument("--nprobe", type=int, nargs="+", default=[1, 2, 4, 8, 16, 32])
+    parser.add_argument("--k", type=int, default=1)
+    parser.add_argument("--probes", type=int, default=200)
+    args = parser.parse_args()
+
+    rng = np.random.default_rng(0)
+    data = clustered_embeddings(rng, args.size, args.dim, max(1, args.size // 5))
+    labels = [(f"USER{i // 5}", f"POSE{i % 5}") for i in range(args.size)]
+    matcher = FaceMatcher()
+    matcher.set_embeddings(labels, data)
+
+    start = time.perf_counter()
+    index = IVFIndex(nlist=args.nlist)
+    index.build(labels, data)
+    print(f"Built {len(index.lists)} lists over {args.size} templates in "
+          f"{time.perf_counter() - start:.1f} s")
+
+    probes = data[rng.choice(args.size, args.probes)] + \
+        0.3 * rng.standard_normal((args.probes, args.dim), dtype=np.float32)
+
+    start = time.perf_counter()
+    for probe in probes:
+        matcher.search(probe, k=args.k, exact=True)
+    exact_ms = (time.perf_counter() - start) * 1000.0 / args.probes
+    print(f"{'nprobe':>8} {'recall':>8} {'ms':>8}   (exact: {exact_ms:.3f} ms)")
+
+    for nprobe in args.nprobe:
+        start = time.perf_counter()
+        for probe in probes:
+            index.search(probe, k=args.k, nprobe=nprobe)
+        ann_ms = (time.perf_counter() - start) * 1000.0 / args.probes
+        recall = measure_recall(index, matcher, probes, k=args.k, nprobe=nprobe)
+        print(f"{nprobe:>8} {recall:>8.3f} {ann_ms:>8.3f}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,49 @@
+import argparse
+import time
+import numpy as np
+from matcher import FaceMatcher, FUSION_STRATEGIES
+
+DEFAULT_SIZES = [10, 100, 1000, 10000, 50000, 100000]
+POSES = ["Front View", "Left Side", "Right Side", "Upward", "Downward"]
+
+
+def random_embeddings(rng, n, dim):
+    return rng.standard_normal((n, dim), dtype=np.float32)
+
+
+def bench_size(n, dim, k, repeats, rng, fusion="max"):
+    """Return (median, p95) search latency in ms for a gallery of n templates."""
+    matcher = FaceMatcher(fusion=fusion)
+    labels = [(f"USER{i // len(POSES)}", POSES[i % len(POSES)]) for i in range(n)]
+    matcher.set_embeddings(labels, random_embeddings(rng, n, dim))
+
+    probes = random_embeddings(rng, repeats, dim)
+    matcher.search(probes[0], k=k)  # Warm-up
+
+    timings = []
+    for probe in probes:
+        start = time.perf_counter()
+        matcher.search(probe, k=k)
+        timings.append((time.perf_counter() - start) * 1000.0)
+    return float(np.median(timings)), float(np.percentile(timings, 95))
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Micro-benchmark the 1:N matcher.")
+    parser.add_argument("--sizes", type=int, nargs="+", default=DEFAULT_SIZES)
+    parser.add_argument("--dim", type=int, default=4096,
+                        help="embedding size (VGG-Face is 4096, Facenet 128)")
+    parser.add_argument("--k", type=int, default=5)
+    parser.add_argument("--repeats", type=int, default=50)
+    parser.add_argument("--fusion", default="max", choices=FUSION_STRATEGIES)
+    args = parser.parse_args()
+
+    rng = np.random.default_rng(0)
+    print(f"{'templates':>10} {'median ms':>10} {'p95 ms':>10}")
+    for n in args.sizes:
+        median, p95 = bench_size(n, args.dim, args.k, args.repeats, rng, args.fusion)
+        print(f"{n:>10} {median:>10.3f} {p95:>10.3f}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,92 @@
+import argparse
+import threading
+import time
+import numpy as np
+from camera import CameraStream, open_source
+from engine import RecognitionEngine
+from multicam import BatchingEngine, RequestDropped, MAX_BATCH, MAX_WAIT
+from template_store import TemplateStore
+
+
+def run_streams(engine, specs, duration, max_batch, max_wait, detect, realtime=True):
+    """Drive one closed-loop client per stream for ``duration`` seconds."""
+    batcher = BatchingEngine(engine, max_batch=max_batch, max_wait=max_wait, detect=detect)
+    cameras = [CameraStream(open_source(spec, realtime=realtime, loop=True)) for spec in specs]
+    served = [0] * len(specs)
+    latencies = []
+    stop = threading.Event()
+
+    def client(i):
+        handle = batcher.client(i)
+        seq = 0
+        while not stop.is_set():
+            with cameras[i].hold(seq, 0.5) as (seq, frame):
+                if frame is None:
+                    continue
+                start = time.perf_counter()
+                try:
+                    handle.nearest(frame)
+                except RequestDropped:
+                    continue
+                latencies.append(time.perf_counter() - start)
+                served[i] += 1
+
+    batcher.start()
+    for camera in cameras:
+        camera.start()
+    threads = [threading.Thread(target=client, args=(i,), daemon=True) for i in range(len(specs))]
+    start = time.perf_counter()
+    for thread in threads:
+        thread.start()
+    time.sleep(duration)
+    stop.set()
+    for thread in threads:
+        thread.join(timeout=30.0)
+    elapsed = time.perf_counter() - start
+    batcher.stop()
+    for camera in cameras:
+        camera.stop()
+
+    ms = np.asarray(latencies) * 1000.0 if latencies else np.zeros(1)
+    return {
+        "throughput": sum(served) / elapsed,
+        "per_stream_min": min(served) / elapsed,
+        "per_stream_max": max(served) / elapsed,
+        "mean_batch": batcher.requests / max(batcher.batches, 1),
+        "p50_ms": float(np.percentile(ms, 50)),
+        "p90_ms": float(np.percentile(ms, 90)),
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Measure batched inference throughput against camera stream count.")
+    parser.add_argument("--source", default="synthetic",
+                        help="frame source for every stream: synthetic, video:PATH or images:DIR")
+    parser.add_argument("--fast", action="store_true",
+                        help="deliver frames as fast as possible instead of in real time, to saturate the model")
+    parser.add_argument("--streams", type=int, nargs="+", default=[1, 2, 4, 8])
+    parser.add_argument("--duration", type=float, default=10.0, help="seconds per stream count")
+    parser.add_argument("--max-batch", type=int, default=MAX_BATCH)
+    parser.add_argument("--max-wait", type=float, default=MAX_WAIT)
+    parser.add_argument("--skip-detection", action="store_true",
+                        help="embed whole frames, e.g. for synthetic sources without real faces")
+    parser.add_argument("--store", help="template store to match against")
+    args = parser.parse_args()
+
+    engine = RecognitionEngine()
+    engine.load()
+    if engine.error is not None:
+        raise SystemExit(f"Recognition engine failed to load: {engine.error}")
+    if args.store:
+        engine.reload(TemplateStore(args.store))
+
+    print(f"{'streams':>8} {'req/s':>8} {'min/s':>8} {'max/s':>8} {'batch':>6} {'p50 ms':>8} {'p90 ms':>8}")
+    for n in args.streams:
+        r = run_streams(engine, [args.source] * n, args.duration, args.max_batch, args.max_wait,
+                        not args.skip_detection, not args.fast)
+        print(f"{n:>8} {r['throughput']:>8.1f} {r['per_stream_min']:>8.1f} {r['per_stream_max']:>8.1f} "
+              f"{r['mean_batch']:>6.2f} {r['p50_ms']:>8.1f} {r['p90_ms']:>8.1f}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,75 @@
+import argparse
+import threading
+import time
+import json
+import http.client
+import numpy as np
+
+
+def client_loop(host, port, path, body, deadline, latencies, statuses, lock):
+    """One keep-alive connection sending requests back to back until the deadline."""
+    connection = http.client.HTTPConnection(host, port, timeout=60)
+    while time.perf_counter() < deadline:
+        start = time.perf_counter()
+        try:
+            connection.request("POST", path, body=body, headers={"Content-Type": "application/octet-stream"})
+            response = connection.getresponse()
+            response.read()
+            status = response.status
+        except (OSError, http.client.HTTPException):
+            connection.close()
+            connection = http.client.HTTPConnection(host, port, timeout=60)
+            status = "error"
+        elapsed = time.perf_counter() - start
+        with lock:
+            statuses[status] = statuses.get(status, 0) + 1
+            if status == 200:
+                latencies.append(elapsed)
+        if status == 503:
+            time.sleep(0.05)
+    connection.close()
+
+
+def run(host, port, path, body, concurrency, duration):
+    latencies, statuses, lock = [], {}, threading.Lock()
+    deadline = time.perf_counter() + duration
+    threads = [threading.Thread(target=client_loop,
+                                args=(host, port, path, body, deadline, latencies, statuses, lock))
+               for _ in range(concurrency)]
+    start = time.perf_counter()
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    elapsed = time.perf_counter() - start
+    ms = np.asarray(latencies) * 1000.0 if latencies else np.zeros(1)
+    return {
+        "ok_per_s": len(latencies) / elapsed,
+        "p50_ms": float(np.percentile(ms, 50)),
+        "p99_ms": float(np.percentile(ms, 99)),
+        "statuses": statuses,
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Offline load generator for the verification service.")
+    parser.add_argument("image", help="encoded image sent as every request body")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8080)
+    parser.add_argument("--path", default="/identify", help="e.g. /identify or /verify?user=DOE")
+    parser.add_argument("--concurrency", type=int, nargs="+", default=[1, 2, 4, 8, 16])
+    parser.add_argument("--duration", type=float, default=10.0, help="seconds per concurrency level")
+    args = parser.parse_args()
+
+    with open(args.image, "rb") as f:
+        body = f.read()
+
+    print(f"{'clients':>8} {'ok/s':>8} {'p50 ms':>8} {'p99 ms':>8}  statuses")
+    for concurrency in args.concurrency:
+        r = run(args.host, args.port, args.path, body, concurrency, args.duration)
+        print(f"{concurrency:>8} {r['ok_per_s']:>8.1f} {r['p50_ms']:>8.1f} {r['p99_ms']:>8.1f}  "
+              f"{json.dumps(r['statuses'])}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,257 @@
+import os
+import sys
+import json
+import time
+import argparse
+import platform
+import cv2
+import numpy as np
+from camera import IMAGE_EXTENSIONS
+from gallery import pose_from_filename, MODEL_THRESHOLDS
+from matcher import FaceMatcher, THRESHOLDS, FUSION_STRATEGIES
+from pipeline import Recognizer, FaceNotFound, STAGES, DETECTOR_BACKEND
+from cascade import CascadeRecognizer, screen_matcher, ACCEPT_RATIO, REJECT_RATIO, SHORTLIST_USERS
+
+# Relative slowdown of a latency percentile that counts as a regression, and
+# the absolute slowdown below which timer jitter is ignored
+LATENCY_TOLERANCE = 0.10
+LATENCY_MIN_DELTA_MS = 1.0
+# Absolute increase in FAR/FRR that counts as a regression
+ACCURACY_TOLERANCE = 0.01
+
+
+def list_images(directory):
+    return sorted(
+        os.path.join(directory, f) for f in os.listdir(directory)
+        if f.lower().endswith(IMAGE_EXTENSIONS)
+    )
+
+
+def load_dataset(root):
+    """Read a labelled dataset.
+
+    ``<root>/enroll/<USER>/<USER>_<pose>_Face.png`` are enrollment images and
+    ``<root>/probes/<LABEL>/*`` are probe frames, in arrival order. A probe
+    label that is not enrolled (e.g. ``_unknown``) marks impostor frames.
+    """
+    enroll, probes = {}, {}
+    for kind, target in (("enroll", enroll), ("probes", probes)):
+        base = os.path.join(root, kind)
+        for label in sorted(os.listdir(base)):
+            if os.path.isdir(os.path.join(base, label)):
+                target[label] = list_images(os.path.join(base, label))
+    return enroll, probes
+
+
+def percentiles(samples):
+    """Latency summary in milliseconds."""
+    if not samples:
+        return None
+    ms = np.asarray(samples) * 1000.0
+    return {
+        "count": int(ms.size),
+        "mean": float(ms.mean()),
+        "p50": float(np.percentile(ms, 50)),
+        "p90": float(np.percentile(ms, 90)),
+        "p99": float(np.percentile(ms, 99)),
+        "max": float(ms.max()),
+    }
+
+
+def enroll_users(recognizer, enroll):
+    for user, paths in enroll.items():
+        for path in paths:
+            frame = cv2.imread(path)
+            try:
+                embedding = recognizer.enroll(frame)
+            except FaceNotFound:
+                print(f"No face in enrollment image {path}")
+                continue
+            recognizer.matcher.add(user, pose_from_filename(user, os.path.basename(path)), embedding)
+
+
+def run_probes(recognizer, probes, enrolled):
+    """Run every probe through the recognizer and collect latencies and decisions."""
+    stage_samples = {stage: [] for stage in STAGES}
+    end_to_end, time_to_unlock = [], []
+    counts = {"genuine": 0, "impostor": 0, "false_rejects": 0,
+              "false_accepts": 0, "misidentified": 0, "no_face": 0}
+
+    wall_start = time.perf_counter()
+    for label, paths in probes.items():
+        genuine = label in enrolled
+        sequence_start = time.perf_counter()
+        unlocked = False
+        for path in paths:
+            timings = {}
+            start = time.perf_counter()
+            frame = cv2.imread(path)
+            timings["capture"] = time.perf_counter() - start
+            if frame is None:
+                print(f"Could not read probe {path}")
+                continue
+            match = recognizer.identify(frame, timings)
+            end_to_end.append(time.perf_counter() - start)
+            for stage in STAGES:
+                if stage in timings:
+                    stage_samples[stage].append(timings[stage])
+            if "embedding" not in timings:
+                counts["no_face"] += 1
+
+            if genuine:
+                counts["genuine"] += 1
+                if match is None:
+                    counts["false_rejects"] += 1
+                elif match[0] != label:
+                    counts["false_rejects"] += 1
+                    counts["misidentified"] += 1
+                elif not unlocked:
+                    unlocked = True
+                    time_to_unlock.append(time.perf_counter() - sequence_start)
+            else:
+                counts["impostor"] += 1
+                if match is not None:
+                    counts["false_accepts"] += 1
+    wall = time.perf_counter() - wall_start
+
+    probes_run = len(end_to_end)
+    return {
+        "stages": {stage: percentiles(samples) for stage, samples in stage_samples.items()},
+        "end_to_end": percentiles(end_to_end),
+        "time_to_unlock": percentiles(time_to_unlock),
+        "unlocked_sequences": len(time_to_unlock),
+        "genuine_sequences": sum(1 for label in probes if label in enrolled),
+        "throughput_probes_per_s": probes_run / wall if wall > 0 else 0.0,
+        "accuracy": dict(
+            counts,
+            far=counts["false_accepts"] / counts["impostor"] if counts["impostor"] else None,
+            frr=counts["false_rejects"] / counts["genuine"] if counts["genuine"] else None,
+        ),
+    }
+
+
+def _slower(new, old):
+    if not new or not old:
+        return False
+    delta = new["p50"] - old["p50"]
+    return delta > LATENCY_MIN_DELTA_MS and new["p50"] > old["p50"] * (1 + LATENCY_TOLERANCE)
+
+
+def find_regressions(result, baseline):
+    """Compare a run with a baseline report; returns human-readable regressions."""
+    regressions = []
+    latencies = [(name, result.get(name), baseline.get(name))
+                 for name in ("end_to_end", "time_to_unlock")]
+    latencies += [(stage, new, baseline.get("stages", {}).get(stage))
+                  for stage, new in result["stages"].items()]
+    for name, new, old in latencies:
+        if _slower(new, old):
+            regressions.append(f"{name} p50 {old['p50']:.1f} -> {new['p50']:.1f} ms")
+    for rate in ("far", "frr"):
+        new, old = result["accuracy"][rate], baseline.get("accuracy", {}).get(rate)
+        if new is not None and old is not None and new > old + ACCURACY_TOLERANCE:
+            regressions.append(f"{rate.upper()} {old:.3f} -> {new:.3f}")
+    return regressions
+
+
+def deepface_version():
+    try:
+        import deepface
+        return getattr(deepface, "__version__", "unknown")
+    except ImportError:
+        return None
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Headless end-to-end benchmark of the UnlockX login pipeline.")
+    parser.add_argument("dataset", help="directory with enroll/<USER>/ and probes/<LABEL>/ subfolders")
+    parser.add_argument("--metric", default="cosine", choices=sorted(THRESHOLDS))
+    parser.add_argument("--threshold", type=float, default=None)
+    parser.add_argument("--fusion", default=FUSION_STRATEGIES[0], choices=FUSION_STRATEGIES)
+    parser.add_argument("--detector", default=DETECTOR_BACKEND)
+    parser.add_argument("--cascade", metavar="SCREEN_MODEL", choices=sorted(MODEL_THRESHOLDS),
+                        help="also run the cheap-then-accurate cascade with this screening model "
+                             "and report it next to the single-model run")
+    parser.add_argument("--accept-ratio", type=float, default=ACCEPT_RATIO)
+    parser.add_argument("--reject-ratio", type=float, default=REJECT_RATIO)
+    parser.add_argument("--shortlist", type=int, default=SHORTLIST_USERS)
+    parser.add_argument("--output", help="write the JSON report here instead of stdout")
+    parser.add_argument("--baseline", help="previous JSON report to check for regressions")
+    args = parser.parse_args()
+
+    enroll, probes = load_dataset(args.dataset)
+    matcher = FaceMatcher(metric=args.metric, threshold=args.threshold, fusion=args.fusion)
+    recognizer = Recognizer(matcher, detector_backend=args.detector)
+
+    start = time.perf_counter()
+    enroll_users(recognizer, enroll)
+    enroll_seconds = time.perf_counter() - start
+
+    result = {
+        "timestamp": time.strftime("%Y-%m-%dT%H:%M:%S"),
+        "config": {
+            "model": recognizer.model_name,
+            "detector": recognizer.detector_backend,
+            "metric": matcher.metric,
+            "threshold": matcher.threshold,
+            "fusion": matcher.fusion,
+            "deepface": deepface_version(),
+            "python": platform.python_version(),
+            "machine": platform.machine(),
+        },
+        "dataset": {
+            "path": os.path.abspath(args.dataset),
+            "enrolled_users": len(enroll),
+            "templates": len(matcher),
+            "probes": sum(len(paths) for paths in probes.values()),
+        },
+        "enroll_seconds": enroll_seconds,
+    }
+    result.update(run_probes(recognizer, probes, set(enroll)))
+
+    if args.cascade:
+        # Shares the heavy model's matcher, so only the screening templates are enrolled again
+        cascade = CascadeRecognizer(matcher, screen_matcher(args.cascade, fusion=args.fusion),
+                                    detector_backend=args.detector, screen_model=args.cascade,
+                                    accept_ratio=args.accept_ratio, reject_ratio=args.reject_ratio,
+                                    shortlist=args.shortlist)
+        start = time.perf_counter()
+        enroll_users(cascade.screen, enroll)
+        cascade.update_coverage()
+        result["cascade"] = {
+            "config": {
+                "screen_model": args.cascade,
+                "screen_threshold": cascade.screen.matcher.threshold,
+                "accept_ratio": args.accept_ratio,
+                "reject_ratio": args.reject_ratio,
+                "shortlist": args.shortlist,
+            },
+            "enroll_seconds": time.perf_counter() - start,
+        }
+        result["cascade"].update(run_probes(cascade, probes, set(enroll)))
+        result["cascade"]["exits"] = dict(cascade.exits)
+        single, cascaded = result["end_to_end"], result["cascade"]["end_to_end"]
+        if single and cascaded:
+            print(f"end-to-end p50: single {single['p50']:.1f} ms, cascade {cascaded['p50']:.1f} ms; "
+                  f"FAR {result['accuracy']['far']} -> {result['cascade']['accuracy']['far']}, "
+                  f"FRR {result['accuracy']['frr']} -> {result['cascade']['accuracy']['frr']}; "
+                  f"exits {cascade.exits}", file=sys.stderr)
+
+    report = json.dumps(result, indent=2)
+    if args.output:
+        with open(args.output, "w") as f:
+            f.write(report)
+    else:
+        print(report)
+
+    if args.baseline:
+        with open(args.baseline) as f:
+            regressions = find_regressions(result, json.load(f))
+        for regression in regressions:
+            print(f"REGRESSION: {regression}", file=sys.stderr)
+        if regressions:
+            sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
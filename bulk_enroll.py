@@ -0,0 +1,230 @@
+import os
+import csv
+import time
+import argparse
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor, FIRST_COMPLETED, wait
+import cv2
+from camera import IMAGE_EXTENSIONS
+from gallery import REFERENCE_DIR, MODEL_NAME, pose_from_filename, reference_path
+from image_writer import ImageWriter, ENROLL_FORMAT, ENROLL_QUALITY, FORMATS
+from matcher import FaceMatcher
+from pipeline import Recognizer, FaceNotFound, DETECTOR_BACKEND
+from template_store import TemplateStore, TEMPLATE_DIR, POSE_WIDTH
+
+_recognizer = None  # One per pool process, built by _init_worker
+
+
+def _init_worker(model_name, detector_backend):
+    global _recognizer
+    _recognizer = Recognizer(FaceMatcher(), model_name, detector_backend)
+
+
+def _embed_file(path):
+    """Pool task: ((face crop, embedding), None) or (None, reason) for one image file."""
+    frame = cv2.imread(path)
+    if frame is None:
+        return None, "unreadable image"
+    try:
+        return _recognizer.enroll_face(frame), None
+    except FaceNotFound:
+        return None, "no face detected"
+    except Exception as e:
+        return None, str(e)
+
+
+def user_key(first_name, last_name):
+    """The name the login page knows a user by: the upper-cased last name."""
+    return last_name.strip().upper()
+
+
+def pose_for(user, path):
+    """Reuse the pose of '<USER>_<pose>_Face.png' files, else the file name."""
+    filename = os.path.basename(path)
+    if filename.upper().startswith(user + "_") and "_Face." in filename:
+        return pose_from_filename(user, filename)
+    return os.path.splitext(filename)[0][:POSE_WIDTH]
+
+
+def tasks_from_directory(root):
+    """(user, pose, path, full name) for every image under root/<First Last or LAST>/."""
+    tasks = []
+    for folder in sorted(os.listdir(root)):
+        directory = os.path.join(root, folder)
+        if not os.path.isdir(directory):
+            continue
+        names = folder.replace("_", " ").split()
+        user = user_key(" ".join(names[:-1]), names[-1])
+        for filename in sorted(os.listdir(directory)):
+            if filename.lower().endswith(IMAGE_EXTENSIONS):
+                path = os.path.join(directory, filename)
+                tasks.append((user, pose_for(user, path), path, " ".join(names).upper()))
+    return tasks
+
+
+def tasks_from_csv(csv_path):
+    """(user, pose, path, full name) from a CSV with first_name, last_name and image_paths columns.
+
+    image_paths may hold several paths separated by ';'; relative paths are
+    resolved against the CSV's directory.
+    """
+    base = os.path.dirname(os.path.abspath(csv_path))
+    tasks = []
+    with open(csv_path, newline="") as f:
+        for row in csv.DictReader(f):
+            user = user_key(row.get("first_name", ""), row["last_name"])
+            full_name = f"{row.get('first_name', '')} {row['last_name']}".strip().upper()
+            for path in filter(None, (p.strip() for p in row["image_paths"].split(";"))):
+                path = os.path.join(base, path)
+                tasks.append((user, pose_for(user, path), path, full_name))
+    return tasks
+
+
+class BulkImporter:
+    """Embeds images in a process pool and writes them like RegisterPage does.
+
+    At most ``window`` images are in flight at once, so memory stays flat on
+    large imports. Results are written from this process only: the aligned
+    face crop is queued to an ImageWriter for reference/<LASTNAME>/ and the
+    template appended (fsynced) to the store. Templates whose (user, pose) is already in the store are
+    skipped, which makes an interrupted import safe to run again. Every new
+    template is checked against the gallery so far; one that matches a
+    different user within ``duplicate_threshold`` is flagged as a possible
+    duplicate identity, and people who share a last name (and so would
+    share one login identity) are reported as name collisions. An import
+    that added anything ends by compacting the store into a new generation.
+    """
+
+    def __init__(self, store, reference_dir=REFERENCE_DIR, workers=2, window=None,
+                 model_name=MODEL_NAME, detector_backend=DETECTOR_BACKEND,
+                 duplicate_threshold=None, copy_images=True, image_format=ENROLL_FORMAT,
+                 image_quality=ENROLL_QUALITY):
+        self.store = store
+        self.reference_dir = reference_dir
+        self.workers = workers
+        self.window = window or workers * 4
+        self.model_name = model_name
+        self.detector_backend = detector_backend
+        self.copy_images = copy_images
+        self.image_format = image_format
+        self.image_quality = image_quality
+        self.writer = None
+        self.matcher = FaceMatcher(threshold=duplicate_threshold)
+        store.populate(self.matcher)
+        self.enrolled = 0
+        self.skipped = 0
+        self.failures = []  # (path, reason)
+        self.duplicates = []  # (user, pose, other user, distance)
+        self.collisions = {}  # user -> full names that map to it
+
+    def _write(self, user, pose, path, face, embedding):
+        nearest = [r for r in self.matcher.search(embedding, k=10) if r[0] != user]
+        if nearest and nearest[0][2] <= self.matcher.threshold:
+            self.duplicates.append((user, pose, nearest[0][0], nearest[0][2]))
+        if self.writer is not None:
+            target = reference_path(user, pose, self.reference_dir, ext=self.writer.fmt)
+            self.writer.write_image(target, face)  # Failures are logged by the writer
+        self.store.append(user, pose, embedding)
+        self.matcher.add(user, pose, embedding)
+        self.enrolled += 1
+
+    def run(self, tasks, progress=None):
+        """Import (user, pose, path, full name) tasks; returns the elapsed seconds."""
+        full_names = {}
+        for user, _, _, full_name in tasks:
+            full_names.setdefault(user, set()).add(full_name)
+        self.collisions = {user: sorted(names) for user, names in full_names.items() if len(names) > 1}
+
+        existing = set(self.matcher.labels)
+        todo = [task for task in tasks if (task[0], task[1]) not in existing]
+        self.skipped += len(tasks) - len(todo)
+
+        start = time.perf_counter()
+        enrolled_before = self.enrolled
+        if self.copy_images:
+            self.writer = ImageWriter(self.image_format, self.image_quality)
+        context = multiprocessing.get_context("spawn")  # TensorFlow does not survive fork
+        with ProcessPoolExecutor(self.workers, mp_context=context, initializer=_init_worker,
+                                 initargs=(self.model_name, self.detector_backend)) as pool:
+            remaining = iter(todo)
+            in_flight = {}
+            while True:
+                while len(in_flight) < self.window:
+                    task = next(remaining, None)
+                    if task is None:
+                        break
+                    in_flight[pool.submit(_embed_file, task[2])] = task
+                if not in_flight:
+                    break
+                done, _ = wait(in_flight, return_when=FIRST_COMPLETED)
+                for future in done:
+                    user, pose, path, _ = in_flight.pop(future)
+                    try:
+                        result, reason = future.result()
+                    except Exception as e:
+                        result, reason = None, str(e)
+                    if result is None:
+                        self.failures.append((path, reason))
+                    else:
+                        self._write(user, pose, path, *result)
+                    if progress is not None:
+                        progress(self.enrolled + len(self.failures), len(todo))
+        if self.writer is not None:
+            self.writer.stop()  # Wait for the last crops to reach the disk
+            self.writer = None
+        if self.enrolled > enrolled_before:
+            # Into a new mapped generation, so logins don't read and replay a huge append log
+            self.store.compact()
+        return time.perf_counter() - start
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Enroll many users at once from existing photos.")
+    source = parser.add_mutually_exclusive_group(required=True)
+    source.add_argument("--directory", help="tree of <First Last>/ or <LASTNAME>/ folders of photos")
+    source.add_argument("--csv", help="CSV with first_name, last_name and ';'-separated image_paths columns")
+    parser.add_argument("--store", default=TEMPLATE_DIR)
+    parser.add_argument("--reference-dir", default=REFERENCE_DIR)
+    parser.add_argument("--no-copy", action="store_true",
+                        help="only write the template store, not reference/<LASTNAME>/ images")
+    parser.add_argument("--image-format", default=ENROLL_FORMAT, choices=FORMATS,
+                        help="format of the face crops saved to reference/<LASTNAME>/")
+    parser.add_argument("--image-quality", type=int, default=ENROLL_QUALITY)
+    parser.add_argument("--workers", type=int, default=max(1, (os.cpu_count() or 2) // 2))
+    parser.add_argument("--window", type=int, default=None, help="images in flight (default 4 per worker)")
+    parser.add_argument("--detector", default=DETECTOR_BACKEND)
+    parser.add_argument("--duplicate-threshold", type=float, default=None,
+                        help="distance under which two users are flagged (default: the login threshold)")
+    parser.add_argument("--failures", help="write failed images and reasons to this CSV")
+    args = parser.parse_args()
+
+    tasks = tasks_from_directory(args.directory) if args.directory else tasks_from_csv(args.csv)
+    importer = BulkImporter(TemplateStore(args.store), args.reference_dir, args.workers, args.window,
+                            detector_backend=args.detector, duplicate_threshold=args.duplicate_threshold,
+                            copy_images=not args.no_copy, image_format=args.image_format,
+                            image_quality=args.image_quality)
+
+    def progress(done, total):
+        if done % 100 == 0 or done == total:
+            print(f"{done}/{total} images processed", flush=True)
+
+    elapsed = importer.run(tasks, progress)
+    processed = importer.enrolled + len(importer.failures)
+    print(f"Enrolled {importer.enrolled} templates, skipped {importer.skipped} already in the store, "
+          f"{len(importer.failures)} failed, in {elapsed:.1f} s "
+          f"({processed / elapsed if elapsed > 0 else 0.0:.1f} images/s)")
+    for path, reason in importer.failures:
+        print(f"FAILED {path}: {reason}")
+    for user, names in importer.collisions.items():
+        print(f"NAME COLLISION {user}: {', '.join(names)} would share one login identity")
+    for user, pose, other, distance in importer.duplicates:
+        print(f"POSSIBLE DUPLICATE {user} ({pose}) matches {other} at distance {distance:.3f}")
+    if args.failures:
+        with open(args.failures, "w", newline="") as f:
+            writer = csv.writer(f)
+            writer.writerow(["path", "reason"])
+            writer.writerows(importer.failures)
+
+
+if __name__ == "__main__":
+    main()
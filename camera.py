@@ -0,0 +1,376 @@
+import os
+import threading
+import time
+from contextlib import contextmanager
+import cv2
+import numpy as np
+from metrics import REGISTRY, stage
+
+FRAMES_CAPTURED = REGISTRY.counter("unlockx_frames_captured_total", "Frames read from camera sources")
+FRAMES_DROPPED = REGISTRY.counter("unlockx_frames_dropped_total",
+                                  "Frames discarded because consumers held every ring slot")
+
+
+class FrameRing:
+    """Small preallocated ring of frames with a latest-frame sequence number.
+
+    The writer never overwrites the latest slot or a slot a consumer is
+    holding, so readers get views into the ring without copying.
+    """
+
+    def __init__(self, slots=4):
+        self.slots = slots
+        self.buffers = None
+        self.seq = 0
+        self._latest = None
+        self._pins = [0] * slots
+        self._cond = threading.Condition()
+
+    def allocate(self, shape, dtype=np.uint8):
+        with self._cond:
+            self.buffers = np.empty((self.slots,) + tuple(shape), dtype=dtype)
+            self._latest = None
+
+    def next_slot(self):
+        """A slot that is neither the latest frame nor held by a consumer."""
+        with self._cond:
+            for offset in range(1, self.slots + 1):
+                slot = ((self._latest or 0) + offset) % self.slots
+                if slot != self._latest and not self._pins[slot]:
+                    return slot
+        return None
+
+    def publish(self, slot):
+        with self._cond:
+            self._latest = slot
+            self.seq += 1
+            self._cond.notify_all()
+
+    def latest(self):
+        """Return (seq, frame) for the newest frame, or (0, None) before the first one.
+
+        The frame is a view that stays valid until the writer wraps around the
+        ring; use hold() when processing takes longer than a few frames.
+        """
+        with self._cond:
+            if self._latest is None:
+                return 0, None
+            return self.seq, self.buffers[self._latest]
+
+    @contextmanager
+    def hold(self, after_seq=None, timeout=None):
+        """Pin the newest frame so it cannot be overwritten while in use."""
+        with self._cond:
+            if after_seq is not None:
+                self._cond.wait_for(lambda: self.seq > after_seq, timeout)
+            slot = self._latest
+            seq = self.seq
+            if slot is not None:
+                self._pins[slot] += 1
+        try:
+            yield seq, (None if slot is None else self.buffers[slot])
+        finally:
+            if slot is not None:
+                with self._cond:
+                    self._pins[slot] -= 1
+
+
+IMAGE_EXTENSIONS = (".png", ".jpg", ".jpeg", ".bmp")
+
+
+class Pacer:
+    """Sleeps between frames to hold a target rate; a no-op when not real-time."""
+
+    def __init__(self, fps, realtime=True):
+        self.interval = 1.0 / fps if realtime and fps and fps > 0 else 0.0
+        self._next = None
+
+    def wait(self):
+        if not self.interval:
+            return
+        now = time.perf_counter()
+        if self._next is None:
+            self._next = now
+        elif self._next > now:
+            time.sleep(self._next - now)
+        # Never build up a backlog of frames to catch up on
+        self._next = max(self._next + self.interval, time.perf_counter() - self.interval)
+
+
+class FrameSource:
+    """Base class for anything CameraStream can read frames from.
+
+    read() follows cv2.VideoCapture.read(): it returns (ret, frame) and may
+    fill ``dst`` in place. ``finished`` becomes True when a finite source
+    (a video or image directory played without looping) runs out.
+    """
+
+    finished = False
+
+    def open(self):
+        pass
+
+    def read(self, dst=None):
+        raise NotImplementedError
+
+    def grab(self):
+        """Skip one frame."""
+        return self.read()[0]
+
+    def release(self):
+        pass
+
+
+class DeviceSource(FrameSource):
+    """A live camera opened with cv2.VideoCapture."""
+
+    def __init__(self, index=0, width=1280, height=720):
+        self.index = index
+        self.width = width
+        self.height = height
+        self._capture = None
+
+    def open(self):
+        self._capture = cv2.VideoCapture(self.index)
+        self._capture.set(cv2.CAP_PROP_FRAME_WIDTH, self.width)
+        self._capture.set(cv2.CAP_PROP_FRAME_HEIGHT, self.height)
+
+    def read(self, dst=None):
+        return self._capture.read(dst)
+
+    def grab(self):
+        return self._capture.grab()
+
+    def release(self):
+        if self._capture is not None:
+            self._capture.release()
+            self._capture = None
+
+
+class VideoFileSource(FrameSource):
+    """A recorded video, paced at its native rate or decoded as fast as possible."""
+
+    def __init__(self, path, realtime=True, loop=False, fps=None):
+        self.path = path
+        self.realtime = realtime
+        self.loop = loop
+        self.fps = fps
+        self._capture = None
+        self._pacer = None
+
+    def open(self):
+        self._capture = cv2.VideoCapture(self.path)
+        if not self._capture.isOpened():
+            raise IOError(f"Cannot open video '{self.path}'")
+        fps = self.fps or self._capture.get(cv2.CAP_PROP_FPS) or 30.0
+        self._pacer = Pacer(fps, self.realtime)
+        self.finished = False
+
+    def read(self, dst=None):
+        self._pacer.wait()
+        ret, frame = self._capture.read(dst)
+        if not ret and self.loop:
+            self._capture.set(cv2.CAP_PROP_POS_FRAMES, 0)
+            ret, frame = self._capture.read(dst)
+        if not ret:
+            self.finished = True
+        return ret, frame
+
+    def release(self):
+        if self._capture is not None:
+            self._capture.release()
+            self._capture = None
+
+
+class ImageDirSource(FrameSource):
+    """Still images from a directory, in name order, played as a video."""
+
+    def __init__(self, path, fps=30.0, realtime=True, loop=False):
+        self.path = path
+        self.fps = fps
+        self.realtime = realtime
+        self.loop = loop
+        self.files = []
+        self._position = 0
+        self._pacer = None
+
+    def open(self):
+        self.files = sorted(
+            os.path.join(self.path, f) for f in os.listdir(self.path)
+            if f.lower().endswith(IMAGE_EXTENSIONS)
+        )
+        if not self.files:
+            raise IOError(f"No images found in '{self.path}'")
+        self._position = 0
+        self._pacer = Pacer(self.fps, self.realtime)
+        self.finished = False
+
+    def read(self, dst=None):
+        if self._position >= len(self.files):
+            if not self.loop:
+                self.finished = True
+                return False, None
+            self._position = 0
+        self._pacer.wait()
+        frame = cv2.imread(self.files[self._position])
+        self._position += 1
+        if frame is None:
+            return False, None
+        if dst is not None and dst.shape == frame.shape:
+            dst[...] = frame
+            return True, dst
+        return True, frame
+
+
+class SyntheticSource(FrameSource):
+    """Generated frames: a face-like blob drifting across a textured background."""
+
+    def __init__(self, width=1280, height=720, fps=30.0, realtime=True, frames=None, seed=0):
+        self.width = width
+        self.height = height
+        self.fps = fps
+        self.realtime = realtime
+        self.frames = frames
+        self.seed = seed
+        self._count = 0
+        self._background = None
+        self._pacer = None
+
+    def open(self):
+        rng = np.random.default_rng(self.seed)
+        self._background = rng.integers(40, 80, (self.height, self.width, 3), dtype=np.uint8)
+        self._count = 0
+        self._pacer = Pacer(self.fps, self.realtime)
+        self.finished = False
+
+    def read(self, dst=None):
+        if self.frames is not None and self._count >= self.frames:
+            self.finished = True
+            return False, None
+        self._pacer.wait()
+        if dst is None or dst.shape != self._background.shape:
+            dst = np.empty_like(self._background)
+        dst[...] = self._background
+
+        t = self._count / float(self.fps)
+        center = (int(self.width * (0.5 + 0.25 * np.sin(t))), self.height // 2)
+        axes = (self.height // 8, self.height // 6)
+        cv2.ellipse(dst, center, axes, 0, 0, 360, (150, 180, 210), -1)
+        for dx in (-axes[0] // 2, axes[0] // 2):
+            cv2.circle(dst, (center[0] + dx, center[1] - axes[1] // 4), axes[0] // 6, (40, 40, 40), -1)
+        self._count += 1
+        return True, dst
+
+
+def open_source(spec, realtime=True, loop=False, width=1280, height=720, fps=30.0):
+    """Build a FrameSource from 'device[:N]', 'video:PATH', 'images:DIR' or 'synthetic'."""
+    kind, _, arg = spec.partition(":")
+    if kind == "device":
+        return DeviceSource(int(arg or 0), width, height)
+    if kind == "video":
+        return VideoFileSource(arg, realtime=realtime, loop=loop)
+    if kind == "images":
+        return ImageDirSource(arg, fps=fps, realtime=realtime, loop=loop)
+    if kind == "synthetic":
+        return SyntheticSource(width, height, fps=fps, realtime=realtime)
+    raise ValueError(f"Unknown frame source '{spec}'")
+
+
+def add_source_arguments(parser):
+    """Register the frame-source command line flags on an argparse parser."""
+    parser.add_argument("--source", action="append", default=None,
+                        help="device[:N], video:PATH, images:DIR or synthetic; repeat for several cameras")
+    parser.add_argument("--fast", action="store_true",
+                        help="play recorded sources as fast as possible instead of in real time")
+    parser.add_argument("--loop", action="store_true", help="restart recorded sources at the end")
+    parser.add_argument("--fps", type=float, default=30.0,
+                        help="frame rate for image directories and synthetic frames")
+    parser.add_argument("--capture-size", default="1280x720",
+                        help="WIDTHxHEIGHT requested from cameras (and of synthetic frames); "
+                             "640x480 is enough for a kiosk preview and faces at arm's length")
+
+
+def sources_from_args(args):
+    """Every --source given, or the first camera device if there were none."""
+    width, height = (int(v) for v in args.capture_size.lower().split("x"))
+    return [open_source(spec, realtime=not args.fast, loop=args.loop, width=width, height=height, fps=args.fps)
+            for spec in args.source or ["device:0"]]
+
+
+class CameraStream:
+    """Single owner of the frame source.
+
+    One background thread reads the source and publishes into a FrameRing;
+    the preview timers, the verification thread and registration capture all
+    read from the ring instead of calling read() themselves.
+    """
+
+    def __init__(self, source=None, slots=4):
+        self.source = source if source is not None else DeviceSource()
+        self.ring = FrameRing(slots)
+        self._thread = None
+        self._running = False
+
+    @property
+    def is_running(self):
+        return self._running
+
+    def start(self):
+        """Open the source and start capturing; a no-op if already running."""
+        if self._running:
+            return
+        self.source.open()
+        self._running = True
+        self._thread = threading.Thread(target=self._run, daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        """Stop the capture thread and release the source."""
+        self._running = False
+        if self._thread is not None and self._thread is not threading.current_thread():
+            self._thread.join(timeout=1.0)
+            self._thread = None
+        self.source.release()
+
+    @property
+    def finished(self):
+        """True once a finite source has delivered its last frame."""
+        return self.source.finished
+
+    def _run(self):
+        read_time = stage("camera_read")
+        while self._running and not self.source.finished:
+            buffer = None
+            slot = 0
+            if self.ring.buffers is not None:
+                slot = self.ring.next_slot()
+                if slot is None:
+                    # Every other slot is held by a consumer; drop this frame
+                    self.source.grab()
+                    FRAMES_DROPPED.inc()
+                    continue
+                buffer = self.ring.buffers[slot]
+
+            start = time.perf_counter()
+            ret, frame = self.source.read(buffer)
+            read_time.observe(time.perf_counter() - start)
+            if not ret:
+                time.sleep(0.01)
+                continue
+            if frame is not buffer:
+                if buffer is None or frame.shape != buffer.shape:
+                    self.ring.allocate(frame.shape, frame.dtype)
+                    slot = 0
+                    buffer = self.ring.buffers[0]
+                buffer[...] = frame
+            self.ring.publish(slot)
+            FRAMES_CAPTURED.inc()
+        self._running = False
+
+    def latest(self):
+        """(seq, frame) of the newest frame; see FrameRing.latest()."""
+        return self.ring.latest()
+
+    def hold(self, after_seq=None, timeout=None):
+        """Context manager pinning the newest frame; see FrameRing.hold()."""
+        return self.ring.hold(after_seq, timeout)
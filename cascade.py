@@ -0,0 +1,169 @@
+import os
+import time
+import logging
+import argparse
+import cv2
+from gallery import (MODEL_NAME, MODEL_THRESHOLDS, REFERENCE_DIR, is_face_crop, is_reference_image,
+                     pose_from_filename)
+from matcher import FaceMatcher, FUSION_SHORTLIST
+from pipeline import Recognizer, FaceNotFound, DETECTOR_BACKEND
+from template_store import TemplateStore, TEMPLATE_DIR, model_store_path
+from metrics import REGISTRY
+
+logger = logging.getLogger("unlockx")
+
+SCREEN_MODEL = "SFace"  # Small OpenCV model; a fraction of VGG-Face's cost per crop
+ACCEPT_RATIO = 0.6  # Screen distance under threshold * this is accepted without the heavy model
+REJECT_RATIO = 1.3  # ...and over threshold * this is rejected without it
+SHORTLIST_USERS = 5  # Users the heavy model re-scores for an ambiguous probe
+EXITS = ("accepted", "rejected", "rescored")
+EXIT_COUNTERS = {name: REGISTRY.counter("unlockx_cascade_exits_total", "How cascade probes were decided", exit=name)
+                 for name in EXITS}
+
+
+def screen_matcher(model_name=SCREEN_MODEL, **kwargs):
+    """A FaceMatcher with the screening model's own cosine threshold."""
+    return FaceMatcher(threshold=MODEL_THRESHOLDS[model_name], **kwargs)
+
+
+class CascadeRecognizer(Recognizer):
+    """Screens every face with a light model and runs the heavy one only when unsure.
+
+    The aligned crop is embedded with ``screen_model`` and searched in
+    ``screen_matcher``. A nearest distance well inside that model's
+    threshold (``accept_ratio``) is accepted and one well outside it
+    (``reject_ratio``) rejected straight away. Anything in between is
+    embedded with the heavy model and re-scored against the shortlisted
+    users only. Distances the screen decides are rescaled to the heavy
+    model's threshold, so callers can keep comparing against
+    ``matcher.threshold``.
+
+    Users with heavy templates but none for the screen model (enrolled
+    before the cascade was set up) are always re-scored, and while there
+    are any, nothing is rejected by the screen alone. ``exits`` counts
+    how each probe was decided.
+    """
+
+    def __init__(self, matcher, screen_matcher, model_name=MODEL_NAME, screen_model=SCREEN_MODEL,
+                 detector_backend=DETECTOR_BACKEND, accept_ratio=ACCEPT_RATIO, reject_ratio=REJECT_RATIO,
+                 shortlist=SHORTLIST_USERS, **kwargs):
+        super().__init__(matcher, model_name, detector_backend, **kwargs)
+        self.screen = Recognizer(screen_matcher, screen_model, detector_backend)
+        self.accept_ratio = accept_ratio
+        self.reject_ratio = reject_ratio
+        self.shortlist = shortlist
+        self.unscreened = set()
+        self.exits = dict.fromkeys(EXITS, 0)
+
+    def update_coverage(self):
+        """Note which users the screen gallery is missing; call after loading either matcher."""
+        self.unscreened = self.matcher.users() - self.screen.matcher.users()
+        if self.unscreened:
+            logger.warning("%d users have no %s templates and are always re-scored with %s",
+                           len(self.unscreened), self.screen.model_name, self.model_name)
+
+    def _exit(self, name):
+        self.exits[name] += 1
+        EXIT_COUNTERS[name].inc()
+
+    def _rescale(self, result):
+        user, pose, distance = result
+        return user, pose, distance * self.matcher.threshold / self.screen.matcher.threshold
+
+    def match_face(self, face, timings=None):
+        """Closest (user, pose, distance) for an aligned crop, in the heavy model's terms, or None."""
+        start = time.perf_counter()
+        screen_probe = self.screen.embed(face)
+        embedded = time.perf_counter()
+        candidates = self.screen.matcher.search(screen_probe, k=FUSION_SHORTLIST)
+        screened = time.perf_counter()
+        if timings is not None:
+            timings["embedding"] = embedded - start
+            timings["matching"] = screened - embedded
+
+        threshold = self.screen.matcher.threshold
+        best = candidates[0] if candidates else None
+        if best is not None and best[2] <= threshold * self.accept_ratio:
+            self._exit("accepted")
+            return self._rescale(best)
+        if not self.unscreened and (best is None or best[2] >= threshold * self.reject_ratio):
+            self._exit("rejected")
+            return None if best is None else self._rescale(best)
+
+        self._exit("rescored")
+        users = list(dict.fromkeys(user for user, _, _ in candidates))[:self.shortlist]
+        if len(self.unscreened) > FUSION_SHORTLIST:
+            results = self.matcher.search(self.embed(face), k=1)  # Mostly unscreened; scan everything
+        else:
+            results = self.matcher.search_users(self.embed(face), users + sorted(self.unscreened), k=1)
+        if timings is not None:
+            timings["rescoring"] = time.perf_counter() - screened
+        return results[0] if results else None
+
+    def nearest(self, frame, timings=None):
+        """Return the closest (user, pose, distance) whatever the threshold, or None."""
+        start = time.perf_counter()
+        face = self.detect(frame)
+        if timings is not None:
+            timings["detection"] = time.perf_counter() - start
+        if face is None:
+            return None
+        return self.match_face(face, timings)
+
+    def enroll_templates(self, frame):
+        face, embedding = self.enroll_face(frame)
+        return face, {self.model_name: embedding, self.screen.model_name: self.screen.embed(face)}
+
+
+def backfill_screen_store(store_path=TEMPLATE_DIR, reference_dir=REFERENCE_DIR, screen_model=SCREEN_MODEL,
+                          detector_backend=DETECTOR_BACKEND):
+    """Embed every reference image with the screen model into its store; returns the count added.
+
+    Users that already have screen templates are skipped, so this can be
+    re-run after more users were enrolled without the cascade.
+    """
+    store = TemplateStore(model_store_path(store_path, screen_model))
+    matcher = FaceMatcher()
+    store.populate(matcher)
+    done = matcher.users()
+    recognizer = Recognizer(matcher, screen_model, detector_backend)
+    count = 0
+    skipped = 0
+    if not os.path.exists(reference_dir):
+        print(f"Reference directory '{reference_dir}' not found.")
+        return count
+    for user in sorted(os.listdir(reference_dir)):
+        user_dir = os.path.join(reference_dir, user)
+        if not os.path.isdir(user_dir) or user in done:
+            continue
+        for filename in sorted(os.listdir(user_dir)):
+            if not is_reference_image(filename):
+                continue
+            path = os.path.join(user_dir, filename)
+            frame = cv2.imread(path)
+            if frame is None:
+                skipped += 1
+                print(f"Could not read {path}")
+                continue
+            try:
+                embedding = recognizer.embed_reference(frame, is_face_crop(path, frame))
+            except FaceNotFound:
+                skipped += 1
+                print(f"No face in {path}")
+                continue
+            store.append(user, pose_from_filename(user, filename), embedding)
+            count += 1
+    if skipped:
+        print(f"Skipped {skipped} reference images.")
+    return count
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Prepare screening-model templates for the recognition cascade.")
+    parser.add_argument("--store", default=TEMPLATE_DIR)
+    parser.add_argument("--reference-dir", default=REFERENCE_DIR)
+    parser.add_argument("--screen-model", default=SCREEN_MODEL, choices=sorted(MODEL_THRESHOLDS))
+    parser.add_argument("--detector", default=DETECTOR_BACKEND)
+    args = parser.parse_args()
+    added = backfill_screen_store(args.store, args.reference_dir, args.screen_model, args.detector)
+    print(f"Added {added} {args.screen_model} templates.")
@@ -0,0 +1,156 @@
+import os
+import time
+import logging
+import threading
+import numpy as np
+from gallery import MODEL_NAME
+from matcher import FaceMatcher, FUSION_STRATEGIES
+from ann_index import IVFIndex
+from pipeline import Recognizer, DETECTOR_BACKEND
+from cascade import CascadeRecognizer, screen_matcher
+from template_store import TemplateStore, model_store_path
+from hotset import HotSet, HOT_SIZE, SNAPSHOT_FILE
+
+logger = logging.getLogger("unlockx")
+
+WARMUP_SIZE = (224, 224)  # VGG-Face input size
+
+
+class RecognitionEngine:
+    """In-process recognition backend used by the Qt pages.
+
+    start() imports DeepFace and loads the model weights off the GUI thread
+    and returns immediately; ``is_ready`` turns True once TensorFlow is
+    imported, the model is built and a dry-run inference has warmed up the
+    graph. Each step is logged relative to ``started_at`` (the process start)
+    so cold-start time to first possible unlock can be tracked.
+
+    With ``screen_model`` set, recognition runs as a cascade.CascadeRecognizer
+    and that model's templates are loaded from its own store next to the
+    main one. Otherwise, unless ``hot_size`` is 0, the users matched most
+    recently are searched first through a hotset.HotSet, snapshotted next
+    to the template store.
+
+    worker.InferenceWorker provides the same interface out of process.
+    """
+
+    def __init__(self, model_name=MODEL_NAME, detector_backend=DETECTOR_BACKEND, fusion=FUSION_STRATEGIES[0],
+                 started_at=None, screen_model=None, hot_size=HOT_SIZE):
+        self.model_name = model_name
+        self.detector_backend = detector_backend
+        self.fusion = fusion
+        self.screen_model = screen_model
+        self.started_at = time.perf_counter() if started_at is None else started_at
+        self.timings = {}
+        self.error = None
+        self.matcher = FaceMatcher(index=IVFIndex(), fusion=fusion)  # ANN kicks in for large galleries
+        if screen_model:
+            self.recognizer = CascadeRecognizer(self.matcher, screen_matcher(screen_model, index=IVFIndex(),
+                                                                             fusion=fusion),
+                                                model_name, screen_model, detector_backend)
+        else:
+            self.recognizer = Recognizer(self.matcher, model_name, detector_backend)
+        self.hot_set = None
+        if hot_size and not screen_model:
+            self.hot_set = self.recognizer.hot_set = HotSet(self.matcher, capacity=hot_size)
+        self._ready = threading.Event()
+        self._thread = None
+
+    @property
+    def is_ready(self):
+        return self._ready.is_set()
+
+    def wait(self, timeout=None):
+        """Block until the engine is ready; returns is_ready."""
+        return self._ready.wait(timeout)
+
+    def start(self):
+        if self._thread is None:
+            self._thread = threading.Thread(target=self.load, daemon=True)
+            self._thread.start()
+
+    def stop(self):
+        if self.hot_set is not None:
+            self.hot_set.save()
+
+    def reload(self, store):
+        """Load the enrolled templates from a TemplateStore."""
+        store.populate(self.matcher)
+        if self.screen_model:
+            TemplateStore(model_store_path(store.path, self.screen_model)).populate(self.recognizer.screen.matcher)
+            self.recognizer.update_coverage()
+        if self.hot_set is not None:
+            if self.hot_set.snapshot_path is None:
+                self.hot_set.snapshot_path = os.path.join(store.path, SNAPSHOT_FILE)
+                self.hot_set.load()
+            else:
+                self.hot_set.refresh()
+
+    def gallery_size(self):
+        return len(self.matcher)
+
+    @property
+    def threshold(self):
+        return self.matcher.threshold
+
+    def add_template(self, user, pose, embedding):
+        """Make a template stored elsewhere searchable at once, hot set included."""
+        self.matcher.add(user, pose, embedding)
+        if self.hot_set is not None:
+            self.hot_set.refresh_user(user)
+
+    def search(self, probe, k=1):
+        """Closest templates for an embedding computed elsewhere, e.g. by a batcher."""
+        return self.recognizer.search(probe, k)
+
+    def identify(self, frame, timings=None):
+        """Best (user, pose, distance) match for a frame, or None."""
+        return self.recognizer.identify(frame, timings)
+
+    def nearest(self, frame, timings=None):
+        """Closest (user, pose, distance) for a frame whatever the threshold, or None."""
+        return self.recognizer.nearest(frame, timings)
+
+    def embed(self, frame):
+        """Enrollment embedding of a captured frame; raises FaceNotFound."""
+        return self.recognizer.enroll(frame)
+
+    def enroll(self, frame):
+        """(face crop, {model name: embedding}) of a captured frame; raises FaceNotFound."""
+        return self.recognizer.enroll_templates(frame)
+
+    def _mark(self, name, since):
+        now = time.perf_counter()
+        self.timings[name] = now - since
+        logger.info("Engine %s took %.2f s (%.2f s since launch)", name,
+                    self.timings[name], now - self.started_at)
+        return now
+
+    def load(self):
+        """Import DeepFace, build the model and warm it up; blocks until done."""
+        try:
+            step = time.perf_counter()
+            from deepface import DeepFace
+            step = self._mark("import", step)
+
+            models = [self.model_name] + ([self.screen_model] if self.screen_model else [])
+            for model_name in models:
+                DeepFace.build_model(model_name)
+            step = self._mark("model_build", step)
+
+            dummy = np.zeros(WARMUP_SIZE + (3,), dtype=np.uint8)
+            DeepFace.extract_faces(img_path=dummy, detector_backend=self.detector_backend,
+                                   enforce_detection=False)
+            for model_name in models:
+                DeepFace.represent(img_path=dummy, model_name=model_name,
+                                   detector_backend="skip", enforce_detection=False)
+            self._mark("warm_up", step)
+        except Exception as e:
+            self.error = e
+            logger.error("Recognition engine failed to load: %s", e)
+            return
+
+        self.timings["first_unlock_possible"] = time.perf_counter() - self.started_at
+        logger.info("Recognition engine ready; first unlock possible %.2f s after launch",
+                    self.timings["first_unlock_possible"])
+        self._ready.set()
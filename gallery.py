@@ -0,0 +1,137 @@
+import os
+import argparse
+import numpy as np
+
+REFERENCE_DIR = "reference"
+MODEL_NAME = "VGG-Face"
+VERIFY_THRESHOLD = 0.68  # DeepFace's cosine distance cutoff for VGG-Face
+# DeepFace's cosine distance cutoffs for the other models a cascade may screen with
+MODEL_THRESHOLDS = {
+    "VGG-Face": VERIFY_THRESHOLD,
+    "Facenet": 0.40,
+    "Facenet512": 0.30,
+    "ArcFace": 0.68,
+    "SFace": 0.593,
+    "OpenFace": 0.10,
+    "GhostFaceNet": 0.65,
+}
+IMAGE_SUFFIX = "_Face.png"  # Full-frame captures; newer ones are face crops, see image_writer
+FRAME_MIN_WIDTH = 640  # Full-frame captures were at least VGA; a .png narrower than this is a crop
+IMAGE_MARKER = "_Face."
+REFERENCE_EXTENSIONS = (".png", ".jpg", ".webp")
+EMBEDDING_SUFFIX = "_Face.npy"
+POSES = ["Front View", "Left Side", "Right Side", "Upward", "Downward"]  # Captured at registration
+
+
+def reference_path(user, pose, reference_dir=REFERENCE_DIR, ext=IMAGE_SUFFIX[-4:]):
+    """Where the enrollment image of a user's pose is kept."""
+    return os.path.join(reference_dir, user, f"{user}_{pose}_Face{ext}")
+
+
+def is_reference_image(filename):
+    return IMAGE_MARKER in filename and filename.lower().endswith(REFERENCE_EXTENSIONS)
+
+
+def is_face_crop(image_path, image):
+    """Whether a reference image is an aligned face crop rather than a full camera frame.
+
+    Only the capture code before image_writer saved full frames, always as
+    .png; crops saved as .png are told apart by being narrower than a frame
+    or not landscape.
+    """
+    if not image_path.lower().endswith(IMAGE_SUFFIX[-4:]):
+        return True
+    height, width = image.shape[:2]
+    return width < FRAME_MIN_WIDTH or width <= height
+
+
+def embedding_path(image_path):
+    """Path of the embedding stored next to a reference image."""
+    return image_path[:image_path.rfind(IMAGE_MARKER)] + EMBEDDING_SUFFIX
+
+
+def save_embedding(image_path, embedding):
+    """Persist an embedding next to its reference image."""
+    np.save(embedding_path(image_path), np.asarray(embedding, dtype=np.float32))
+
+
+def pose_from_filename(user, filename):
+    """Extract the pose name from '<USER>_<pose>_Face.<ext>'."""
+    stem = filename[len(user) + 1:]
+    return stem[:stem.rfind(IMAGE_MARKER)]
+
+
+def load_gallery(reference_dir=REFERENCE_DIR, poses=None):
+    """Load stored embeddings as a list of (user, pose, embedding)."""
+    gallery = []
+    if not os.path.exists(reference_dir):
+        return gallery
+
+    for user in sorted(os.listdir(reference_dir)):
+        user_dir = os.path.join(reference_dir, user)
+        if not os.path.isdir(user_dir):
+            continue
+        for filename in sorted(os.listdir(user_dir)):
+            if not filename.endswith(EMBEDDING_SUFFIX):
+                continue
+            pose = pose_from_filename(user, filename)
+            if poses is not None and pose not in poses:
+                continue
+            embedding = np.load(os.path.join(user_dir, filename))
+            gallery.append((user, pose, embedding))
+    return gallery
+
+
+def backfill_embeddings(reference_dir=REFERENCE_DIR, force=False):
+    """Compute missing embeddings for reference images enrolled before they were stored.
+
+    Images are detected, aligned and embedded by pipeline.Recognizer, exactly
+    like login probes, so the templates are comparable with them.
+    """
+    import cv2
+    from pipeline import Recognizer  # Deferred: pipeline imports this module, and TensorFlow
+
+    if not os.path.exists(reference_dir):
+        print(f"Reference directory '{reference_dir}' not found.")
+        return 0
+
+    recognizer = Recognizer(matcher=None)
+    count = 0
+    skipped = 0
+    for user in sorted(os.listdir(reference_dir)):
+        user_dir = os.path.join(reference_dir, user)
+        if not os.path.isdir(user_dir):
+            continue
+        for filename in sorted(os.listdir(user_dir)):
+            if not is_reference_image(filename):
+                continue
+            image_path = os.path.join(user_dir, filename)
+            if not force and os.path.exists(embedding_path(image_path)):
+                continue
+            try:
+                frame = cv2.imread(image_path)
+                if frame is None:
+                    raise ValueError("could not read image")
+                save_embedding(image_path, recognizer.embed_reference(frame, is_face_crop(image_path, frame)))
+                count += 1
+                print(f"Embedded {image_path}")
+            except Exception as e:
+                skipped += 1
+                print(f"Failed to embed {image_path}: {str(e)}")
+    print(f"Backfilled {count} embeddings, skipped {skipped} images.")
+    return count
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Manage the UnlockX embedding gallery.")
+    parser.add_argument("--backfill", action="store_true",
+                        help="compute embeddings for existing reference images")
+    parser.add_argument("--force", action="store_true",
+                        help="recompute embeddings that already exist")
+    parser.add_argument("--reference-dir", default=REFERENCE_DIR)
+    args = parser.parse_args()
+
+    if args.backfill:
+        backfill_embeddings(args.reference_dir, force=args.force)
+    else:
+        parser.print_help()
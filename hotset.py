@@ -0,0 +1,194 @@
+import os
+import json
+import time
+import logging
+import itertools
+import threading
+import collections
+from matcher import FaceMatcher
+from metrics import REGISTRY
+
+logger = logging.getLogger("unlockx")
+
+HOT_SIZE = 256  # Users kept in the hot tier
+HOT_MAX_AGE = 7 * 24 * 3600.0  # Seconds since a user's last match before they leave the tier
+HOT_MARGIN = 0.75  # A hot match must be within threshold * this to skip the full gallery
+EVICTION_WINDOW = 8  # Least recently matched users among which the least frequent is evicted
+SNAPSHOT_FILE = "hotset.json"
+SAVE_INTERVAL = 60.0  # Seconds between snapshot writes while matches come in
+LOG_EVERY = 200  # Probes between hit-rate log lines
+SMOOTHING = 0.05  # Weight of the newest full-gallery search time in its running average
+
+HOT_HITS = REGISTRY.counter("unlockx_hot_set_hits_total", "Probes decided by the hot set alone")
+HOT_MISSES = REGISTRY.counter("unlockx_hot_set_misses_total", "Probes that fell back to the full gallery")
+
+
+class HotSet:
+    """Templates of recently matched users, searched before the full gallery.
+
+    search() scans the small hot matcher first and returns its result when
+    it is within ``margin`` of the threshold, stricter than the threshold
+    itself; otherwise the full ``gallery`` matcher decides. Every match
+    within the threshold moves its user to the front of the tier.
+
+    This is an early exit, not an exact search: a confident hot match is
+    returned without looking at cold users, even if one of them would be
+    closer still (e.g. a look-alike enrolled later). ``margin`` bounds how
+    confident that hot match must be, and so how rare such a miss is.
+
+    The tier holds at most ``capacity`` users: when full, the least
+    frequently matched of the EVICTION_WINDOW least recently matched users
+    is evicted, and users unmatched for ``max_age`` seconds expire. Only
+    user names, last-match times and hit counts are snapshotted to
+    ``snapshot_path``; templates are taken from the gallery again on load,
+    so deleted users or changed templates never come back stale.
+    """
+
+    def __init__(self, gallery, capacity=HOT_SIZE, max_age=HOT_MAX_AGE, margin=HOT_MARGIN, snapshot_path=None):
+        self.gallery = gallery
+        self.capacity = capacity
+        self.max_age = max_age
+        self.margin = margin
+        self.snapshot_path = snapshot_path
+        self.matcher = self._empty_matcher()
+        self.entries = collections.OrderedDict()  # user -> [last match (epoch seconds), matches]; oldest first
+        self.probes = 0
+        self.hits = 0
+        self.saved = 0.0  # Seconds of full-gallery matching avoided
+        self._full_time = None  # Running average of a full-gallery search
+        self._window = [0, 0]  # Probes and hits since the last log line
+        self._last_save = time.time()
+        self._lock = threading.Lock()
+
+    def _empty_matcher(self):
+        return FaceMatcher(metric=self.gallery.metric, threshold=self.gallery.threshold,
+                           fusion=self.gallery.fusion, vote_quorum=self.gallery.vote_quorum)
+
+    def __len__(self):
+        return len(self.entries)
+
+    def search(self, probe, k=1):
+        """FaceMatcher.search(), answered from the hot tier when it is confident enough."""
+        start = time.perf_counter()
+        results = self.matcher.search(probe, k=k) if self.entries else []
+        hot_time = time.perf_counter() - start
+        hit = bool(results) and results[0][2] <= self.gallery.threshold * self.margin
+        if not hit:
+            start = time.perf_counter()
+            results = self.gallery.search(probe, k=k)
+            full_time = time.perf_counter() - start
+        with self._lock:
+            self.probes += 1
+            self._window[0] += 1
+            if hit:
+                self.hits += 1
+                self._window[1] += 1
+                if self._full_time is not None:
+                    self.saved += max(0.0, self._full_time - hot_time)
+            else:
+                self._full_time = (full_time if self._full_time is None
+                                   else self._full_time + SMOOTHING * (full_time - self._full_time))
+            if self._window[0] >= LOG_EVERY:
+                self._log()
+        (HOT_HITS if hit else HOT_MISSES).inc()
+        if results and results[0][2] <= self.gallery.threshold:
+            self.record(results[0][0])
+        return results
+
+    def _log(self):
+        probes, hits = self._window
+        logger.info("Hot set: %d of the last %d probes decided by %d hot users (%.0f%%); "
+                    "%.1f ms of matching saved in total (%.2f ms per hit)",
+                    hits, probes, len(self.entries), 100.0 * hits / probes, self.saved * 1000.0,
+                    self.saved * 1000.0 / self.hits if self.hits else 0.0)
+        self._window = [0, 0]
+
+    def record(self, user, now=None):
+        """Note a match of ``user``, bringing their templates into the tier if needed."""
+        now = time.time() if now is None else now
+        with self._lock:
+            entry = self.entries.pop(user, None)
+            if entry is None:
+                templates = self.gallery.templates(user)
+                if not templates:
+                    return
+                for pose, embedding in templates:
+                    self.matcher.add(user, pose, embedding)
+                entry = [now, 0]
+            entry[0] = now
+            entry[1] += 1
+            self.entries[user] = entry
+            self._expire(now)
+            while len(self.entries) > self.capacity:
+                oldest = list(itertools.islice(self.entries.items(), EVICTION_WINDOW))
+                self._evict(min(oldest, key=lambda item: item[1][1])[0])
+            due = now - self._last_save >= SAVE_INTERVAL
+        if due:
+            self.save()
+
+    def _evict(self, user):
+        del self.entries[user]
+        self.matcher.remove_user(user)
+
+    def _expire(self, now):
+        while self.entries:
+            user, (last, _) = next(iter(self.entries.items()))
+            if now - last <= self.max_age:
+                break
+            self._evict(user)
+
+    def refresh_user(self, user):
+        """Re-read one hot user's templates after they were changed in the gallery."""
+        with self._lock:
+            if user not in self.entries:
+                return
+            self.matcher.remove_user(user)
+            templates = self.gallery.templates(user)
+            if not templates:
+                del self.entries[user]
+            for pose, embedding in templates:
+                self.matcher.add(user, pose, embedding)
+
+    def refresh(self):
+        """Re-read every hot user's templates after the gallery was reloaded."""
+        with self._lock:
+            self.matcher = self._empty_matcher()
+            for user in list(self.entries):
+                templates = self.gallery.templates(user)
+                if not templates:
+                    del self.entries[user]  # Deleted since
+                    continue
+                for pose, embedding in templates:
+                    self.matcher.add(user, pose, embedding)
+            self._expire(time.time())
+
+    def save(self):
+        """Write the snapshot of hot users, if a path is set."""
+        if not self.snapshot_path:
+            return
+        with self._lock:
+            snapshot = {"users": [[user, last, matches] for user, (last, matches) in self.entries.items()]}
+            self._last_save = time.time()
+        tmp = self.snapshot_path + ".tmp"
+        try:
+            with open(tmp, "w") as f:
+                json.dump(snapshot, f)
+            os.replace(tmp, self.snapshot_path)
+        except OSError as e:
+            logger.error("Could not save hot set to %s: %s", self.snapshot_path, e)
+
+    def load(self):
+        """Restore the hot users of the last snapshot from the current gallery."""
+        if not self.snapshot_path or not os.path.exists(self.snapshot_path):
+            return 0
+        try:
+            with open(self.snapshot_path) as f:
+                users = json.load(f)["users"]
+        except (OSError, ValueError, KeyError) as e:
+            logger.error("Ignoring unreadable hot set snapshot %s: %s", self.snapshot_path, e)
+            return 0
+        with self._lock:
+            self.entries = collections.OrderedDict((user, [last, matches]) for user, last, matches in users)
+        self.refresh()
+        logger.info("Hot set restored with %d users", len(self.entries))
+        return len(self.entries)
@@ -0,0 +1,109 @@
+import os
+import time
+import queue
+import logging
+import threading
+import cv2
+from metrics import REGISTRY, stage
+
+logger = logging.getLogger("unlockx")
+
+ENROLL_FORMAT = ".jpg"  # Format of saved enrollment face crops
+ENROLL_QUALITY = 90  # JPEG/WebP quality 0-100; for PNG, mapped to compression level
+FORMATS = (".jpg", ".png", ".webp")
+MAX_QUEUE = 32
+
+WRITE_ERRORS = REGISTRY.counter("unlockx_write_errors_total", "Background image or store writes that failed")
+
+
+def encode_params(fmt, quality):
+    """cv2.imencode parameters for a format and 0-100 quality."""
+    if fmt == ".jpg":
+        return [cv2.IMWRITE_JPEG_QUALITY, int(quality)]
+    if fmt == ".webp":
+        return [cv2.IMWRITE_WEBP_QUALITY, int(quality)]
+    if fmt == ".png":
+        return [cv2.IMWRITE_PNG_COMPRESSION, max(0, min(9, 9 - int(quality) // 11))]
+    raise ValueError(f"Unsupported image format: {fmt}")
+
+
+def write_durably(path, data):
+    """Write bytes via a temporary file, fsync and rename, so a crash leaves old or new."""
+    os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+    tmp = path + ".tmp"
+    with open(tmp, "wb") as f:
+        f.write(data)
+        f.flush()
+        os.fsync(f.fileno())
+    os.replace(tmp, path)
+
+
+class ImageWriter:
+    """Background queue that encodes and durably writes images off the caller's thread.
+
+    write_image() and call() return at once; jobs run in order on one
+    thread, and ``on_done(error)`` is called there once a job is on disk
+    (error is None on success). flush() waits for everything queued so far.
+    """
+
+    def __init__(self, fmt=ENROLL_FORMAT, quality=ENROLL_QUALITY, max_queue=MAX_QUEUE):
+        if fmt not in FORMATS:
+            raise ValueError(f"Unsupported image format: {fmt}")
+        self.fmt = fmt
+        self.quality = quality
+        self._queue = queue.Queue(max_queue)  # Blocks producers rather than growing without bound
+        self._thread = threading.Thread(target=self._run, daemon=True)
+        self._thread.start()
+
+    def write_image(self, path, image, on_done=None):
+        """Queue ``image`` to be encoded in the writer's format and written to ``path``.
+
+        The caller must not modify ``image`` afterwards.
+        """
+        params = encode_params(self.fmt, self.quality)
+
+        def job():
+            ok, data = cv2.imencode(self.fmt, image, params)
+            if not ok:
+                raise IOError(f"Could not encode {path}")
+            write_durably(path, data.tobytes())
+
+        self._queue.put((job, on_done))
+
+    def call(self, fn, on_done=None):
+        """Queue any other write, e.g. a template store append, behind the images."""
+        self._queue.put((fn, on_done))
+
+    def flush(self, timeout=None):
+        """Block until every job queued so far has finished; returns False on timeout."""
+        done = threading.Event()
+        self._queue.put((lambda: None, lambda error: done.set()))
+        return done.wait(timeout)
+
+    def stop(self):
+        self.flush(5.0)
+        self._queue.put(None)
+        self._thread.join(timeout=1.0)
+
+    def _run(self):
+        write_time = stage("background_write")
+        while True:
+            item = self._queue.get()
+            if item is None:
+                return
+            job, on_done = item
+            error = None
+            start = time.perf_counter()
+            try:
+                job()
+            except Exception as e:
+                error = e
+                WRITE_ERRORS.inc()
+                if on_done is None:
+                    logger.error("Background write failed: %s", e)
+            write_time.observe(time.perf_counter() - start)
+            if on_done is not None:
+                try:
+                    on_done(error)
+                except Exception as e:
+                    logger.error("Write completion callback failed: %s", e)
@@ -1,18 +1,48 @@
+import time
+STARTUP_TIME = time.perf_counter()  # Taken first so startup logs include import time
+
 import sys
-import cv2
 import os
+import argparse
+from concurrent.futures import ThreadPoolExecutor
 from PyQt5.QtWidgets import (
     QApplication, QStackedWidget, QWidget, QVBoxLayout, 
-    QPushButton, QLabel, QLineEdit, QMessageBox, QHBoxLayout
+    QPushButton, QLabel, QLineEdit, QMessageBox, QHBoxLayout, QGridLayout
 )
-from PyQt5.QtGui import QImage, QPixmap, QFont, QIcon
+from PyQt5.QtGui import QPixmap, QFont, QIcon
 from PyQt5.QtCore import QTimer, Qt, QSize
-from deepface import DeepFace
 import numpy as np
-import time
-import threading
+import logging
+from gallery import REFERENCE_DIR, POSES, MODEL_NAME, MODEL_THRESHOLDS, reference_path
+from template_store import TemplateStore, ModelStores
+from camera import CameraStream, add_source_arguments, sources_from_args
+from engine import RecognitionEngine
+from worker import InferenceWorker
+from matcher import FUSION_STRATEGIES
+from scheduler import VerificationScheduler
+from multicam import MultiCameraHost
+from image_writer import ImageWriter, ENROLL_FORMAT, ENROLL_QUALITY, FORMATS
+from metrics import span, summary, add_metrics_arguments, start_metrics_export
+from preview import PreviewLabel, PreviewRenderer
+from hotset import HOT_SIZE
+
+logger = logging.getLogger("unlockx")
+
+ENGINE_LOADING_TEXT = "Loading recognition engine..."
+OVERLAY_INTERVAL = 500  # ms between debug overlay refreshes
+STATUS_INTERVAL = 200  # ms between checks of the engine's loading state
+CAPTURE_POLL_INTERVAL = 30  # ms between checks for a finished enrollment capture
+
+
+class DebugOverlay(QLabel):
+    """Live metrics summary: counters, preview FPS and per-stage p50/p95 latencies."""
 
-REFERENCE_DIR = "reference"
+    def __init__(self):
+        super().__init__()
+        self.setStyleSheet("QLabel { font-family: monospace; font-size: 11px; color: #555555; }")
+        self.timer = QTimer()
+        self.timer.timeout.connect(lambda: self.setText(summary()))
+        self.timer.start(OVERLAY_INTERVAL)
 
 class MainWindow(QWidget):
     def __init__(self):
@@ -105,7 +135,7 @@ class MainWindow(QWidget):
         self.setLayout(layout)
 
 class RegisterPage(QWidget):
-    def __init__(self, stacked_widget):
+    def __init__(self, stacked_widget, store, camera, engine, writer):
         super().__init__()
         self.setWindowTitle("Register | UnlockX")  # Set window title
         self.setStyleSheet("""
@@ -139,10 +169,20 @@ class RegisterPage(QWidget):
             }
         """)
         self.stacked_widget = stacked_widget
-        self.camera = None  
+        self.store = store
+        self.templates = ModelStores(store)  # A cascade engine also returns screening-model templates
+        self.writer = writer  # Saves captures off the GUI thread
+        self.camera = camera  # Shared CameraStream, owned by main()
+        self.camera_active = False
+        self.engine = engine
         self.pose_index = 0
-        self.poses = ["Front View", "Left Side", "Right Side", "Upward", "Downward"]
+        self.poses = POSES
         self.user_last_name = ""
+        # Detection and embedding run off the GUI thread; the timer applies the result
+        self.enroller = ThreadPoolExecutor(max_workers=1, thread_name_prefix="enroll")
+        self.capture = None  # (user, pose, Future) of the capture being processed
+        self.capture_timer = QTimer()
+        self.capture_timer.timeout.connect(self.finish_capture)
 
         layout = QVBoxLayout()
         layout.setSpacing(10)  # Set consistent spacing between widgets
@@ -189,7 +229,7 @@ class RegisterPage(QWidget):
         # Pose Label and Image Label
         self.pose_label = QLabel("Pose: Not Started", alignment=Qt.AlignCenter)
         self.pose_label.setContentsMargins(0, 5, 0, 5)  # Reduce vertical margins
-        self.image_label = QLabel()
+        self.image_label = PreviewLabel()
         self.image_label.setFixedSize(500, 350)  # More reasonable size
         self.image_label.setAlignment(Qt.AlignCenter)
 
@@ -205,8 +245,7 @@ class RegisterPage(QWidget):
 
         self.setLayout(layout)
 
-        self.timer = QTimer()
-        self.timer.timeout.connect(self.update_frame)
+        self.preview = PreviewRenderer(self.image_label, self.camera)
 
     def save_name(self):
         """Save user name and create a folder based on last name."""
@@ -235,48 +274,80 @@ class RegisterPage(QWidget):
         self.stacked_widget.setCurrentIndex(0)  # Return to main page
 
     def start_camera(self):
-        if self.camera is None:
-            self.camera = cv2.VideoCapture(0)  # Initialize the camera
-            self.camera.set(cv2.CAP_PROP_FRAME_WIDTH, 1280)  # Set max width
-            self.camera.set(cv2.CAP_PROP_FRAME_HEIGHT, 720)  # Set max height
-            self.timer.start(30)  # Refresh every 30ms
+        if not self.camera_active:
+            self.camera.start()  # Opens the device only the first time
+            self.camera_active = True
+            self.preview.start()
 
     def stop_camera(self):
-        if self.camera is not None:
-            self.timer.stop()
-            self.camera.release()
-            self.camera = None  
-
-    def update_frame(self):
-        if self.camera is not None:
-            ret, frame = self.camera.read()
-            if ret:
-                frame = cv2.resize(frame, (640, 480))  # Resize to fit QLabel
-                frame = cv2.cvtColor(frame, cv2.COLOR_BGR2RGB)
-                height, width, channel = frame.shape
-                bytes_per_line = 3 * width
-                q_img = QImage(frame.data, width, height, bytes_per_line, QImage.Format_RGB888)
-                self.image_label.setPixmap(QPixmap.fromImage(q_img))
+        self.capture_timer.stop()
+        self.capture = None  # A capture still being processed is dropped
+        if self.camera_active:
+            self.preview.stop()
+            self.camera_active = False
 
     def capture_image(self):
-        if self.camera is None:
+        if not self.camera_active:
             print("Camera is not initialized.")
             return
+        if not self.engine.is_ready:
+            QMessageBox.information(self, "Please Wait", "The recognition engine is still loading. Try again in a moment.")
+            return
+        if self.capture is not None:
+            return  # Still processing the previous capture
+
+        with self.camera.hold() as (seq, frame):
+            if frame is None:
+                return
+            frame = frame.copy()  # The ring slot is reused once hold() ends
+
+        user, pose_name = self.user_last_name, self.poses[self.pose_index]
+        self.capture_button.setEnabled(False)
+        self.pose_label.setText(f"Pose: {pose_name} (processing...)")
+        self.capture = (user, pose_name, self.enroller.submit(self.enroll, frame))
+        self.capture_timer.start(CAPTURE_POLL_INTERVAL)
+
+    def enroll(self, frame):
+        """Runs on the enroll thread: detection, alignment and embedding of a capture."""
+        with span("capture_enroll"):
+            return self.engine.enroll(frame)
+
+    def finish_capture(self):
+        """Save a processed capture and move on to the next pose, on the GUI thread."""
+        user, pose_name, future = self.capture
+        if not future.done():
+            return
+        self.capture_timer.stop()
+        self.capture = None
+        self.capture_button.setEnabled(True)
+        try:
+            face, embeddings = future.result()
+        except Exception as e:
+            # Keep the user on this pose so they can try again
+            self.pose_label.setText(f"Pose: {pose_name}")
+            QMessageBox.warning(self, "Capture Error", f"Could not capture face: {str(e)}")
+            return
 
-        ret, frame = self.camera.read()
-        if ret:
-            user_dir = os.path.join(REFERENCE_DIR, self.user_last_name)
-            pose_name = self.poses[self.pose_index]  # Get the current pose name
-            filename = os.path.join(user_dir, f"{self.user_last_name}_{pose_name}_Face.png")  # Save as .png
-            cv2.imwrite(filename, frame)
+        # Encoding, writing and fsyncing happen on the writer thread, in order
+        path = reference_path(user, pose_name, ext=self.writer.fmt)
+        self.writer.write_image(path, face, lambda error: self.saved(path, error))
+        self.writer.call(lambda: self.templates.append(user, pose_name, embeddings),
+                         lambda error: self.saved(f"{user} {pose_name} template", error))
 
-            self.pose_index += 1
+        self.pose_index += 1
 
-            if self.pose_index < len(self.poses):
-                self.pose_label.setText(f"Pose: {self.poses[self.pose_index]}")
-            else:
-                self.stop_camera()
-                self.stacked_widget.setCurrentIndex(0)
+        if self.pose_index < len(self.poses):
+            self.pose_label.setText(f"Pose: {self.poses[self.pose_index]}")
+        else:
+            self.stop_camera()
+            self.stacked_widget.setCurrentIndex(0)
+
+    def saved(self, what, error):
+        """Called from the writer thread once a capture is on disk."""
+        if error is None:
+            logger.info("Saved %s", what)
+        else:
+            logger.error("Could not save %s: %s", what, error)
 
     def showEvent(self, event):
         super().showEvent(event)
@@ -286,7 +357,7 @@ class RegisterPage(QWidget):
         super().hideEvent(event)
 
 class LoginPage(QWidget):
-    def __init__(self, stacked_widget):
+    def __init__(self, stacked_widget, store, camera, engine, writer):
         super().__init__()
         self.setWindowTitle("Login | UnlockX")  # Set window title
         self.setStyleSheet("""
@@ -330,10 +401,16 @@ class LoginPage(QWidget):
             }
         """)
         self.stacked_widget = stacked_widget
+        self.store = store
+        self.writer = writer
         self.face_match = False
-        self.camera = None
-        self.last_detection_time = 0
+        self.camera = camera  # Shared CameraStream, owned by main()
+        self.camera_active = False
+        self.engine = engine
+        self.engine_loading = False
         self.matched_user = None
+        # Only runs while the login camera is on; idle frames never reach the engine
+        self.scheduler = VerificationScheduler(camera, engine, self.on_match)
 
         layout = QVBoxLayout()
         layout.setAlignment(Qt.AlignCenter)  # Center all content vertically
@@ -350,7 +427,7 @@ class LoginPage(QWidget):
         self.status_label.setAlignment(Qt.AlignCenter)
         self.status_label.setObjectName("status_label")
 
-        self.image_label = QLabel()
+        self.image_label = PreviewLabel()
         self.image_label.setFixedSize(640, 480)  # Standard 4:3 aspect ratio
         self.image_label.setAlignment(Qt.AlignCenter)
         self.image_label.setStyleSheet("""
@@ -385,100 +462,48 @@ class LoginPage(QWidget):
 
         self.setLayout(layout)
 
+        self.preview = PreviewRenderer(self.image_label, self.camera)
         self.timer = QTimer()
-        self.timer.timeout.connect(self.update_frame)
-
-        self.lock = threading.Lock()
-        self.running = True
-        self.verification_thread = threading.Thread(target=self.verify_face, daemon=True)
-        self.verification_thread.start()
-
-    def verify_face(self):
-        while self.running:
-            if self.camera is None:
-                time.sleep(0.1)
-                continue
-
-            current_time = time.time()
-            if current_time - self.last_detection_time < 1.0:  # Check every second
-                time.sleep(0.1)
-                continue
-
-            self.last_detection_time = current_time
-
-            ret, frame = self.camera.read()
-            if not ret:
-                continue
-
-            try:
-                # Check if there are any directories in the reference folder
-                if not os.path.exists(REFERENCE_DIR):
-                    continue
-
-                user_folders = [f for f in os.listdir(REFERENCE_DIR) 
-                              if os.path.isdir(os.path.join(REFERENCE_DIR, f))]
-
-                for user_folder in user_folders:
-                    user_dir = os.path.join(REFERENCE_DIR, user_folder)
-                    reference_images = [f for f in os.listdir(user_dir) 
-                                     if f.endswith('_Front View_Face.png')]
+        self.timer.timeout.connect(self.update_status)
 
-                    if not reference_images:
-                        continue
-
-                    reference_image_path = os.path.join(user_dir, reference_images[0])
-                    
-                    result = DeepFace.verify(
-                        img1_path=frame,
-                        img2_path=reference_image_path,
-                        enforce_detection=False,
-                        model_name='VGG-Face'
-                    )
-
-                    if result['verified']:
-                        self.matched_user = user_folder
-                        self.status_label.setText(f"Hello, {self.matched_user}")
-                        return  # Exit thread after successful match
-
-            except Exception as e:
-                print(f"Verification error: {str(e)}")
-
-            time.sleep(0.1)
+    def on_match(self, match):
+        """Called from the scheduler thread once a face is recognised; update_status shows it."""
+        self.matched_user = match[0]
 
     def start_login_camera(self):
-        if self.camera is None:
-            self.camera = cv2.VideoCapture(0)
-            self.camera.set(cv2.CAP_PROP_FRAME_WIDTH, 640)
-            self.camera.set(cv2.CAP_PROP_FRAME_HEIGHT, 480)
-            self.timer.start(30)
-            self.status_label.setText("Looking for face...")
+        if not self.camera_active:
+            self.camera.start()  # Opens the device only the first time
+            self.camera_active = True
+            self.preview.start()
+            self.timer.start(STATUS_INTERVAL)
+            self.engine_loading = not self.engine.is_ready
+            self.status_label.setText(ENGINE_LOADING_TEXT if self.engine_loading else "Looking for face...")
             self.matched_user = None
-            self.running = True
-            if not self.verification_thread.is_alive():
-                self.verification_thread = threading.Thread(target=self.verify_face, daemon=True)
-                self.verification_thread.start()
+            self.writer.flush()  # Pick up enrollments still being written
+            self.engine.reload(self.store)
+            self.scheduler.start()
 
     def stop_camera(self):
-        self.running = False
-        if self.camera is not None:
+        self.scheduler.stop()
+        if self.camera_active:
+            self.preview.stop()
             self.timer.stop()
-            self.camera.release()
-            self.camera = None
-        if self.verification_thread.is_alive():
-            self.verification_thread.join(timeout=1.0)
-
-    def update_frame(self):
-        """Capture and update the webcam feed in QLabel."""
-        if self.camera is not None:
-            ret, frame = self.camera.read()
-            if ret:
-                # Resize frame to match the image_label size
-                frame = cv2.resize(frame, (640, 480))
-                frame = cv2.cvtColor(frame, cv2.COLOR_BGR2RGB)
-                height, width, channel = frame.shape
-                bytes_per_line = 3 * width
-                q_img = QImage(frame.data, width, height, bytes_per_line, QImage.Format_RGB888)
-                self.image_label.setPixmap(QPixmap.fromImage(q_img))
+            self.camera_active = False
+
+    def update_status(self):
+        """Follow the engine's loading state and show matches; the preview renders itself."""
+        if self.matched_user is not None:
+            text = f"Hello, {self.matched_user}"
+            if self.status_label.text() != text:
+                self.status_label.setText(text)
+            return
+        if self.engine_loading:
+            if self.engine.error is not None:
+                self.engine_loading = False
+                self.status_label.setText("Recognition engine failed to load")
+            elif self.engine.is_ready:
+                self.engine_loading = False
+                self.status_label.setText("Looking for face...")
 
     def go_back(self):
         """Handle back button click"""
@@ -499,8 +524,129 @@ class LoginPage(QWidget):
         self.stop_camera()
         super().hideEvent(event)
 
+class MultiCameraPage(QWidget):
+    """One tile per door: a small preview and that door's status line."""
+
+    def __init__(self, host, store):
+        super().__init__()
+        self.setWindowTitle("Doors | UnlockX")
+        self.setStyleSheet("""
+            QWidget {
+                background-color: #f0f0f0;
+            }
+            QLabel {
+                color: #333333;
+                font-size: 16px;
+            }
+            #status_label {
+                font-size: 20px;
+                color: #2196F3;
+                font-weight: bold;
+            }
+        """)
+        self.host = host
+        self.store = store
+        self.host.on_status = self.set_status
+        self.status_texts = [ENGINE_LOADING_TEXT] * len(host.cameras)
+
+        layout = QGridLayout()
+        columns = 2 if len(host.cameras) <= 4 else 3
+        self.image_labels, self.status_labels = [], []
+        for i in range(len(host.cameras)):
+            tile = QVBoxLayout()
+            image_label = PreviewLabel()
+            image_label.setFixedSize(400, 300)
+            image_label.setAlignment(Qt.AlignCenter)
+            status_label = QLabel(ENGINE_LOADING_TEXT)
+            status_label.setAlignment(Qt.AlignCenter)
+            status_label.setObjectName("status_label")
+            tile.addWidget(QLabel(f"Door {i + 1}", alignment=Qt.AlignCenter))
+            tile.addWidget(image_label, alignment=Qt.AlignCenter)
+            tile.addWidget(status_label)
+            layout.addLayout(tile, i // columns, i % columns)
+            self.image_labels.append(image_label)
+            self.status_labels.append(status_label)
+        self.setLayout(layout)
+
+        self.previews = [PreviewRenderer(label, camera, door=i + 1)
+                         for i, (label, camera) in enumerate(zip(self.image_labels, host.cameras))]
+        self.timer = QTimer()
+        self.timer.timeout.connect(self.update_statuses)
+
+    def set_status(self, stream_id, text):
+        """Called from the host's threads; the GUI timer applies it."""
+        self.status_texts[stream_id] = text
+
+    def start(self):
+        self.host.start(self.store)
+        for preview in self.previews:
+            preview.start()
+        self.timer.start(STATUS_INTERVAL)
+
+    def update_statuses(self):
+        for label, text in zip(self.status_labels, self.status_texts):
+            if label.text() != text:
+                label.setText(text)
+
+def parse_args(argv):
+    parser = argparse.ArgumentParser(description="UnlockX face recognition kiosk.")
+    add_source_arguments(parser)
+    parser.add_argument("--worker-process", action="store_true",
+                        help="run detection, embedding and matching in a separate process")
+    parser.add_argument("--fusion", default=FUSION_STRATEGIES[0], choices=FUSION_STRATEGIES,
+                        help="how each user's pose templates are combined when matching")
+    parser.add_argument("--enroll-format", default=ENROLL_FORMAT, choices=FORMATS,
+                        help="image format of saved enrollment face crops")
+    parser.add_argument("--enroll-quality", type=int, default=ENROLL_QUALITY,
+                        help="JPEG/WebP quality (0-100) of saved enrollment face crops")
+    parser.add_argument("--screen-model", choices=sorted(MODEL_THRESHOLDS),
+                        help="screen faces with this lighter model first and run VGG-Face only when unsure (single camera only)")
+    parser.add_argument("--hot-size", type=int, default=HOT_SIZE,
+                        help="recently matched users searched before the full gallery (0 disables)")
+    add_metrics_arguments(parser)
+    parser.add_argument("--debug-overlay", action="store_true",
+                        help="show live stage latencies and counters under the preview")
+    # Leave anything we don't know about (e.g. Qt's own flags) to QApplication
+    args, qt_argv = parser.parse_known_args(argv[1:])
+    return args, argv[:1] + qt_argv
+
 def main():
-    app = QApplication(sys.argv)
+    logging.basicConfig(level=logging.INFO, format="%(asctime)s %(levelname)s %(name)s: %(message)s")
+    args, qt_argv = parse_args(sys.argv)
+    app = QApplication(qt_argv)
+
+    sources = sources_from_args(args)
+    start_metrics_export(args)
+
+    if args.screen_model and len(sources) > 1:
+        # Doors share one batched heavy-model pass; the cascade only serves a single camera
+        logger.warning("--screen-model serves a single camera; doors use %s alone", MODEL_NAME)
+        args.screen_model = None
+
+    # Load DeepFace/TensorFlow in the background so the window appears at once
+    if args.worker_process and len(sources) == 1:
+        engine = InferenceWorker(fusion=args.fusion, started_at=STARTUP_TIME, screen_model=args.screen_model,
+                                 hot_size=args.hot_size)
+    else:
+        if args.worker_process:
+            logger.warning("--worker-process serves a single camera; using the in-process engine")
+        engine = RecognitionEngine(fusion=args.fusion, started_at=STARTUP_TIME, screen_model=args.screen_model,
+                                   hot_size=args.hot_size)
+    engine.start()
+    app.aboutToQuit.connect(engine.stop)
+
+    if len(sources) > 1:
+        # Several doors from one process: one model, batched across the streams
+        host = MultiCameraHost(sources, engine)
+        app.aboutToQuit.connect(host.stop)
+        doors = MultiCameraPage(host, TemplateStore())
+        if args.debug_overlay:
+            doors.layout().addWidget(DebugOverlay(), doors.layout().rowCount(), 0, 1, -1)
+        doors.start()
+        doors.show()
+        logger.info("Window shown %.2f s after launch", time.perf_counter() - STARTUP_TIME)
+        sys.exit(app.exec_())
+
     app.setWindowIcon(QIcon(r'logo\unlockx.png')) # Set application icon
     stacked_widget = QStackedWidget()
     stacked_widget.setFixedSize(1366, 768)  # Set the constant window size
@@ -514,9 +660,18 @@ def main():
         elif isinstance(widget, LoginPage):
             stacked_widget.setWindowTitle("Login | UnlockX")
 
+    store = TemplateStore()  # Shared so new enrollments reach the login matcher
+    camera = CameraStream(sources[0])  # One capture thread serves every page
+    app.aboutToQuit.connect(camera.stop)
+    writer = ImageWriter(args.enroll_format, args.enroll_quality)
+    app.aboutToQuit.connect(writer.stop)  # Finishes pending writes before exit
+
     main_window = MainWindow()
-    register_page = RegisterPage(stacked_widget)
-    login_page = LoginPage(stacked_widget)
+    register_page = RegisterPage(stacked_widget, store, camera, engine, writer)
+    login_page = LoginPage(stacked_widget, store, camera, engine, writer)
+    if args.debug_overlay:
+        for page in (register_page, login_page):
+            page.layout().addWidget(DebugOverlay())
 
     stacked_widget.addWidget(main_window)
     stacked_widget.addWidget(register_page)
@@ -532,6 +687,7 @@ def main():
 
     stacked_widget.setCurrentWidget(main_window)
     stacked_widget.show()
+    logger.info("Window shown %.2f s after launch", time.perf_counter() - STARTUP_TIME)
 
     sys.exit(app.exec_())
 
@@ -0,0 +1,506 @@
+import os
+import logging
+import threading
+import numpy as np
+from gallery import VERIFY_THRESHOLD
+
+logger = logging.getLogger("unlockx")
+
+# DeepFace's VGG-Face cutoffs for the metrics that can be derived from a dot
+# product of L2-normalized vectors.
+THRESHOLDS = {
+    "cosine": VERIFY_THRESHOLD,
+    "euclidean_l2": 1.17,
+}
+
+# Below this many templates an exact scan is fast enough to skip the ANN index.
+ANN_MIN_TEMPLATES = 50000
+
+# How a user's pose templates are combined into one score: the best single
+# pose, the normalized mean of all poses, or a vote in which at least
+# VOTE_QUORUM poses (or all of them, for users with fewer) must be within
+# the threshold and users are ranked by the share of poses that agree.
+FUSION_STRATEGIES = ("max", "centroid", "vote")
+VOTE_QUORUM = 2
+# Templates fetched from the ANN index whose users are then fused exactly.
+FUSION_SHORTLIST = 64
+
+
+def l2_normalize(x):
+    """L2-normalize a vector or the rows of a matrix as float32."""
+    x = np.asarray(x, dtype=np.float32)
+    norms = np.linalg.norm(x, axis=-1, keepdims=True)
+    return x / np.maximum(norms, 1e-12)
+
+
+def _user_names(labels):
+    """Array of the user of every label; store-backed labels provide it directly."""
+    if hasattr(labels, "users"):
+        return labels.users()
+    return np.array([user for user, _ in labels], dtype=object)
+
+
+def top_k(scores, k):
+    """Indices of the k largest scores, best first."""
+    k = min(k, scores.shape[0])
+    if k < scores.shape[0]:
+        top = np.argpartition(-scores, k - 1)[:k]
+    else:
+        top = np.arange(scores.shape[0])
+    return top[np.argsort(-scores[top])]
+
+
+class FaceMatcher:
+    """1:N matcher over L2-normalized float32 embedding matrices.
+
+    Templates live in a read-only base matrix (which may be a memmap from the
+    template store, used without copying) plus a growable in-memory tail for
+    enrollments added since. An optional ANN index (see ann_index.IVFIndex) is
+    used for galleries of at least ``ann_min_size`` templates once it has been
+    built in the background; until then searches fall back to the exact scan.
+
+    Every pose a user enrolled is a template. With ``fusion="max"`` results
+    are individual templates; the other strategies rank users, still scoring
+    all templates with one matrix-vector product and combining them per user
+    with bincount/reduceat over a cached row-to-user grouping.
+    """
+
+    def __init__(self, metric="cosine", threshold=None, index=None, ann_min_size=ANN_MIN_TEMPLATES,
+                 fusion="max", vote_quorum=VOTE_QUORUM):
+        if metric not in THRESHOLDS:
+            raise ValueError(f"Unsupported distance metric: {metric}")
+        if fusion not in FUSION_STRATEGIES:
+            raise ValueError(f"Unsupported fusion strategy: {fusion}")
+        self.metric = metric
+        self.threshold = THRESHOLDS[metric] if threshold is None else threshold
+        self.fusion = fusion
+        self.vote_quorum = vote_quorum
+        self._base = None
+        self._base_labels = []
+        self._base_alive = None  # Row mask, allocated once a base row is removed
+        self._matrix = None
+        self._size = 0
+        self._tail_labels = []
+        self.index_template = index
+        self.ann_min_size = ann_min_size
+        self.index = None  # Set once a background build or load completes
+        self._index_thread = None
+        self._groups = None  # Row-to-user grouping for fusion, rebuilt after changes
+        self._journals = []  # Per index job: changes made while it runs, replayed when it finishes
+        self._version = 0  # Bumped when set_embeddings() replaces the whole gallery
+        self.source = None  # Set by TemplateStore.populate() to what was loaded, for incremental reloads
+        self._lock = threading.Lock()
+
+    @classmethod
+    def from_gallery(cls, gallery, **kwargs):
+        """Build a matcher from a list of (user, pose, embedding)."""
+        matcher = cls(**kwargs)
+        matcher.set_gallery(gallery)
+        return matcher
+
+    def __len__(self):
+        if self._base is None:
+            base = 0
+        elif self._base_alive is None:
+            base = self._base.shape[0]
+        else:
+            base = int(np.count_nonzero(self._base_alive))
+        return base + self._size
+
+    def _live(self):
+        """Yield ((user, pose), row) for every template that has not been removed."""
+        if self._base is not None:
+            for i, label in enumerate(self._base_labels):
+                if self._base_alive is None or self._base_alive[i]:
+                    yield label, self._base[i]
+        for i in range(self._size):
+            yield self._tail_labels[i], self._matrix[i]
+
+    @property
+    def labels(self):
+        """(user, pose) of every live template."""
+        return [label for label, _ in self._live()]
+
+    @property
+    def matrix(self):
+        """A copy of the live templates, one normalized row each."""
+        rows = [row for _, row in self._live()]
+        if not rows:
+            return np.empty((0, 0), dtype=np.float32)
+        return np.stack(rows)
+
+    def set_gallery(self, gallery):
+        """Replace all templates with a list of (user, pose, embedding)."""
+        labels = [(user, pose) for user, pose, _ in gallery]
+        embeddings = np.stack([e for _, _, e in gallery]) if gallery else None
+        self.set_embeddings(labels, embeddings)
+
+    def set_embeddings(self, labels, embeddings, normalized=False, build_index=True):
+        """Replace all templates with (user, pose) labels and an (n, d) matrix.
+
+        With ``normalized=True`` a float32 matrix is used in place, so a
+        memmapped store is never copied into memory. With ``build_index``
+        false, a large gallery is left for the caller to index.
+        """
+        if embeddings is not None and embeddings.shape[0] == 0:
+            labels, embeddings = [], None  # An empty store has no dimension yet
+        if embeddings is not None and not (normalized and embeddings.dtype == np.float32):
+            embeddings = l2_normalize(embeddings)
+        with self._lock:
+            self._base = embeddings
+            self._base_labels = labels
+            self._base_alive = None
+            self._matrix = None
+            self._size = 0
+            self._tail_labels = []
+            self._groups = None
+            self.index = None
+            self._version += 1
+            self.source = None
+        if build_index and self.needs_index():
+            self.build_index()
+
+    @property
+    def is_indexing(self):
+        """Whether an index build or load is in progress."""
+        with self._lock:
+            return bool(self._journals)
+
+    def needs_index(self):
+        """Whether an ANN index is configured and the gallery is large enough to use it."""
+        return self.index_template is not None and len(self) >= self.ann_min_size
+
+    def add(self, user, pose, embedding):
+        """Append one template, growing the in-memory tail geometrically."""
+        row = l2_normalize(embedding)
+        with self._lock:
+            if self._matrix is None:
+                self._matrix = np.empty((16, row.shape[0]), dtype=np.float32)
+            elif self._size == self._matrix.shape[0]:
+                grown = np.empty((self._size * 2, self._matrix.shape[1]), dtype=np.float32)
+                grown[:self._size] = self._matrix[:self._size]
+                self._matrix = grown
+            self._matrix[self._size] = row
+            self._tail_labels.append((user, pose))
+            self._size += 1
+            self._groups = None
+            if self.index is not None:
+                self.index.add(user, pose, row)
+            for changes in self._journals:
+                changes.append((user, pose, row))
+
+    def remove_user(self, user):
+        """Delete every template of a user; returns the number removed."""
+        with self._lock:
+            removed = 0
+            if self._base is not None:
+                rows = [i for i, (u, _) in enumerate(self._base_labels) if u == user]
+                if rows:
+                    if self._base_alive is None:
+                        self._base_alive = np.ones(self._base.shape[0], dtype=bool)
+                    removed += int(np.count_nonzero(self._base_alive[rows]))
+                    self._base_alive[rows] = False
+
+            keep = [i for i, (u, _) in enumerate(self._tail_labels) if u != user]
+            if len(keep) < self._size:
+                removed += self._size - len(keep)
+                self._matrix[:len(keep)] = self._matrix[keep]
+                self._tail_labels = [self._tail_labels[i] for i in keep]
+                self._size = len(keep)
+
+            if removed:
+                self._groups = None
+                if self.index is not None:
+                    self.index.remove_user(user)
+                for changes in self._journals:
+                    changes.append((user, None, None))
+        return removed
+
+    def build_index(self, background=True, on_ready=None, save_path=None):
+        """(Re)build the ANN index without blocking the caller, saving it to ``save_path`` if given."""
+        if self.index_template is None:
+            raise RuntimeError("FaceMatcher has no ANN index configured")
+        # Only references are taken under the lock; the base (possibly a
+        # memmap) is read a chunk at a time by the build, outside it
+        with self._lock:
+            job = self._start_index_job()
+            blocks = []
+            if self._base is not None:
+                rows = None if self._base_alive is None else np.flatnonzero(self._base_alive)
+                blocks.append((self._base_labels, self._base, rows))
+            if self._size:
+                # Small, and compacted in place by remove_user(), so copied
+                blocks.append((list(self._tail_labels), self._matrix[:self._size].copy(), None))
+
+        def build():
+            index = self.index_template.clone_empty()
+            index.build_blocks(blocks)
+            if save_path:
+                tmp = save_path + ".tmp.npz"
+                try:
+                    index.save(tmp)
+                    os.replace(tmp, save_path)
+                except OSError as e:
+                    logger.error("Could not save ANN index to %s: %s", save_path, e)
+            return index
+
+        return self._run_index_job(job, build, background, on_ready)
+
+    def load_index(self, path, background=True, on_ready=None):
+        """Load a saved ANN index without blocking the caller."""
+        if self.index_template is None:
+            raise RuntimeError("FaceMatcher has no ANN index configured")
+        with self._lock:
+            job = self._start_index_job()
+        return self._run_index_job(job, lambda: type(self.index_template).load(path), background, on_ready)
+
+    def _run_index_job(self, job, make_index, background, on_ready):
+        def run():
+            index = None
+            try:
+                index = make_index()
+            except Exception as e:
+                logger.error("ANN index error: %s", e)
+            self._finish_index_job(job, index)
+            if on_ready is not None:
+                on_ready(self.index)
+
+        if not background:
+            run()
+            return None
+        self._index_thread = threading.Thread(target=run, daemon=True)
+        self._index_thread.start()
+        return self._index_thread
+
+    def _start_index_job(self):
+        """Journal changes from now on; call with the lock held."""
+        changes = []
+        self._journals.append(changes)
+        return self._version, changes
+
+    def _finish_index_job(self, job, index):
+        """Swap in a finished index (None if the job failed), replaying changes made meanwhile.
+
+        If the whole gallery was replaced in the meantime the index is
+        dropped; whoever replaced it indexes the new gallery.
+        """
+        version, changes = job
+        with self._lock:
+            self._journals.remove(changes)
+            if index is None or version != self._version:
+                return
+            for user, pose, row in changes:
+                if pose is None:
+                    index.remove_user(user)
+                else:
+                    index.add(user, pose, row)
+            self.index = index
+
+    def _row(self, i):
+        base_size = 0 if self._base is None else self._base.shape[0]
+        return self._base[i] if i < base_size else self._matrix[i - base_size]
+
+    def _label(self, i):
+        base_size = 0 if self._base is None else self._base.shape[0]
+        return self._base_labels[i] if i < base_size else self._tail_labels[i - base_size]
+
+    def _grouping(self):
+        """Map every row (base then tail) to a user number; removed rows map to len(users).
+
+        ``order`` sorts the rows by user, and user u's rows are
+        ``order[starts[u]:ends[u]]``. Called with the lock held.
+        """
+        if self._groups is None:
+            parts, alive = [], []
+            if self._base is not None:
+                parts.append(np.asarray(_user_names(self._base_labels), dtype=object))
+                alive.append(np.ones(self._base.shape[0], dtype=bool) if self._base_alive is None
+                             else self._base_alive)
+            if self._size:
+                parts.append(np.array([user for user, _ in self._tail_labels], dtype=object))
+                alive.append(np.ones(self._size, dtype=bool))
+            names = np.concatenate(parts) if parts else np.empty(0, dtype=object)
+            alive = np.concatenate(alive) if alive else np.empty(0, dtype=bool)
+
+            users, inverse = np.unique(names[alive].astype(str), return_inverse=True)
+            row_user = np.full(names.shape[0], len(users), dtype=np.intp)
+            row_user[alive] = inverse
+            order = np.argsort(row_user, kind="stable")
+            starts = np.searchsorted(row_user[order], np.arange(len(users) + 1))
+            self._groups = {"users": users, "row_user": row_user, "order": order,
+                            "starts": starts[:-1], "ends": starts[1:], "centroid_norms": None}
+        return self._groups
+
+    def _centroid_norms(self, groups, chunk=65536):
+        """Norm of each user's summed templates, so mean similarity needs no second scan."""
+        if groups["centroid_norms"] is None:
+            n_users = len(groups["users"])
+            dim = self._base.shape[1] if self._base is not None else self._matrix.shape[1]
+            sums = np.zeros((n_users + 1, dim), dtype=np.float64)
+            blocks = []
+            if self._base is not None:
+                blocks.append((0, self._base))
+            if self._size:
+                blocks.append((0 if self._base is None else self._base.shape[0], self._matrix[:self._size]))
+            for offset, block in blocks:
+                for start in range(0, block.shape[0], chunk):
+                    rows = block[start:start + chunk]
+                    np.add.at(sums, groups["row_user"][offset + start:offset + start + rows.shape[0]], rows)
+            groups["centroid_norms"] = np.maximum(np.linalg.norm(sums[:n_users], axis=1), 1e-12)
+        return groups["centroid_norms"]
+
+    def _fuse(self, scores, k):
+        """Rank users from per-template scores; returns [(user, pose, similarity)].
+
+        Removed or unscored templates must hold -inf. Called with the lock held.
+        """
+        groups = self._grouping()
+        users, row_user, order, starts = (groups["users"], groups["row_user"],
+                                          groups["order"], groups["starts"])
+        if not len(users):
+            return []
+        n_users = len(users)
+        valid = np.isfinite(scores)
+        best = np.maximum.reduceat(scores[order], starts)  # Best pose per user
+
+        if self.fusion == "max":
+            fused = best.copy()
+        elif self.fusion == "centroid":
+            sums = np.bincount(row_user, weights=np.where(valid, scores, 0.0), minlength=n_users + 1)
+            fused = sums[:n_users] / self._centroid_norms(groups)
+        else:
+            within = valid & (scores >= self.to_similarity(self.threshold))
+            votes = np.bincount(row_user, weights=within, minlength=n_users + 1)[:n_users]
+            poses = np.bincount(row_user, minlength=n_users + 1)[:n_users]
+            qualified = votes >= np.minimum(self.vote_quorum, poses)
+            # Largest share of agreeing poses first, then the closest pose;
+            # similarity is within [-1, 1]
+            fused = np.where(qualified, votes / np.maximum(poses, 1) * 4.0 + best, -np.inf)
+        fused[~np.isfinite(best)] = -np.inf  # Users the scan never reached
+
+        results = []
+        for u in top_k(fused, k):
+            if not np.isfinite(fused[u]):
+                break
+            rows = order[starts[u]:groups["ends"][u]]
+            pose_row = rows[np.argmax(scores[rows])]
+            similarity = best[u] if self.fusion == "vote" else fused[u]
+            results.append((str(users[u]), self._label(pose_row)[1], float(similarity)))
+        return results
+
+    def to_similarity(self, distance):
+        """Inverse of to_distance()."""
+        if self.metric == "cosine":
+            return 1.0 - distance
+        return 1.0 - distance * distance / 2.0
+
+    def to_distance(self, similarity):
+        """Convert cosine similarity of normalized vectors to the configured metric."""
+        if self.metric == "cosine":
+            return 1.0 - similarity
+        return np.sqrt(np.maximum(2.0 - 2.0 * similarity, 0.0))
+
+    def search(self, probe, k=1, exact=False):
+        """Return the k closest templates as (user, pose, distance), best first.
+
+        With a fusion strategy other than "max" these are the k closest users,
+        each with the pose that matched best and the fused distance.
+        """
+        with self._lock:
+            index = None if exact else self.index
+            if index is not None:
+                if self.fusion == "max":
+                    return [(user, pose, float(self.to_distance(score)))
+                            for user, pose, score in index.search(probe, k=k)]
+                return self._search_shortlist(index, probe, k)
+            probe = l2_normalize(probe)
+            parts = []
+            base_size = 0
+            if self._base is not None:
+                base_size = self._base.shape[0]
+                base_scores = self._base @ probe
+                if self._base_alive is not None:
+                    base_scores[~self._base_alive] = -np.inf
+                parts.append(base_scores)
+            if self._size:
+                parts.append(self._matrix[:self._size] @ probe)
+            if not parts:
+                return []
+            scores = np.concatenate(parts) if len(parts) > 1 else parts[0]
+            if self.fusion != "max":
+                return [(user, pose, float(self.to_distance(similarity)))
+                        for user, pose, similarity in self._fuse(scores, k)]
+            base_labels, tail_labels = self._base_labels, self._tail_labels
+
+        top = top_k(scores, k)
+        top = top[np.isfinite(scores[top])]
+        distances = self.to_distance(scores[top])
+        return [(*(base_labels[i] if i < base_size else tail_labels[i - base_size]), float(d))
+                for i, d in zip(top, distances)]
+
+    def _score_users(self, probe, users):
+        """Score only the given users' templates; every other row is -inf."""
+        groups = self._grouping()
+        known, order, starts, ends = groups["users"], groups["order"], groups["starts"], groups["ends"]
+        scores = np.full(groups["row_user"].shape[0], -np.inf, dtype=np.float32)
+        for user in users:
+            u = np.searchsorted(known, user)
+            if u >= len(known) or known[u] != user:
+                continue
+            rows = order[starts[u]:ends[u]]
+            scores[rows] = np.stack([self._row(i) for i in rows]) @ probe
+        return scores
+
+    def _search_shortlist(self, index, probe, k):
+        """Fuse exactly over the users of the ANN index's nearest templates."""
+        probe = l2_normalize(probe)
+        shortlist = {user for user, _, _ in index.search(probe, k=max(FUSION_SHORTLIST, k))}
+        scores = self._score_users(probe, shortlist)
+        return [(user, pose, float(self.to_distance(similarity)))
+                for user, pose, similarity in self._fuse(scores, k)]
+
+    def users(self):
+        """Set of every user with at least one template."""
+        with self._lock:
+            return set(str(user) for user in self._grouping()["users"])
+
+    def templates(self, user):
+        """[(pose, normalized embedding)] of one user's templates, copied out."""
+        with self._lock:
+            groups = self._grouping()
+            known = groups["users"]
+            u = np.searchsorted(known, user)
+            if u >= len(known) or known[u] != user:
+                return []
+            rows = groups["order"][groups["starts"][u]:groups["ends"][u]]
+            return [(self._label(i)[1], np.array(self._row(i))) for i in rows]
+
+    def search_users(self, probe, users, k=1):
+        """Like search(), but scoring only the given users' templates, e.g. a shortlist."""
+        with self._lock:
+            scores = self._score_users(l2_normalize(probe), users)
+            results = self._fuse(scores, k)
+        return [(user, pose, float(self.to_distance(similarity))) for user, pose, similarity in results]
+
+    def verify(self, probe, user):
+        """1:1 check against one user's templates, fused like search().
+
+        Returns (pose, distance, accepted), or None if the user has no templates.
+        """
+        with self._lock:
+            scores = self._score_users(l2_normalize(probe), [user])
+            results = self._fuse(scores, 1)
+        if not results:
+            if np.isfinite(scores).any():
+                return None, None, False  # A vote the user's poses did not pass
+            return None
+        _, pose, similarity = results[0]
+        distance = float(self.to_distance(similarity))
+        return pose, distance, distance <= self.threshold
+
+    def match(self, probe):
+        """Return the best (user, pose, distance) within the threshold, or None."""
+        results = self.search(probe, k=1)
+        if results and results[0][2] <= self.threshold:
+            return results[0]
+        return None
@@ -0,0 +1,271 @@
+import os
+import time
+import bisect
+import logging
+import threading
+import collections
+from contextlib import contextmanager
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+logger = logging.getLogger("unlockx")
+
+# Seconds; covers a preview paint (~1 ms) up to a cold DeepFace call
+BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0)
+WINDOW = 256  # Recent samples per histogram kept for the overlay's percentiles
+EXPORT_INTERVAL = 5.0  # Seconds between metrics file rewrites
+
+
+def _label_text(labels):
+    if not labels:
+        return ""
+    return "{" + ",".join(f'{k}="{v}"' for k, v in labels) + "}"
+
+
+class Counter:
+    def __init__(self):
+        self.value = 0
+        self._lock = threading.Lock()
+
+    def inc(self, amount=1):
+        with self._lock:
+            self.value += amount
+
+    def samples(self, name, labels):
+        yield name, labels, self.value
+
+
+class Gauge:
+    def __init__(self):
+        self.value = 0.0
+
+    def set(self, value):
+        self.value = value  # A single store; no lock needed
+
+    def samples(self, name, labels):
+        yield name, labels, self.value
+
+
+class Histogram:
+    """Cumulative Prometheus buckets plus a short window of recent samples."""
+
+    def __init__(self, buckets=BUCKETS, window=WINDOW):
+        self.buckets = buckets
+        self.counts = [0] * (len(buckets) + 1)  # Last slot is +Inf
+        self.count = 0
+        self.sum = 0.0
+        self.recent = collections.deque(maxlen=window)
+        self._lock = threading.Lock()
+
+    def observe(self, value):
+        i = bisect.bisect_left(self.buckets, value)
+        with self._lock:
+            self.counts[i] += 1
+            self.count += 1
+            self.sum += value
+            self.recent.append(value)
+
+    def percentile(self, q):
+        """q-th percentile (0-100) of the recent window, or None before any sample."""
+        with self._lock:
+            recent = sorted(self.recent)
+        if not recent:
+            return None
+        return recent[min(len(recent) - 1, int(len(recent) * q / 100.0))]
+
+    def samples(self, name, labels):
+        with self._lock:
+            counts, count, total = list(self.counts), self.count, self.sum
+        cumulative = 0
+        for bound, n in zip(self.buckets + (float("inf"),), counts):
+            cumulative += n
+            le = "+Inf" if bound == float("inf") else repr(bound)
+            yield name + "_bucket", labels + (("le", le),), cumulative
+        yield name + "_sum", labels, total
+        yield name + "_count", labels, count
+
+
+class Registry:
+    """Named metrics, created on first use, rendered in Prometheus text format."""
+
+    def __init__(self):
+        self._metrics = {}  # (name, labels) -> metric
+        self._help = {}  # name -> (type, help)
+        self._lock = threading.Lock()
+
+    def _get(self, cls, kind, name, help, labels):
+        key = (name, tuple(sorted(labels.items())))
+        metric = self._metrics.get(key)
+        if metric is None:
+            with self._lock:
+                metric = self._metrics.setdefault(key, cls())
+                self._help.setdefault(name, (kind, help))
+        return metric
+
+    def counter(self, name, help="", **labels):
+        return self._get(Counter, "counter", name, help, labels)
+
+    def gauge(self, name, help="", **labels):
+        return self._get(Gauge, "gauge", name, help, labels)
+
+    def histogram(self, name, help="", **labels):
+        return self._get(Histogram, "histogram", name, help, labels)
+
+    def metrics(self):
+        """Sorted [((name, labels), metric)] of everything registered so far."""
+        with self._lock:
+            return sorted(self._metrics.items())
+
+    def render(self):
+        metrics = self.metrics()
+        with self._lock:
+            helps = dict(self._help)
+        lines = []
+        current = None
+        for (name, labels), metric in metrics:
+            if name != current:
+                kind, help = helps[name]
+                lines.append(f"# HELP {name} {help}")
+                lines.append(f"# TYPE {name} {kind}")
+                current = name
+            for sample, sample_labels, value in metric.samples(name, labels):
+                lines.append(f"{sample}{_label_text(sample_labels)} {value}")
+        return "\n".join(lines) + "\n"
+
+
+REGISTRY = Registry()
+
+
+def stage(name):
+    """Latency histogram of one pipeline stage."""
+    return REGISTRY.histogram("unlockx_stage_seconds", "Time spent in each pipeline stage", stage=name)
+
+
+@contextmanager
+def span(name):
+    """Time the enclosed block into the stage histogram ``name``."""
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        stage(name).observe(time.perf_counter() - start)
+
+
+def observe_timings(timings, stages=("detection", "embedding", "matching", "rescoring")):
+    """Feed a Recognizer-style timings dict into the stage histograms."""
+    for name in stages:
+        if name in timings:
+            stage(name).observe(timings[name])
+
+
+class RateMeter:
+    """Events per second over the last ``interval`` seconds, published to a gauge."""
+
+    def __init__(self, gauge, interval=1.0):
+        self.gauge = gauge
+        self.interval = interval
+        self._events = 0
+        self._since = time.perf_counter()
+
+    def tick(self):
+        self._events += 1
+        now = time.perf_counter()
+        if now - self._since >= self.interval:
+            self.gauge.set(self._events / (now - self._since))
+            self._events = 0
+            self._since = now
+
+    def reset(self):
+        """Report 0 until ticks resume, e.g. while a preview is hidden."""
+        self.gauge.set(0.0)
+        self._events = 0
+        self._since = time.perf_counter()
+
+    @property
+    def rate(self):
+        return self.gauge.value
+
+
+def summary(stages=("camera_read", "motion", "presence", "detection", "embedding", "matching",
+                    "rescoring", "preview_render"), registry=REGISTRY):
+    """Short multi-line text of rates, counters and p50/p95 stage latencies, for an overlay."""
+    lines = []
+    metrics = registry.metrics()
+    histograms = {labels: metric for (name, labels), metric in metrics if name == "unlockx_stage_seconds"}
+    values = []
+    for (name, labels), metric in metrics:
+        if isinstance(metric, (Counter, Gauge)):
+            short = name[len("unlockx_"):] if name.startswith("unlockx_") else name
+            short = short[:-len("_total")] if short.endswith("_total") else short
+            suffix = "".join(f" {v}" for _, v in labels)
+            values.append(f"{short}{suffix} {metric.value:.3g}" if isinstance(metric, Gauge)
+                          else f"{short}{suffix} {metric.value}")
+    lines.append(" | ".join(values))
+    for name in stages:
+        histogram = histograms.get((("stage", name),))
+        if histogram is None or not histogram.count:
+            continue
+        p50, p95 = histogram.percentile(50), histogram.percentile(95)
+        lines.append(f"{name}: p50 {p50 * 1000:.1f} ms  p95 {p95 * 1000:.1f} ms  n={histogram.count}")
+    return "\n".join(lines)
+
+
+class _MetricsHandler(BaseHTTPRequestHandler):
+    registry = REGISTRY
+
+    def do_GET(self):
+        if self.path.split("?")[0] != "/metrics":
+            self.send_error(404)
+            return
+        payload = self.registry.render().encode()
+        self.send_response(200)
+        self.send_header("Content-Type", "text/plain; version=0.0.4")
+        self.send_header("Content-Length", str(len(payload)))
+        self.end_headers()
+        self.wfile.write(payload)
+
+    def log_message(self, format, *args):
+        pass
+
+
+def serve_metrics(port, host="127.0.0.1", registry=REGISTRY):
+    """Serve GET /metrics from a daemon thread; returns the server."""
+    handler = type("MetricsHandler", (_MetricsHandler,), {"registry": registry})
+    server = ThreadingHTTPServer((host, port), handler)
+    server.daemon_threads = True
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    logger.info("Metrics on http://%s:%d/metrics", host, port)
+    return server
+
+
+def write_metrics(path, registry=REGISTRY):
+    """Atomically rewrite a Prometheus textfile-collector file."""
+    tmp = path + ".tmp"
+    with open(tmp, "w") as f:
+        f.write(registry.render())
+    os.replace(tmp, path)
+
+
+def export_metrics_file(path, interval=EXPORT_INTERVAL, registry=REGISTRY):
+    """Rewrite ``path`` every ``interval`` seconds from a daemon thread."""
+    def run():
+        while True:
+            try:
+                write_metrics(path, registry)
+            except OSError as e:
+                logger.error("Could not write metrics to %s: %s", path, e)
+            time.sleep(interval)
+
+    threading.Thread(target=run, daemon=True).start()
+
+
+def add_metrics_arguments(parser):
+    parser.add_argument("--metrics-port", type=int, help="serve Prometheus metrics on this local port")
+    parser.add_argument("--metrics-file", help="periodically write Prometheus metrics to this file")
+
+
+def start_metrics_export(args):
+    """Start whichever exporters the --metrics-* arguments ask for."""
+    if args.metrics_port:
+        serve_metrics(args.metrics_port)
+    if args.metrics_file:
+        export_metrics_file(args.metrics_file)
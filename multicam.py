@@ -0,0 +1,257 @@
+import time
+import logging
+import threading
+import collections
+from concurrent.futures import Future
+from camera import CameraStream
+from scheduler import VerificationScheduler
+
+logger = logging.getLogger("unlockx")
+
+MAX_BATCH = 8  # Face crops embedded in one forward pass
+MAX_WAIT = 0.01  # Seconds the dispatcher waits for a batch to fill
+MAX_QUEUE_DEPTH = 2  # Pending requests per stream; the oldest is dropped beyond this
+RESUME_DELAY = 3.0  # Seconds a door shows its greeting
+
+
+class RequestDropped(RuntimeError):
+    """A newer frame from the same stream replaced this request in the queue."""
+
+
+class QueueFull(RuntimeError):
+    """Raised by submit() when a rejecting BatchingEngine has no room for a request."""
+
+
+class BatchingEngine:
+    """Shares one loaded RecognitionEngine between several camera streams.
+
+    Each stream has its own bounded queue. A dispatcher thread takes
+    requests round-robin across the queues, starting from a different
+    stream every batch, so a busy client gets at most its share of each
+    batch. The frames are detected and aligned one by one, and the crops
+    are embedded together with Recognizer.embed_batch(); each request's
+    Future gets the embedding and aligned crop, or Nones when the frame
+    had no face.
+
+    A full stream queue drops its oldest request, which suits cameras
+    where only the newest frame matters. With ``reject=True`` submit()
+    raises QueueFull instead, as it also does once ``max_pending``
+    requests are waiting in total, so callers can push back.
+    """
+
+    def __init__(self, engine, max_batch=MAX_BATCH, max_wait=MAX_WAIT, max_queue_depth=MAX_QUEUE_DEPTH,
+                 detect=True, reject=False, max_pending=None):
+        self.engine = engine
+        self.max_batch = max_batch
+        self.max_wait = max_wait
+        self.max_queue_depth = max_queue_depth
+        self.detect = detect  # False embeds whole frames, for benchmarks on faceless sources
+        self.reject = reject
+        self.max_pending = max_pending
+        self.batches = 0
+        self.requests = 0
+        self.dropped = 0
+        self.rejected = 0
+        self._queues = collections.OrderedDict()  # stream id -> deque of (frame, future)
+        self._next_stream = 0
+        self._cond = threading.Condition()
+        self._thread = None
+        self._running = False
+
+    def start(self):
+        if self._thread is None:
+            self._running = True
+            self._thread = threading.Thread(target=self._run, daemon=True)
+            self._thread.start()
+
+    def stop(self):
+        with self._cond:
+            self._running = False
+            self._cond.notify_all()
+        if self._thread is not None:
+            self._thread.join(timeout=1.0)
+            self._thread = None
+
+    def client(self, stream_id):
+        """Engine-like handle that tags requests with one stream's id."""
+        with self._cond:
+            self._queues.setdefault(stream_id, collections.deque())
+        return StreamClient(self, stream_id)
+
+    def submit(self, stream_id, frame):
+        """Queue a frame for embedding; returns a Future of (embedding, timings, face crop).
+
+        Embedding and crop are None when the frame had no face.
+
+        The frame must stay unchanged until the Future is done.
+        """
+        future = Future()
+        with self._cond:
+            queue = self._queues.setdefault(stream_id, collections.deque())
+            full = len(queue) >= self.max_queue_depth
+            if (self.reject and full) or (self.max_pending is not None and self._pending() >= self.max_pending):
+                self.rejected += 1
+                raise QueueFull(f"{self._pending()} requests already waiting")
+            if full:
+                _, stale = queue.popleft()
+                stale.set_exception(RequestDropped(f"Stream {stream_id} queue is full"))
+                self.dropped += 1
+            queue.append((frame, future))
+            self._cond.notify_all()
+        return future
+
+    def _pending(self):
+        return sum(len(queue) for queue in self._queues.values())
+
+    @property
+    def pending(self):
+        with self._cond:
+            return self._pending()
+
+    def _take_batch(self):
+        """Wait for work, give a batch a moment to fill, then take it round-robin."""
+        with self._cond:
+            self._cond.wait_for(lambda: not self._running or self._pending(), timeout=0.5)
+            if not self._running or not self._pending():
+                return []
+            deadline = time.perf_counter() + self.max_wait
+            while self._pending() < self.max_batch:
+                remaining = deadline - time.perf_counter()
+                if remaining <= 0 or not self._cond.wait(remaining):
+                    break
+
+            streams = list(self._queues)
+            start = self._next_stream % len(streams)
+            order = streams[start:] + streams[:start]
+            self._next_stream += 1
+            batch = []
+            while len(batch) < self.max_batch and any(self._queues[s] for s in order):
+                for stream_id in order:
+                    if self._queues[stream_id] and len(batch) < self.max_batch:
+                        batch.append((stream_id,) + self._queues[stream_id].popleft())
+            return batch
+
+    def _run(self):
+        recognizer = self.engine.recognizer
+        while self._running:
+            batch = self._take_batch()
+            if not batch:
+                continue
+            self.batches += 1
+            self.requests += len(batch)
+            try:
+                start = time.perf_counter()
+                crops = [recognizer.detect(frame) if self.detect else frame for _, frame, _ in batch]
+                detected = time.perf_counter()
+                faces = [crop for crop in crops if crop is not None]
+                embeddings = iter(recognizer.embed_batch(faces) if faces else [])
+                embedded = time.perf_counter()
+                for (_, _, future), crop in zip(batch, crops):
+                    timings = {"detection": (detected - start) / len(batch), "batch_size": len(batch)}
+                    if crop is None:
+                        future.set_result((None, timings, None))
+                        continue
+                    timings["embedding"] = (embedded - detected) / len(faces)
+                    future.set_result((next(embeddings), timings, crop))
+            except Exception as e:
+                for _, _, future in batch:
+                    if not future.done():
+                        future.set_exception(e)
+
+
+class StreamClient:
+    """What a stream's VerificationScheduler sees: the engine interface, batched."""
+
+    def __init__(self, batcher, stream_id):
+        self.batcher = batcher
+        self.stream_id = stream_id
+
+    @property
+    def is_ready(self):
+        return self.batcher.engine.is_ready
+
+    @property
+    def threshold(self):
+        return self.batcher.engine.threshold
+
+    def gallery_size(self):
+        return self.batcher.engine.gallery_size()
+
+    def nearest(self, frame, timings=None, timeout=30.0):
+        embedding, batch_timings, _ = self.batcher.submit(self.stream_id, frame).result(timeout)
+        if timings is not None:
+            timings.update(batch_timings)
+        if embedding is None:
+            return None
+        start = time.perf_counter()
+        results = self.batcher.engine.search(embedding)
+        if timings is not None:
+            timings["matching"] = time.perf_counter() - start
+        return results[0] if results else None
+
+    def identify(self, frame, timings=None, timeout=30.0):
+        result = self.nearest(frame, timings, timeout)
+        if result is not None and result[2] <= self.threshold:
+            return result
+        return None
+
+
+class MultiCameraHost:
+    """Serves several doors from one process and one loaded model.
+
+    Every source gets its own CameraStream and VerificationScheduler (motion
+    gating, tracking and best-frame selection stay per door); their
+    inference requests meet in one BatchingEngine. ``on_status(stream_id,
+    text)`` is called from worker threads whenever a door's status changes.
+    """
+
+    def __init__(self, sources, engine, on_status=None, resume_delay=RESUME_DELAY, **batch_options):
+        self.engine = engine
+        self.on_status = on_status
+        self.resume_delay = resume_delay
+        self.batcher = BatchingEngine(engine, **batch_options)
+        self.cameras = [CameraStream(source) for source in sources]
+        self.schedulers = [
+            # Kept running after a match, so a greeted face stays decided until it leaves
+            VerificationScheduler(camera, self.batcher.client(i), self._matched_callback(i), stop_on_match=False)
+            for i, camera in enumerate(self.cameras)
+        ]
+        self.matches = [0] * len(self.cameras)
+        self._timers = []
+
+    def _status(self, stream_id, text):
+        if self.on_status is not None:
+            self.on_status(stream_id, text)
+
+    def _matched_callback(self, stream_id):
+        def matched(match):
+            self.matches[stream_id] += 1
+            self._status(stream_id, f"Hello, {match[0]}")
+            timer = threading.Timer(self.resume_delay, self._resume, (stream_id, self.matches[stream_id]))
+            timer.daemon = True
+            self._timers.append(timer)
+            timer.start()
+        return matched
+
+    def _resume(self, stream_id, match_count):
+        if self.matches[stream_id] == match_count:  # Not greeting someone newer
+            self._status(stream_id, "Looking for face...")
+
+    def start(self, store=None):
+        """Open every source and start verifying; loads templates from ``store`` first."""
+        if store is not None:
+            self.engine.reload(store)
+        self.batcher.start()
+        for i, (camera, scheduler) in enumerate(zip(self.cameras, self.schedulers)):
+            camera.start()
+            scheduler.start()
+            self._status(i, "Looking for face...")
+
+    def stop(self):
+        for timer in self._timers:
+            timer.cancel()
+        for scheduler in self.schedulers:
+            scheduler.stop()
+        self.batcher.stop()
+        for camera in self.cameras:
+            camera.stop()
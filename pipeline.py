@@ -0,0 +1,193 @@
+import math
+import time
+import cv2
+import numpy as np
+from gallery import MODEL_NAME
+
+DETECTOR_BACKEND = "opencv"  # DeepFace's default detector
+DETECT_WIDTH = 320  # Frames are downscaled to this width before detection
+MIN_FACE_SIZE = 48  # Smallest usable face side, in full-resolution pixels
+CROP_MARGIN = 0.2  # Extra context kept around the detected box, per side
+
+STAGES = ("capture", "detection", "embedding", "matching", "rescoring")
+
+
+class FaceNotFound(ValueError):
+    """Raised when an enrollment capture has no usable face."""
+
+
+def align_face(frame, box, eyes=None, margin=CROP_MARGIN):
+    """Crop a face box from the full-resolution frame, levelling the eyes.
+
+    Only the padded region around the box is rotated, so alignment costs the
+    same regardless of frame size.
+    """
+    x, y, w, h = box
+    pad_x, pad_y = int(w * margin), int(h * margin)
+    x0, y0 = max(x - pad_x, 0), max(y - pad_y, 0)
+    x1, y1 = min(x + w + pad_x, frame.shape[1]), min(y + h + pad_y, frame.shape[0])
+    region = frame[y0:y1, x0:x1]
+
+    if eyes is not None:
+        (lx, ly), (rx, ry) = sorted(eyes)
+        angle = math.degrees(math.atan2(ry - ly, rx - lx))
+        if abs(angle) > 1.0:
+            center = ((lx + rx) / 2.0 - x0, (ly + ry) / 2.0 - y0)
+            rotation = cv2.getRotationMatrix2D(center, angle, 1.0)
+            region = cv2.warpAffine(region, rotation, (region.shape[1], region.shape[0]),
+                                    flags=cv2.INTER_LINEAR, borderMode=cv2.BORDER_REPLICATE)
+    return region
+
+
+class Recognizer:
+    """The login verification logic without Qt: detect, align, embed and match.
+
+    Detection runs once per frame on a copy downscaled to ``detect_width``;
+    the face is then cropped and aligned from the full-resolution frame and
+    that crop is the only thing the embedding model sees. Frames without a
+    usable face are rejected before any embedding runs. identify() records
+    how long each stage took into an optional ``timings`` dict so the same
+    code path can be benchmarked headlessly; stages that were skipped are
+    left out.
+    """
+
+    def __init__(self, matcher, model_name=MODEL_NAME, detector_backend=DETECTOR_BACKEND,
+                 detect_width=DETECT_WIDTH, min_face_size=MIN_FACE_SIZE):
+        self.matcher = matcher
+        self.model_name = model_name
+        self.detector_backend = detector_backend
+        self.detect_width = detect_width
+        self.min_face_size = min_face_size
+        self.hot_set = None  # Optional hotset.HotSet searched before the full matcher
+        self._batch_represent = None  # Whether DeepFace.represent accepts a list; probed once
+
+    def locate(self, frame):
+        """Return (box, eyes) of the largest face in full-frame coordinates, or None."""
+        from deepface import DeepFace  # Deferred so matching tools don't load TensorFlow
+
+        scale = 1.0
+        small = frame
+        if self.detect_width and frame.shape[1] > self.detect_width:
+            scale = frame.shape[1] / float(self.detect_width)
+            small = cv2.resize(frame, (self.detect_width, int(round(frame.shape[0] / scale))),
+                               interpolation=cv2.INTER_AREA)
+
+        faces = DeepFace.extract_faces(
+            img_path=small,
+            detector_backend=self.detector_backend,
+            enforce_detection=False,
+            align=False
+        )
+        # With enforce_detection=False DeepFace reports "no face" as a
+        # zero-confidence region covering the whole frame
+        faces = [f for f in faces if f.get("confidence", 0) > 0]
+        if not faces:
+            return None
+
+        area = max(faces, key=lambda f: f["facial_area"]["w"] * f["facial_area"]["h"])["facial_area"]
+        box = tuple(int(round(area[k] * scale)) for k in ("x", "y", "w", "h"))
+        if min(box[2], box[3]) < self.min_face_size:
+            return None
+        eyes = None
+        if area.get("left_eye") and area.get("right_eye"):
+            eyes = tuple((ex * scale, ey * scale) for ex, ey in (area["left_eye"], area["right_eye"]))
+        return box, eyes
+
+    def detect(self, frame):
+        """Return the aligned full-resolution crop of the largest face, or None."""
+        located = self.locate(frame)
+        if located is None:
+            return None
+        box, eyes = located
+        return align_face(frame, box, eyes)
+
+    def embed(self, face):
+        """Embed an already-aligned face crop as a float32 vector."""
+        from deepface import DeepFace
+
+        result = DeepFace.represent(
+            img_path=face,
+            model_name=self.model_name,
+            detector_backend="skip",
+            enforce_detection=False
+        )
+        return np.asarray(result[0]["embedding"], dtype=np.float32)
+
+    def embed_batch(self, faces):
+        """Embed several aligned crops, in one forward pass where DeepFace supports it."""
+        from deepface import DeepFace
+
+        if len(faces) > 1 and self._batch_represent is not False:
+            try:
+                results = DeepFace.represent(
+                    img_path=list(faces),
+                    model_name=self.model_name,
+                    detector_backend="skip",
+                    enforce_detection=False
+                )
+                self._batch_represent = True
+                return [np.asarray(result[0]["embedding"], dtype=np.float32) for result in results]
+            except Exception:
+                if self._batch_represent:
+                    raise
+                self._batch_represent = False  # Older DeepFace: one image per call
+        return [self.embed(face) for face in faces]
+
+    def embed_reference(self, image, is_crop):
+        """Embed a saved reference image the way live probes are embedded; raises FaceNotFound.
+
+        Full camera frames (older reference images) go through detect().
+        Aligned crops are already what detect() returns for a probe, so they
+        are embedded as they are; see gallery.is_face_crop.
+        """
+        face = image if is_crop else self.detect(image)
+        if face is None:
+            raise FaceNotFound("No face detected")
+        return self.embed(face)
+
+    def enroll(self, frame):
+        """Template embedding for an enrollment capture; raises FaceNotFound."""
+        return self.enroll_face(frame)[1]
+
+    def enroll_face(self, frame):
+        """(aligned face crop, embedding) for an enrollment capture; raises FaceNotFound."""
+        face = self.detect(frame)
+        if face is None:
+            raise FaceNotFound("No face detected")
+        return face, self.embed(face)
+
+    def enroll_templates(self, frame):
+        """(aligned face crop, {model name: embedding}) for every model this recognizer matches with."""
+        face, embedding = self.enroll_face(frame)
+        return face, {self.model_name: embedding}
+
+    def search(self, probe, k=1):
+        """Closest templates for an embedding, from the hot set when it is confident."""
+        return (self.matcher if self.hot_set is None else self.hot_set).search(probe, k=k)
+
+    def nearest(self, frame, timings=None):
+        """Return the closest (user, pose, distance) whatever the threshold, or None."""
+        start = time.perf_counter()
+        face = self.detect(frame)
+        detected = time.perf_counter()
+        if timings is not None:
+            timings["detection"] = detected - start
+        if face is None:
+            return None  # Nothing worth embedding, e.g. an empty hallway
+
+        probe = self.embed(face)
+        embedded = time.perf_counter()
+        results = self.search(probe)
+        matched = time.perf_counter()
+
+        if timings is not None:
+            timings["embedding"] = embedded - detected
+            timings["matching"] = matched - embedded
+        return results[0] if results else None
+
+    def identify(self, frame, timings=None):
+        """Return the best (user, pose, distance) within the threshold, or None."""
+        result = self.nearest(frame, timings)
+        if result is not None and result[2] <= self.matcher.threshold:
+            return result
+        return None
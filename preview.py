@@ -0,0 +1,117 @@
+import time
+import cv2
+import numpy as np
+from PyQt5.QtWidgets import QLabel
+from PyQt5.QtGui import QImage, QPainter
+from PyQt5.QtCore import QTimer
+from metrics import REGISTRY, RateMeter, stage
+
+MIN_INTERVAL = 33  # ms between paints when the kiosk keeps up (~30 FPS)
+MAX_INTERVAL = 200  # ms between paints under heavy load (5 FPS)
+LOAD_FRACTION = 0.25  # Back off once painting takes more than this share of the interval
+SMOOTHING = 0.1  # Weight of the newest sample in the paint cost average
+
+PREVIEW_TIME = stage("preview_render")
+PREVIEW_FPS_HELP = "Preview frames painted per second"
+
+# Qt 5.14+ reads OpenCV's BGR order directly; older Qt needs a channel swap
+BGR_FORMAT = getattr(QImage, "Format_BGR888", None)
+
+
+class PreviewLabel(QLabel):
+    """A QLabel that paints a QImage directly, skipping the QPixmap round trip."""
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self._image = None
+
+    def set_image(self, image):
+        self._image = image
+        self.update()
+
+    def paintEvent(self, event):
+        super().paintEvent(event)  # Border and background from the style sheet
+        if self._image is not None:
+            painter = QPainter(self)
+            painter.drawImage((self.width() - self._image.width()) // 2,
+                              (self.height() - self._image.height()) // 2, self._image)
+            painter.end()
+
+
+class PreviewRenderer:
+    """Paints a CameraStream's newest frame into a PreviewLabel.
+
+    Frames are scaled once, straight into a buffer preallocated at the
+    label's size (keeping the aspect ratio), which a QImage wraps without
+    copying. Nothing is done while the label is hidden or its window
+    minimized, or when no new frame has arrived. The timer interval
+    adapts: it grows when painting gets expensive or the event loop runs
+    late, and shrinks back towards MIN_INTERVAL when there is headroom.
+    """
+
+    def __init__(self, label, camera, **labels):
+        self.label = label
+        self.camera = camera
+        self.fps = RateMeter(REGISTRY.gauge("unlockx_preview_fps", PREVIEW_FPS_HELP, **labels))
+        self.interval = MIN_INTERVAL
+        self.cost = 0.0  # Smoothed seconds per paint
+        self._seq = 0
+        self._buffer = None
+        self._image = None
+        self._last_tick = None
+        self.timer = QTimer()
+        self.timer.timeout.connect(self.render)
+
+    def start(self):
+        self._seq = 0
+        self._last_tick = None
+        self.timer.start(int(self.interval))
+
+    def stop(self):
+        self.timer.stop()
+        self.fps.reset()
+
+    def _target(self, frame):
+        """Buffer and QImage for this frame shape at the label's size, reused across frames."""
+        height, width = frame.shape[:2]
+        scale = min(self.label.width() / width, self.label.height() / height)
+        size = (max(1, int(height * scale)), max(1, int(width * scale)))
+        if self._buffer is None or self._buffer.shape[:2] != size:
+            self._buffer = np.empty(size + (3,), dtype=np.uint8)
+            self._image = QImage(self._buffer.data, size[1], size[0], 3 * size[1],
+                                 BGR_FORMAT if BGR_FORMAT is not None else QImage.Format_RGB888)
+        return self._buffer
+
+    def _adapt(self, now):
+        late = 0.0 if self._last_tick is None else (now - self._last_tick) * 1000.0 - self.interval
+        self._last_tick = now
+        budget = self.interval * LOAD_FRACTION / 1000.0
+        if self.cost > budget or late > self.interval:
+            interval = min(MAX_INTERVAL, self.interval * 1.25)
+        elif self.cost < budget / 2:
+            interval = max(MIN_INTERVAL, self.interval * 0.9)
+        else:
+            return
+        if int(interval) != int(self.interval):
+            self.timer.setInterval(int(interval))
+        self.interval = interval
+
+    def render(self):
+        if not self.label.isVisible() or self.label.window().isMinimized():
+            self._last_tick = None  # Time spent hidden is not lateness
+            return
+        now = time.perf_counter()
+        self._adapt(now)
+        with self.camera.hold() as (seq, frame):
+            if frame is None or seq == self._seq:
+                return
+            self._seq = seq
+            buffer = self._target(frame)
+            cv2.resize(frame, (buffer.shape[1], buffer.shape[0]), dst=buffer, interpolation=cv2.INTER_LINEAR)
+        if BGR_FORMAT is None:
+            cv2.cvtColor(buffer, cv2.COLOR_BGR2RGB, dst=buffer)
+        self.label.set_image(self._image)
+        elapsed = time.perf_counter() - now
+        self.cost += SMOOTHING * (elapsed - self.cost)
+        PREVIEW_TIME.observe(elapsed)
+        self.fps.tick()
@@ -0,0 +1,217 @@
+import time
+import logging
+import threading
+import cv2
+import numpy as np
+from pipeline import DETECT_WIDTH
+from tracker import FaceTracker, Track, MIN_VOTES
+from metrics import REGISTRY, stage, observe_timings
+
+logger = logging.getLogger("unlockx")
+
+MOTION_THRESHOLD = 4.0  # Mean absolute grey-level change that counts as motion
+ACTIVE_WINDOW = 2.0  # Seconds to keep looking for faces after the last motion
+RETRY_INTERVAL = 1.0  # How often a still face is re-checked without motion
+BURST_FRAMES = 5  # Face frames collected before the best one is embedded
+BURST_TIMEOUT = 0.25  # ...or seconds after the first one, whichever comes first
+POLL_INTERVAL = 0.2
+
+FRAMES_PROCESSED = REGISTRY.counter("unlockx_frames_processed_total", "Frames looked at by the scheduler")
+FRAMES_SKIPPED = REGISTRY.counter("unlockx_frames_skipped_total", "Frames skipped by motion gating")
+INFERENCES = REGISTRY.counter("unlockx_inferences_total", "Frames sent to the recognition engine")
+MATCHES = REGISTRY.counter("unlockx_matches_total", "Faces accepted as an enrolled user")
+REJECTIONS = REGISTRY.counter("unlockx_rejections_total", "Face tracks decided as unknown")
+ERRORS = REGISTRY.counter("unlockx_verification_errors_total", "Recognition engine calls that failed")
+
+
+def thumbnail(frame, width=DETECT_WIDTH):
+    """Small greyscale copy of a frame used for every cheap per-frame signal."""
+    scale = width / float(frame.shape[1])
+    small = cv2.resize(frame, (width, int(round(frame.shape[0] * scale))), interpolation=cv2.INTER_AREA)
+    return cv2.cvtColor(small, cv2.COLOR_BGR2GRAY)
+
+
+def motion_score(previous, current):
+    """Mean absolute difference between two thumbnails; 0 means a static scene."""
+    if previous is None or previous.shape != current.shape:
+        return float("inf")
+    return float(cv2.absdiff(previous, current).mean())
+
+
+def frame_quality(gray, box):
+    """Rank a face for embedding: sharp, large and left-right symmetric (frontal) wins."""
+    x, y, w, h = box
+    face = gray[y:y + h, x:x + w]
+    sharpness = cv2.Laplacian(face, cv2.CV_64F).var()
+    half = w // 2
+    left = face[:, :half].astype(np.int16)
+    right = face[:, w - half:][:, ::-1].astype(np.int16)
+    symmetry = 1.0 - np.abs(left - right).mean() / 255.0
+    return sharpness * w * h * symmetry
+
+
+def load_face_detector():
+    """OpenCV's frontal Haar cascade, or None if this build doesn't ship it."""
+    try:
+        detector = cv2.CascadeClassifier(cv2.data.haarcascades + "haarcascade_frontalface_default.xml")
+    except AttributeError:
+        return None
+    return None if detector.empty() else detector
+
+
+class VerificationScheduler:
+    """Decides which camera frames are worth sending to the recognition engine.
+
+    A background thread sleeps on the camera's frame ring and looks at each
+    new frame through a small greyscale thumbnail. Frames only reach the
+    frontal-face detector while there is motion (or, for someone standing
+    still, once every ``retry_interval``), and only frames with a face are
+    considered for embedding. Faces are followed across frames by a
+    tracker.FaceTracker; for the largest undecided track, the sharpest,
+    largest and most frontal frame of a short burst is embedded and its
+    nearest template recorded on the track until the track is decided.
+    ``on_match`` is called from the scheduler thread with the (user, pose,
+    mean distance) of the first accepted track, after which the scheduler
+    stops, or, with ``stop_on_match=False``, keeps following the scene:
+    the accepted track stays decided until it leaves the frame.
+
+    Each run has its own stop event, so a thread still finishing an
+    inference after stop() timed out can never be revived by start(); the
+    new run waits for it to exit before touching the engine.
+    """
+
+    def __init__(self, camera, engine, on_match, motion_threshold=MOTION_THRESHOLD,
+                 active_window=ACTIVE_WINDOW, retry_interval=RETRY_INTERVAL,
+                 burst_frames=BURST_FRAMES, burst_timeout=BURST_TIMEOUT, criterion="average", min_votes=MIN_VOTES,
+                 stop_on_match=True):
+        self.camera = camera
+        self.engine = engine
+        self.criterion = criterion
+        self.min_votes = min_votes
+        self.tracker = None
+        self.on_match = on_match
+        self.stop_on_match = stop_on_match
+        self.motion_threshold = motion_threshold
+        self.active_window = active_window
+        self.retry_interval = retry_interval
+        self.burst_frames = burst_frames
+        self.burst_timeout = burst_timeout
+        self.frames_seen = 0
+        self.frames_checked = 0
+        self.inferences = 0
+        self._detector = load_face_detector()
+        self._stop = threading.Event()
+        self._thread = None
+
+    @property
+    def is_running(self):
+        return self._thread is not None and self._thread.is_alive() and not self._stop.is_set()
+
+    def start(self):
+        if not self.is_running:
+            predecessor = self._thread  # Still alive if stop() timed out mid-inference
+            self._stop = threading.Event()
+            # Fresh tracks per session, so a face decided last time is looked at again
+            self.tracker = FaceTracker(self.engine.threshold, self.criterion, self.min_votes)
+            self._thread = threading.Thread(target=self._run, args=(self._stop, self.tracker, predecessor),
+                                            daemon=True)
+            self._thread.start()
+
+    def stop(self):
+        self._stop.set()
+        if self._thread is not None and self._thread is not threading.current_thread():
+            self._thread.join(timeout=1.0)
+
+    def find_faces(self, gray):
+        """Frontal face boxes in a thumbnail."""
+        if self._detector is None:
+            return [(0, 0, gray.shape[1], gray.shape[0])]  # No cheap detector; let the engine decide
+        faces = self._detector.detectMultiScale(gray, scaleFactor=1.2, minNeighbors=4, minSize=(24, 24))
+        return [tuple(int(v) for v in face) for face in faces]
+
+    def _run(self, stop, tracker, predecessor=None):
+        if predecessor is not None:
+            predecessor.join()
+        seq = 0
+        previous = None
+        active_until = 0.0
+        last_check = 0.0
+        target, best, best_score, burst_size, burst_start = None, None, None, 0, None
+        # Histograms looked up once; observing is a bisect and a locked add
+        motion_time, presence_time, inference_time = stage("motion"), stage("presence"), stage("inference")
+
+        while not stop.is_set():
+            if not self.engine.is_ready or self.engine.gallery_size() == 0:
+                stop.wait(POLL_INTERVAL)
+                continue
+
+            with self.camera.hold(seq, POLL_INTERVAL) as (new_seq, frame):
+                if frame is None or new_seq == seq:
+                    continue
+                seq = new_seq
+                self.frames_seen += 1
+                FRAMES_PROCESSED.inc()
+                start = time.perf_counter()
+                gray = thumbnail(frame)
+                motion = motion_score(previous, gray)
+                previous = gray
+                now = time.perf_counter()
+                motion_time.observe(now - start)
+                if motion >= self.motion_threshold:
+                    active_until = now + self.active_window
+                # An idle scene is only re-checked now and then, for someone standing still
+                if now < active_until or now - last_check >= self.retry_interval:
+                    last_check = now
+                    self.frames_checked += 1
+                    tracks = tracker.update(self.find_faces(gray), now)
+                    presence_time.observe(time.perf_counter() - now)
+                    # Decided faces are never embedded again while they stay in view
+                    undecided = [track for track in tracks if not track.decided]
+                    if target not in undecided:
+                        target = max(undecided, key=lambda t: t.area) if undecided else None
+                        best_score, burst_size, burst_start = None, 0, None
+                    if target is not None:
+                        score = frame_quality(gray, target.box)
+                        if best is None or best.shape != frame.shape:
+                            best, best_score = np.empty_like(frame), None
+                        if best_score is None or score > best_score:
+                            best[...] = frame  # Copy out of the ring; the slot will be reused
+                            best_score = score
+                        burst_size += 1
+                        if burst_start is None:
+                            burst_start = now
+                else:
+                    FRAMES_SKIPPED.inc()
+
+            if burst_start is None:
+                continue
+            if burst_size < self.burst_frames and time.perf_counter() - burst_start < self.burst_timeout:
+                continue
+
+            self.inferences += 1
+            INFERENCES.inc()
+            burst_size, burst_start, best_score = 0, None, None
+            timings = {}
+            start = time.perf_counter()
+            try:
+                result = self.engine.nearest(best, timings)
+            except Exception as e:
+                ERRORS.inc()
+                logger.error("Verification error: %s", e)
+                continue
+            if stop.is_set():
+                return  # Stopped during the inference; a newer run may own the camera now
+            inference_time.observe(time.perf_counter() - start)
+            observe_timings(timings)
+            decision = tracker.record(target, result, time.perf_counter())
+            if decision is Track.REJECTED:
+                REJECTIONS.inc()
+                logger.info("Face track %d rejected after %d inferences", target.id, len(target.observations))
+            elif decision is not None:
+                MATCHES.inc()
+                logger.info("Matched %s (%s) on track %d after %d frames, %d checked, %d inferences",
+                            decision[0], decision[1], target.id, self.frames_seen,
+                            self.frames_checked, self.inferences)
+                self.on_match(decision)
+                if self.stop_on_match:
+                    return
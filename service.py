@@ -0,0 +1,290 @@
+import os
+import re
+import time
+import json
+import logging
+import argparse
+import threading
+import socketserver
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import urlparse, parse_qs
+import cv2
+import numpy as np
+from gallery import REFERENCE_DIR, POSES, reference_path
+from engine import RecognitionEngine
+from image_writer import ImageWriter, ENROLL_FORMAT, ENROLL_QUALITY, FORMATS
+from matcher import FUSION_STRATEGIES
+from multicam import BatchingEngine, QueueFull, MAX_BATCH, MAX_WAIT
+from template_store import TemplateStore, TEMPLATE_DIR, NAME_WIDTH, POSE_WIDTH
+from metrics import REGISTRY, stage, observe_timings
+
+logger = logging.getLogger("unlockx")
+
+MAX_BODY = 10 * 1024 * 1024  # Largest accepted image upload, in bytes
+MAX_PENDING = 64  # Requests waiting for the model before new ones get 503
+MAX_CLIENT_QUEUE = 16  # Requests one client may have waiting
+REQUEST_TIMEOUT = 30.0
+RETRY_AFTER = 1  # Seconds suggested to clients that were turned away
+ROUTES = ("/enroll", "/verify", "/identify")
+NAME_PATTERN = re.compile(r"[A-Z0-9 _-]+")  # Safe in file and directory names on every platform
+
+
+class ServiceError(Exception):
+    """An error with an HTTP status, reported to the client as JSON."""
+
+    def __init__(self, status, message):
+        super().__init__(message)
+        self.status = status
+
+
+def check_name(value, what, width):
+    """Reject names that could leave the reference directory or be truncated in the store."""
+    if not NAME_PATTERN.fullmatch(value) or len(value) > width:
+        raise ServiceError(400, f"{what} must be 1-{width} characters of A-Z, 0-9, space, _ or -")
+
+
+class VerificationService:
+    """The enroll / verify / identify logic of the kiosk, without Qt.
+
+    Concurrent requests are embedded together through a BatchingEngine
+    (one queue per client) that rejects work once ``max_pending`` requests
+    are waiting; the HTTP layer turns that into 503 with Retry-After.
+    Enrollment face crops are encoded and saved by an ImageWriter in the
+    background; the template itself is stored before enroll() returns.
+    """
+
+    def __init__(self, engine, store, reference_dir=REFERENCE_DIR, max_batch=MAX_BATCH,
+                 max_wait=MAX_WAIT, max_pending=MAX_PENDING, max_client_queue=MAX_CLIENT_QUEUE,
+                 image_format=ENROLL_FORMAT, image_quality=ENROLL_QUALITY):
+        self.engine = engine
+        self.store = store
+        self.reference_dir = reference_dir
+        self.writer = ImageWriter(image_format, image_quality)
+        self.batcher = BatchingEngine(engine, max_batch=max_batch, max_wait=max_wait,
+                                      max_queue_depth=max_client_queue, reject=True,
+                                      max_pending=max_pending)
+        self._store_lock = threading.Lock()  # TemplateStore appends are not thread-safe
+
+    def start(self):
+        self.engine.reload(self.store)
+        self.engine.start()
+        self.batcher.start()
+
+    def stop(self):
+        self.batcher.stop()
+        self.engine.stop()
+        self.writer.stop()
+
+    def _embed(self, client, frame):
+        if not self.engine.is_ready:
+            raise ServiceError(503, "Recognition engine is still loading")
+        try:
+            future = self.batcher.submit(client, frame)
+        except QueueFull as e:
+            raise ServiceError(503, f"Too many requests waiting: {e}")
+        embedding, timings, face = future.result(REQUEST_TIMEOUT)
+        observe_timings(timings)
+        if embedding is None:
+            raise ServiceError(422, "No face detected")
+        return embedding, timings, face
+
+    def enroll(self, client, user, pose, frame):
+        """Same flow as RegisterPage.capture_image: keep the face crop and store the template."""
+        check_name(user, "user", NAME_WIDTH)
+        check_name(pose.upper(), "pose", POSE_WIDTH)
+        embedding, timings, face = self._embed(client, frame)
+        self.writer.write_image(reference_path(user, pose, self.reference_dir, ext=self.writer.fmt), face)
+        with self._store_lock:
+            self.store.append(user, pose, embedding)
+        self.engine.add_template(user, pose, embedding)
+        return 201, {"user": user, "pose": pose, "timings": timings}
+
+    def verify(self, client, user, frame):
+        """1:1: does the face belong to ``user``?"""
+        check_name(user, "user", NAME_WIDTH)
+        embedding, timings, _ = self._embed(client, frame)
+        result = self.engine.matcher.verify(embedding, user)
+        if result is None:
+            raise ServiceError(404, f"No templates enrolled for {user}")
+        pose, distance, accepted = result
+        return 200, {"user": user, "match": accepted, "pose": pose, "distance": distance,
+                     "timings": timings}
+
+    def identify(self, client, frame):
+        """1:N: who is this, if anyone?"""
+        embedding, timings, _ = self._embed(client, frame)
+        results = self.engine.search(embedding)
+        if results and results[0][2] <= self.engine.threshold:
+            user, pose, distance = results[0]
+            return 200, {"match": True, "user": user, "pose": pose, "distance": distance,
+                         "timings": timings}
+        return 200, {"match": False, "timings": timings}
+
+    def health(self):
+        return 200, {
+            "ready": self.engine.is_ready,
+            "error": None if self.engine.error is None else str(self.engine.error),
+            "templates": self.engine.gallery_size(),
+            "pending": self.batcher.pending,
+            "batches": self.batcher.batches,
+            "requests": self.batcher.requests,
+            "rejected": self.batcher.rejected,
+        }
+
+
+class RequestHandler(BaseHTTPRequestHandler):
+    """POST /enroll?user=&pose=, /verify?user=, /identify with an encoded image body;
+    GET /health, and GET /metrics in Prometheus text format."""
+
+    protocol_version = "HTTP/1.1"  # Keep-alive: every response carries a Content-Length
+    disable_nagle_algorithm = True  # Headers and body go out as separate writes
+    service = None  # Set by make_server()
+
+    def address_string(self):
+        # Unix sockets have no peer address
+        return self.client_address[0] if self.client_address else "unix"
+
+    def _send_json(self, status, body, headers=()):
+        payload = json.dumps(body).encode()
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(payload)))
+        for name, value in headers:
+            self.send_header(name, value)
+        self.end_headers()
+        self.wfile.write(payload)
+
+    def _read_frame(self):
+        length = int(self.headers.get("Content-Length") or 0)
+        if length <= 0:
+            raise ServiceError(400, "Expected an encoded image as the request body")
+        if length > MAX_BODY:
+            self.close_connection = True  # The unread body would corrupt the next request
+            raise ServiceError(413, f"Image larger than {MAX_BODY} bytes")
+        body = self.rfile.read(length)
+        frame = cv2.imdecode(np.frombuffer(body, dtype=np.uint8), cv2.IMREAD_COLOR)
+        if frame is None:
+            raise ServiceError(400, "Could not decode the image")
+        return frame
+
+    def _client(self):
+        # Fairness is per calling client; a gateway can name its callers itself
+        return self.headers.get("X-Client-Id") or self.address_string()
+
+    def _handle(self, route):
+        try:
+            status, body = route()
+            self._send_json(status, body)
+        except ServiceError as e:
+            headers = [("Retry-After", str(RETRY_AFTER))] if e.status == 503 else []
+            self._send_json(e.status, {"error": str(e)}, headers)
+        except Exception as e:
+            logger.exception("Request failed")
+            self._send_json(500, {"error": str(e)})
+
+    def do_GET(self):
+        url = urlparse(self.path)
+        if url.path == "/health":
+            self._handle(self.service.health)
+        elif url.path == "/metrics":
+            payload = REGISTRY.render().encode()
+            self.send_response(200)
+            self.send_header("Content-Type", "text/plain; version=0.0.4")
+            self.send_header("Content-Length", str(len(payload)))
+            self.end_headers()
+            self.wfile.write(payload)
+        else:
+            self._send_json(404, {"error": f"Unknown path {url.path}"})
+
+    def do_POST(self):
+        url = urlparse(self.path)
+        query = {k: v[0] for k, v in parse_qs(url.query).items()}
+
+        def route():
+            if url.path not in ROUTES:
+                self.close_connection = True
+                raise ServiceError(404, f"Unknown path {url.path}")
+            frame = self._read_frame()
+            if url.path == "/identify":
+                return self.service.identify(self._client(), frame)
+            user = query.get("user", "").strip().upper()  # Names are stored upper-case, as in RegisterPage
+            if not user:
+                raise ServiceError(400, "Missing user parameter")
+            if url.path == "/verify":
+                return self.service.verify(self._client(), user, frame)
+            pose = query.get("pose", POSES[0])
+            if pose not in POSES:
+                raise ServiceError(400, f"Pose must be one of {', '.join(POSES)}")
+            return self.service.enroll(self._client(), user, pose, frame)
+
+        start = time.perf_counter()
+        self._handle(route)
+        if url.path in ROUTES:  # Unknown paths would each add a histogram
+            stage("http" + url.path.replace("/", "_")).observe(time.perf_counter() - start)
+
+    def log_message(self, format, *args):
+        logger.debug("%s %s", self.address_string(), format % args)
+
+
+class ServiceHTTPServer(ThreadingHTTPServer):
+    request_queue_size = 128  # Listen backlog; the default of 5 resets bursts of new connections
+
+
+if hasattr(socketserver, "UnixStreamServer"):  # Not on Windows
+    class ThreadingUnixHTTPServer(socketserver.ThreadingMixIn, socketserver.UnixStreamServer):
+        daemon_threads = True
+        request_queue_size = 128
+else:
+    ThreadingUnixHTTPServer = None
+
+
+def make_server(service, host="127.0.0.1", port=8080, unix_socket=None):
+    """An HTTP server over TCP, or over a Unix socket when a path is given."""
+    handler = type("ServiceRequestHandler", (RequestHandler,), {"service": service})
+    if unix_socket:
+        if ThreadingUnixHTTPServer is None:
+            raise ValueError("Unix sockets are not supported on this platform")
+        if os.path.exists(unix_socket):
+            os.unlink(unix_socket)
+        handler.disable_nagle_algorithm = False  # TCP_NODELAY fails on AF_UNIX sockets
+        return ThreadingUnixHTTPServer(unix_socket, handler)
+    return ServiceHTTPServer((host, port), handler)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Local UnlockX verification service.")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8080)
+    parser.add_argument("--unix-socket", help="listen on this Unix socket path instead of TCP")
+    parser.add_argument("--store", default=TEMPLATE_DIR)
+    parser.add_argument("--reference-dir", default=REFERENCE_DIR)
+    parser.add_argument("--fusion", default=FUSION_STRATEGIES[0], choices=FUSION_STRATEGIES)
+    parser.add_argument("--max-batch", type=int, default=MAX_BATCH)
+    parser.add_argument("--max-wait", type=float, default=MAX_WAIT,
+                        help="seconds to wait for concurrent requests to share a batch")
+    parser.add_argument("--max-pending", type=int, default=MAX_PENDING)
+    parser.add_argument("--image-format", default=ENROLL_FORMAT, choices=FORMATS,
+                        help="format of the enrollment images saved to --reference-dir")
+    parser.add_argument("--image-quality", type=int, default=ENROLL_QUALITY)
+    args = parser.parse_args()
+    if args.unix_socket and ThreadingUnixHTTPServer is None:
+        parser.error("--unix-socket is not supported on this platform")
+
+    logging.basicConfig(level=logging.INFO, format="%(asctime)s %(levelname)s %(name)s: %(message)s")
+    service = VerificationService(RecognitionEngine(fusion=args.fusion), TemplateStore(args.store),
+                                  args.reference_dir, args.max_batch, args.max_wait, args.max_pending,
+                                  image_format=args.image_format, image_quality=args.image_quality)
+    service.start()
+    server = make_server(service, args.host, args.port, args.unix_socket)
+    logger.info("Serving on %s", args.unix_socket or f"http://{args.host}:{args.port}")
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+        service.stop()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,425 @@
+import os
+import json
+import time
+import zlib
+import logging
+import argparse
+import threading
+from contextlib import contextmanager
+import numpy as np
+from gallery import MODEL_NAME
+from matcher import l2_normalize
+
+try:
+    import fcntl
+except ImportError:
+    fcntl = None  # No cross-process locking (Windows); threads are still serialized
+
+logger = logging.getLogger("unlockx")
+
+TEMPLATE_DIR = "templates"
+META_FILE = "meta.json"
+LOCK_FILE = "lock"
+
+NAME_WIDTH = 64
+POSE_WIDTH = 32
+
+RECORD_DTYPE = np.dtype([
+    ("user_id", "<u4"),
+    ("name", f"S{NAME_WIDTH}"),
+    ("pose", f"S{POSE_WIDTH}"),
+    ("timestamp", "<f8"),
+])
+
+OP_ADD = 1
+OP_DELETE = 2
+
+
+def log_dtype(dim):
+    """Fixed-width append-log entry: op, record, embedding and a CRC32 of the rest."""
+    return np.dtype([
+        ("op", "u1"),
+        ("record", RECORD_DTYPE),
+        ("embedding", "<f4", (dim,)),
+        ("crc", "<u4"),
+    ])
+
+
+class RecordLabels:
+    """Read-only (user, pose) view over a record array, decoded on access."""
+
+    def __init__(self, records):
+        self.records = records
+
+    def __len__(self):
+        return len(self.records)
+
+    def __getitem__(self, i):
+        record = self.records[i]
+        return record["name"].decode(), record["pose"].decode()
+
+    def __iter__(self):
+        for i in range(len(self.records)):
+            yield self[i]
+
+    def users(self):
+        """Every record's user name as one array, without a Python-level loop."""
+        return np.char.decode(self.records["name"])
+
+
+class TemplateStore:
+    """Compact on-disk template gallery.
+
+    A compacted generation is an ``embeddings.<gen>.f32`` matrix of normalized
+    float32 rows and a ``records.<gen>.bin`` array of fixed-width records, both
+    opened read-only with ``np.memmap``. Enrollments and deletions since the
+    last compaction go to ``append.<gen>.log``; each entry is fsynced and
+    checksummed, and a torn write at the tail is cut off on the next open.
+    ``meta.json`` names the current generation and is replaced atomically
+    by compact().
+
+    Several processes may share a store (the kiosk and the command line
+    below). Appends, compaction and log repair hold an exclusive lock on
+    the store, and each store re-reads the generation and log before
+    appending or populating, so changes made elsewhere are picked up.
+    """
+
+    def __init__(self, path=TEMPLATE_DIR):
+        self.path = path
+        self.dim = None
+        self.generation = 0
+        self.embeddings = np.empty((0, 0), dtype=np.float32)
+        self.records = np.empty(0, dtype=RECORD_DTYPE)
+        self.log_entries = []  # (op, record, embedding) read from or appended to the log
+        self._log_size = 0  # Bytes of the append log reflected in log_entries
+        self._user_ids = {}
+        self._thread_lock = threading.Lock()
+        self.open()
+
+    def _file(self, kind, generation=None):
+        generation = self.generation if generation is None else generation
+        ext = {"embeddings": "f32", "records": "bin", "append": "log", "index": "npz"}[kind]
+        return os.path.join(self.path, f"{kind}.{generation}.{ext}")
+
+    @contextmanager
+    def _locked(self):
+        """Hold the store's lock against other threads and, where possible, other processes."""
+        with self._thread_lock:
+            if fcntl is None or not os.path.isdir(self.path):
+                yield
+                return
+            try:
+                f = open(os.path.join(self.path, LOCK_FILE), "a")
+            except OSError:
+                yield  # A read-only store; nothing done here writes to it
+                return
+            with f:
+                fcntl.flock(f, fcntl.LOCK_EX)
+                try:
+                    yield
+                finally:
+                    fcntl.flock(f, fcntl.LOCK_UN)
+
+    def _read_meta(self):
+        meta_path = os.path.join(self.path, META_FILE)
+        if not os.path.exists(meta_path):
+            return None
+        with open(meta_path) as f:
+            return json.load(f)
+
+    def open(self):
+        """Map the current generation and replay its append log."""
+        with self._locked():
+            self._open()
+
+    def _open(self):
+        meta = self._read_meta()
+        if meta is None:
+            return
+        self.dim = meta["dim"]
+        self.generation = meta["generation"]
+
+        count = os.path.getsize(self._file("records")) // RECORD_DTYPE.itemsize
+        if count:
+            self.records = np.memmap(self._file("records"), dtype=RECORD_DTYPE, mode="r", shape=(count,))
+            self.embeddings = np.memmap(self._file("embeddings"), dtype=np.float32, mode="r",
+                                        shape=(count, self.dim))
+        else:
+            self.records = np.empty(0, dtype=RECORD_DTYPE)
+            self.embeddings = np.empty((0, self.dim), dtype=np.float32)
+
+        self.log_entries = self._read_log()
+        self._user_ids = {}
+        for _, record, _ in self.log_entries:
+            self._user_ids[record["name"].decode()] = int(record["user_id"])
+
+    def _read_log(self):
+        """Valid log entries; anything after them is truncated so later appends stay aligned."""
+        self._log_size = 0
+        log_path = self._file("append")
+        if not os.path.exists(log_path):
+            return []
+        dtype = log_dtype(self.dim)
+        raw = np.fromfile(log_path, dtype=np.uint8)
+        count = raw.size // dtype.itemsize  # A partial trailing entry is a torn write
+        entries = raw[:count * dtype.itemsize].view(dtype)
+        crc_offset = dtype.fields["crc"][1]
+
+        valid = []
+        for i, entry in enumerate(entries):
+            start = i * dtype.itemsize
+            if zlib.crc32(raw[start:start + crc_offset].tobytes()) != int(entry["crc"]):
+                logger.warning("Template log %s corrupt at entry %d; ignoring the rest", log_path, i)
+                break
+            valid.append((int(entry["op"]), entry["record"].copy(), entry["embedding"].copy()))
+
+        self._log_size = len(valid) * dtype.itemsize
+        if raw.size > self._log_size:
+            logger.warning("Truncating %d bytes of torn or corrupt entries from %s",
+                           raw.size - self._log_size, log_path)
+            try:
+                with open(log_path, "r+b") as f:
+                    f.truncate(self._log_size)
+                    f.flush()
+                    os.fsync(f.fileno())
+            except OSError as e:
+                # Read-only here; the next writer repairs it
+                logger.error("Could not truncate %s: %s", log_path, e)
+                self._log_size = raw.size
+        return valid
+
+    def _stale(self):
+        """Whether another process compacted the store or appended to its log since we read it."""
+        meta = self._read_meta()
+        if meta is None:
+            return False
+        if self.dim is None or meta["generation"] != self.generation:
+            return True
+        log_path = self._file("append")
+        return (os.path.getsize(log_path) if os.path.exists(log_path) else 0) != self._log_size
+
+    def refresh(self):
+        """Re-open the store if it changed on disk since it was last read."""
+        with self._locked():
+            if self._stale():
+                self._open()
+
+    def _write_meta(self, generation):
+        tmp = os.path.join(self.path, META_FILE + ".tmp")
+        with open(tmp, "w") as f:
+            json.dump({"dim": self.dim, "generation": generation}, f)
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(tmp, os.path.join(self.path, META_FILE))
+
+    def _ensure_created(self, dim):
+        if self.dim is not None:
+            if dim != self.dim:
+                raise ValueError(f"Embedding size {dim} does not match store size {self.dim}")
+            return
+        os.makedirs(self.path, exist_ok=True)
+        self.dim = dim
+        self.embeddings = np.empty((0, dim), dtype=np.float32)
+        for kind in ("embeddings", "records"):
+            open(self._file(kind), "wb").close()
+        self._write_meta(self.generation)
+
+    def _user_id(self, name):
+        """Stable id for a name; looked up in the mapped records only on a cache miss."""
+        if name not in self._user_ids:
+            rows = np.flatnonzero(self.records["name"] == name.encode()[:NAME_WIDTH])
+            if rows.size:
+                self._user_ids[name] = int(self.records["user_id"][rows[0]])
+            else:
+                base_max = int(self.records["user_id"].max()) if len(self.records) else 0
+                self._user_ids[name] = max(base_max, max(self._user_ids.values(), default=0)) + 1
+        return self._user_ids[name]
+
+    def _append_entry(self, op, name, pose, embedding, timestamp):
+        dtype = log_dtype(self.dim)
+        entry = np.zeros(1, dtype=dtype)
+        entry["op"] = op
+        entry["record"]["user_id"] = self._user_id(name)
+        entry["record"]["name"] = name.encode()[:NAME_WIDTH]
+        entry["record"]["pose"] = pose.encode()[:POSE_WIDTH]
+        entry["record"]["timestamp"] = time.time() if timestamp is None else timestamp
+        entry["embedding"] = embedding
+        payload = entry.tobytes()
+        entry["crc"] = zlib.crc32(payload[:dtype.fields["crc"][1]])
+
+        with open(self._file("append"), "ab") as f:
+            f.write(entry.tobytes())
+            f.flush()
+            os.fsync(f.fileno())
+        self._log_size += dtype.itemsize
+        self.log_entries.append((op, entry["record"][0].copy(), entry["embedding"][0].copy()))
+
+    def append(self, name, pose, embedding, timestamp=None):
+        """Durably record a new template; returns once it is on disk."""
+        embedding = l2_normalize(embedding)
+        os.makedirs(self.path, exist_ok=True)
+        with self._locked():
+            if self._stale():
+                self._open()
+            self._ensure_created(embedding.shape[0])
+            self._append_entry(OP_ADD, name, pose, embedding, timestamp)
+
+    def delete_user(self, name):
+        """Durably mark every template of a user as deleted."""
+        with self._locked():
+            if self._stale():
+                self._open()
+            if self.dim is None:
+                return
+            self._append_entry(OP_DELETE, name, "", np.zeros(self.dim, dtype=np.float32), None)
+
+    def populate(self, matcher):
+        """Load the store into a FaceMatcher without copying the mapped rows.
+
+        A matcher this store already populated only gets the log entries
+        added since, and keeps its ANN index. Otherwise the generation is
+        loaded afresh; its ANN index is read from ``index.<gen>.npz`` or,
+        the first time, built over the generation and saved there. Templates
+        added to the matcher directly are not tracked.
+        """
+        self.refresh()
+        key = (os.path.abspath(self.path), self.generation)
+        source = matcher.source
+        if source is not None and source[0] == key and source[1] <= len(self.log_entries):
+            entries = self.log_entries[source[1]:]
+        else:
+            matcher.set_embeddings(RecordLabels(self.records), self.embeddings, normalized=True,
+                                   build_index=False)
+            if matcher.needs_index():
+                # Started before the log replay, which the index job journals and applies
+                index_path = self._file("index")
+                if os.path.exists(index_path):
+                    def loaded(index):
+                        if index is None and not matcher.is_indexing:  # Unreadable; index the gallery as it is now
+                            matcher.build_index()
+                    matcher.load_index(index_path, on_ready=loaded)
+                else:
+                    matcher.build_index(save_path=index_path)
+            entries = self.log_entries
+        for op, record, embedding in entries:
+            name = record["name"].decode()
+            if op == OP_ADD:
+                matcher.add(name, record["pose"].decode(), embedding)
+            else:
+                matcher.remove_user(name)
+        if matcher.index is None and not matcher.is_indexing and matcher.needs_index():
+            matcher.build_index()  # Grew past the ANN size through the log alone
+        matcher.source = (key, len(self.log_entries))
+
+    def live_templates(self):
+        """Return (record, embedding) for every template that survives the log."""
+        live = [(self.records[i], self.embeddings[i]) for i in range(len(self.records))]
+        for op, record, embedding in self.log_entries:
+            if op == OP_ADD:
+                live.append((record, embedding))
+            else:
+                live = [(r, e) for r, e in live if r["name"] != record["name"]]
+        return live
+
+    def compact(self):
+        """Rewrite live templates into a new generation and drop the append log."""
+        with self._locked():
+            if self._stale():
+                self._open()
+            return self._compact()
+
+    def _compact(self):
+        if self.dim is None:
+            return 0
+        live = self.live_templates()
+        generation = self.generation + 1
+
+        records = np.array([r for r, _ in live], dtype=RECORD_DTYPE)
+        embeddings = np.array([e for _, e in live], dtype=np.float32).reshape(-1, self.dim)
+        for kind, array in (("embeddings", embeddings), ("records", records)):
+            with open(self._file(kind, generation), "wb") as f:
+                f.write(array.tobytes())
+                f.flush()
+                os.fsync(f.fileno())
+        self._write_meta(generation)
+
+        old = self.generation
+        # Release the old maps before removing their files
+        self.records = np.empty(0, dtype=RECORD_DTYPE)
+        self.embeddings = np.empty((0, self.dim), dtype=np.float32)
+        for kind in ("embeddings", "records", "append", "index"):
+            try:
+                if os.path.exists(self._file(kind, old)):
+                    os.remove(self._file(kind, old))
+            except OSError as e:
+                # Still mapped by another process; it is unused from now on
+                logger.warning("Could not remove %s: %s", self._file(kind, old), e)
+        self._open()
+        return len(live)
+
+
+def model_store_path(path, model_name):
+    """Templates of models other than MODEL_NAME live in a subdirectory of the main store."""
+    return path if model_name == MODEL_NAME else os.path.join(path, model_name)
+
+
+class ModelStores:
+    """A main TemplateStore plus one store per extra embedding model, opened on first use."""
+
+    def __init__(self, store):
+        self.stores = {MODEL_NAME: store}
+
+    def __getitem__(self, model_name):
+        if model_name not in self.stores:
+            self.stores[model_name] = TemplateStore(model_store_path(self.stores[MODEL_NAME].path, model_name))
+        return self.stores[model_name]
+
+    def append(self, name, pose, embeddings, timestamp=None):
+        """Append one template per model from a {model name: embedding} dict."""
+        for model_name, embedding in embeddings.items():
+            self[model_name].append(name, pose, embedding, timestamp)
+
+
+def import_reference(store, reference_dir):
+    """Append reference images under reference/<LASTNAME>/ to the store; returns the count added.
+
+    Stored .npy embeddings predate aligned-crop matching, so every image is
+    embedded again the way login probes are. A (user, pose) the store
+    already has, e.g. from a kiosk registration or an earlier import, is
+    skipped, so importing twice adds nothing.
+    """
+    from gallery import backfill_embeddings, load_gallery
+
+    backfill_embeddings(reference_dir, force=True)
+    store.refresh()
+    existing = {(record["name"].decode(), record["pose"].decode()) for record, _ in store.live_templates()}
+    count = 0
+    for user, pose, embedding in load_gallery(reference_dir):
+        if (user, pose) in existing:
+            continue
+        store.append(user, pose, embedding)
+        existing.add((user, pose))
+        count += 1
+    return count
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Manage the UnlockX template store.")
+    parser.add_argument("--store", default=TEMPLATE_DIR)
+    parser.add_argument("--import-reference", metavar="DIR",
+                        help="import embeddings from a reference/<LASTNAME>/ directory")
+    parser.add_argument("--delete", metavar="LASTNAME", help="delete a user's templates")
+    parser.add_argument("--compact", action="store_true",
+                        help="rewrite the store without deleted users and clear the log")
+    args = parser.parse_args()
+
+    store = TemplateStore(args.store)
+    if args.import_reference:
+        print(f"Imported {import_reference(store, args.import_reference)} templates.")
+    if args.delete:
+        store.delete_user(args.delete.upper())
+        print(f"Deleted {args.delete.upper()}.")
+    if args.compact:
+        print(f"Compacted store to {store.compact()} templates.")
+    if not (args.import_reference or args.delete or args.compact):
+        parser.print_help()
@@ -0,0 +1,82 @@
+import time
+import numpy as np
+from hotset import HotSet
+from matcher import FaceMatcher
+
+DIM = 8
+USERS = "ABCDE"
+
+
+def axis(i):
+    vector = np.zeros(DIM, dtype=np.float32)
+    vector[i] = 1.0
+    return vector
+
+
+def gallery():
+    return FaceMatcher.from_gallery([(user, "Front", axis(i)) for i, user in enumerate(USERS)])
+
+
+def test_eviction_spares_frequent_users():
+    hot = HotSet(gallery(), capacity=3)
+    for now in (1, 2, 3):
+        hot.record("A", now=now)
+    hot.record("B", now=4)
+    hot.record("C", now=5)
+    hot.record("D", now=6)  # A is least recent, but B is least frequent
+    assert list(hot.entries) == ["A", "C", "D"]
+    assert hot.matcher.users() == {"A", "C", "D"}
+
+    hot.record("C", now=7)
+    hot.record("E", now=8)  # D and E tie on one match; the older one goes
+    assert list(hot.entries) == ["A", "C", "E"]
+
+
+def test_unmatched_users_expire():
+    hot = HotSet(gallery(), max_age=10)
+    hot.record("A", now=0)
+    hot.record("B", now=5)
+    hot.record("C", now=12)
+    assert list(hot.entries) == ["B", "C"]
+    assert hot.matcher.users() == {"B", "C"}
+
+
+def test_search_prefers_the_hot_tier():
+    hot = HotSet(gallery())
+    assert hot.search(axis(1))[0][0] == "B"
+    assert hot.hits == 0 and list(hot.entries) == ["B"]
+    assert hot.search(axis(1))[0][0] == "B"
+    assert hot.hits == 1 and hot.entries["B"][1] == 2
+
+
+def test_snapshot_round_trip(tmp_path):
+    path = str(tmp_path / "hotset.json")
+    full = gallery()
+    hot = HotSet(full, snapshot_path=path)
+    now = time.time()
+    hot.record("A", now=now)
+    hot.record("C", now=now)
+    hot.record("C", now=now)
+    hot.save()
+
+    full.remove_user("A")  # Deleted while the kiosk was down
+    restored = HotSet(full, snapshot_path=path)
+    assert restored.load() == 1
+    assert dict(restored.entries) == {"C": [now, 2]}
+    assert restored.matcher.search(axis(2))[0][:2] == ("C", "Front")
+
+
+def test_refresh_user_after_reenrollment():
+    full = gallery()
+    hot = HotSet(full)
+    hot.record("A", now=time.time())
+
+    full.remove_user("A")
+    full.add("A", "Left", axis(7))
+    hot.refresh_user("A")
+    assert [(pose, list(e)) for pose, e in hot.matcher.templates("A")] == [("Left", list(axis(7)))]
+    assert hot.matcher.search(axis(7))[0][:2] == ("A", "Left")
+
+    full.remove_user("A")
+    hot.refresh_user("A")
+    assert "A" not in hot.entries and len(hot.matcher) == 0
@@ -0,0 +1,123 @@
+import threading
+import numpy as np
+from ann_index import IVFIndex
+from matcher import FaceMatcher
+
+DIM = 8
+
+
+def axis(i):
+    vector = np.zeros(DIM, dtype=np.float32)
+    vector[i] = 1.0
+    return vector
+
+
+def mix(*weights):
+    return np.asarray(weights + (0.0,) * (DIM - len(weights)), dtype=np.float32)
+
+
+def embedding(seed):
+    return np.random.default_rng(seed).standard_normal(DIM).astype(np.float32)
+
+
+# A has one exact pose and one unrelated one; B has two good but inexact poses
+GALLERY = [
+    ("A", "Front", axis(0)),
+    ("A", "Left", axis(2)),
+    ("B", "Front", mix(0.9, 0.44)),
+    ("B", "Left", mix(0.85, -0.53)),
+]
+
+
+def test_max_fusion_ranks_single_templates():
+    matcher = FaceMatcher.from_gallery(GALLERY, fusion="max")
+    results = matcher.search(axis(0), k=3)
+    assert [(user, pose) for user, pose, _ in results] == [("A", "Front"), ("B", "Front"), ("B", "Left")]
+    assert results[0][2] < 1e-6
+
+
+def test_centroid_fusion_prefers_consistent_poses():
+    matcher = FaceMatcher.from_gallery(GALLERY, fusion="centroid")
+    results = matcher.search(axis(0), k=2)
+    assert [(user, pose) for user, pose, _ in results] == [("B", "Front"), ("A", "Front")]
+    assert results[0][2] < 0.01  # B's poses average out to the probe
+    assert abs(results[1][2] - (1.0 - 1.0 / np.sqrt(2.0))) < 1e-5
+
+
+def test_vote_fusion_needs_a_quorum_of_poses():
+    matcher = FaceMatcher.from_gallery(GALLERY, fusion="vote")
+    results = matcher.search(axis(0), k=2)
+    assert [(user, pose) for user, pose, _ in results] == [("B", "Front")]
+    # The reported distance is that of the closest pose, not the vote share
+    assert abs(results[0][2] - matcher.search_users(axis(0), ["B"])[0][2]) < 1e-6
+
+
+def test_verify_reports_a_failed_vote():
+    matcher = FaceMatcher.from_gallery(GALLERY, fusion="vote")
+    assert matcher.verify(axis(0), "A") == (None, None, False)
+    assert matcher.verify(axis(0), "NOBODY") is None
+    pose, distance, accepted = matcher.verify(axis(0), "B")
+    assert pose == "Front" and accepted and distance < matcher.threshold
+
+
+def test_remove_user_from_base_and_tail():
+    matcher = FaceMatcher.from_gallery(GALLERY)
+    matcher.add("A", "Right", axis(3))
+    matcher.add("C", "Front", axis(1))
+    assert matcher.remove_user("A") == 3
+    assert matcher.remove_user("A") == 0
+    assert matcher.users() == {"B", "C"}
+    assert len(matcher) == 3
+    assert "A" not in {user for user, _, _ in matcher.search(axis(0), k=10)}
+    assert matcher.search(axis(1))[0][:2] == ("C", "Front")
+
+
+def test_index_follows_add_and_remove():
+    gallery = [(f"U{i}", "Front", embedding(i)) for i in range(40)]
+    matcher = FaceMatcher.from_gallery(gallery, index=IVFIndex(nlist=4, nprobe=4), ann_min_size=20)
+    matcher._index_thread.join()
+    assert matcher.index is not None
+
+    matcher.add("NEW", "Front", embedding(100))
+    assert matcher.search(embedding(100))[0][:2] == ("NEW", "Front")
+    matcher.remove_user("U3")
+    found = {user for user, _, _ in matcher.search(embedding(3), k=40)}
+    assert "U3" not in found and len(found) == 40
+    ann = matcher.search(embedding(5), k=3)
+    exact = matcher.search(embedding(5), k=3, exact=True)
+    assert [r[:2] for r in ann] == [r[:2] for r in exact]
+
+
+class GatedIVFIndex(IVFIndex):
+    """An IVFIndex whose load() waits until the test lets it finish."""
+
+    gate = threading.Event()
+
+    @classmethod
+    def load(cls, path):
+        cls.gate.wait(5)
+        return super().load(path)
+
+
+def test_changes_during_an_index_load_are_replayed(tmp_path):
+    gallery = [(f"U{i}", "Front", embedding(i)) for i in range(40)]
+    path = str(tmp_path / "index.npz")
+    built = FaceMatcher.from_gallery(gallery, index=IVFIndex(nlist=4, nprobe=4), ann_min_size=20)
+    built._index_thread.join()
+    built.index.save(path)
+
+    matcher = FaceMatcher(index=GatedIVFIndex(nlist=4, nprobe=4), ann_min_size=20)
+    matcher.set_embeddings([(user, pose) for user, pose, _ in gallery],
+                           np.stack([e for _, _, e in gallery]), build_index=False)
+    GatedIVFIndex.gate.clear()
+    matcher.load_index(path)
+    assert matcher.is_indexing
+    matcher.add("NEW", "Front", embedding(100))
+    matcher.remove_user("U1")
+    GatedIVFIndex.gate.set()
+    matcher._index_thread.join()
+
+    assert not matcher.is_indexing
+    assert len(matcher.index) == 40
+    assert matcher.index.search(embedding(100))[0][:2] == ("NEW", "Front")
+    assert "U1" not in {user for user, _, _ in matcher.index.search(embedding(1), k=40)}
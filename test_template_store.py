@@ -0,0 +1,130 @@
+import os
+import numpy as np
+from ann_index import IVFIndex
+from matcher import FaceMatcher
+from template_store import TemplateStore, log_dtype
+
+DIM = 8
+
+
+def embedding(seed):
+    return np.random.default_rng(seed).standard_normal(DIM).astype(np.float32)
+
+
+def users(store):
+    matcher = FaceMatcher()
+    store.populate(matcher)
+    return matcher.users()
+
+
+def test_append_survives_reopen(tmp_path):
+    store = TemplateStore(str(tmp_path))
+    store.append("A", "Front", embedding(1))
+    store.delete_user("A")
+    store.append("B", "Front", embedding(2))
+    assert users(TemplateStore(str(tmp_path))) == {"B"}
+
+
+def test_torn_tail_is_truncated_before_the_next_append(tmp_path):
+    store = TemplateStore(str(tmp_path))
+    store.append("A", "Front", embedding(1))
+    store.append("B", "Front", embedding(2))
+    log_path = store._file("append")
+    with open(log_path, "ab") as f:
+        f.write(b"\x01" * 20)  # Half-written entry from a crash
+
+    store = TemplateStore(str(tmp_path))
+    assert os.path.getsize(log_path) == 2 * log_dtype(DIM).itemsize
+    store.append("C", "Front", embedding(3))
+    assert users(TemplateStore(str(tmp_path))) == {"A", "B", "C"}
+
+
+def test_corrupt_entry_drops_the_rest(tmp_path):
+    store = TemplateStore(str(tmp_path))
+    for i, name in enumerate("ABC"):
+        store.append(name, "Front", embedding(i))
+    log_path = store._file("append")
+    with open(log_path, "r+b") as f:
+        f.seek(log_dtype(DIM).itemsize + 10)  # Inside B's record
+        f.write(b"\xff")
+
+    store = TemplateStore(str(tmp_path))
+    store.append("D", "Front", embedding(4))
+    assert users(TemplateStore(str(tmp_path))) == {"A", "D"}
+
+
+def test_compact_keeps_live_templates(tmp_path):
+    store = TemplateStore(str(tmp_path))
+    store.append("A", "Front", embedding(1))
+    store.append("A", "Left", embedding(2))
+    store.append("B", "Front", embedding(3))
+    store.delete_user("B")
+    assert store.compact() == 2
+    assert store.generation == 1
+    assert not os.path.exists(store._file("append", 0))
+
+    reopened = TemplateStore(str(tmp_path))
+    assert users(reopened) == {"A"}
+    assert len(reopened.records) == 2
+    np.testing.assert_allclose(np.linalg.norm(reopened.embeddings, axis=1), 1.0, rtol=1e-5)
+
+
+def test_append_after_compaction_by_another_process(tmp_path):
+    kiosk = TemplateStore(str(tmp_path))
+    kiosk.append("A", "Front", embedding(1))
+    TemplateStore(str(tmp_path)).compact()
+
+    kiosk.append("B", "Front", embedding(2))
+    assert kiosk.generation == 1
+    assert not os.path.exists(kiosk._file("append", 0))
+    assert users(TemplateStore(str(tmp_path))) == {"A", "B"}
+
+
+def test_populate_sees_changes_from_another_process(tmp_path):
+    kiosk = TemplateStore(str(tmp_path))
+    kiosk.append("A", "Front", embedding(1))
+    kiosk.append("B", "Front", embedding(2))
+    assert users(kiosk) == {"A", "B"}
+
+    cli = TemplateStore(str(tmp_path))
+    cli.delete_user("A")
+    assert users(kiosk) == {"B"}
+    cli.compact()
+    cli.append("C", "Front", embedding(3))
+    assert users(kiosk) == {"B", "C"}
+
+
+def test_populate_again_only_applies_new_entries(tmp_path):
+    store = TemplateStore(str(tmp_path))
+    for i in range(40):
+        store.append(f"U{i}", "Front", embedding(i))
+    store.compact()
+    matcher = FaceMatcher(index=IVFIndex(), ann_min_size=20)
+    store.populate(matcher)
+    matcher._index_thread.join()
+    index = matcher.index
+    assert os.path.exists(store._file("index"))
+
+    store.append("NEW", "Front", embedding(100))
+    store.populate(matcher)
+    store.populate(matcher)
+    assert matcher.index is index
+    assert len(matcher) == 41
+    assert matcher.index.search(embedding(100))[0][0] == "NEW"
+
+
+def test_saved_index_is_loaded_for_the_same_generation(tmp_path):
+    store = TemplateStore(str(tmp_path))
+    for i in range(40):
+        store.append(f"U{i}", "Front", embedding(i))
+    store.compact()
+    first = FaceMatcher(index=IVFIndex(), ann_min_size=20)
+    store.populate(first)
+    first._index_thread.join()
+
+    store.delete_user("U1")
+    second = FaceMatcher(index=IVFIndex(), ann_min_size=20)
+    TemplateStore(str(tmp_path)).populate(second)
+    second._index_thread.join()
+    assert len(second.index) == 39
+    assert "U1" not in {user for user, _, _ in second.index.search(embedding(1), k=40)}
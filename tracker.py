@@ -0,0 +1,131 @@
+import itertools
+
+IOU_THRESHOLD = 0.3  # Minimum overlap for a box to continue an existing track
+MAX_AGE = 1.5  # Seconds a track survives without being seen
+MIN_VOTES = 2  # Observations of the same user needed to decide a track
+MAX_OBSERVATIONS = 5  # Observations after which an undecided track is rejected
+REJECT_COOLDOWN = 5.0  # Seconds before a rejected track is tried again
+DECISION_CRITERIA = ("average", "vote")
+
+
+def iou(a, b):
+    """Intersection over union of two (x, y, w, h) boxes."""
+    ax, ay, aw, ah = a
+    bx, by, bw, bh = b
+    w = min(ax + aw, bx + bw) - max(ax, bx)
+    h = min(ay + ah, by + bh) - max(ay, by)
+    if w <= 0 or h <= 0:
+        return 0.0
+    inter = w * h
+    return inter / float(aw * ah + bw * bh - inter)
+
+
+class Track:
+    """One face followed across frames, with the match results gathered for it."""
+
+    REJECTED = "rejected"
+
+    def __init__(self, track_id, box, now):
+        self.id = track_id
+        self.box = box
+        self.first_seen = now
+        self.last_seen = now
+        self.observations = []  # (user, distance) of the nearest template per inference
+        self.decision = None  # The matched (user, pose, distance), or Track.REJECTED
+        self.decided_at = None
+
+    @property
+    def decided(self):
+        return self.decision is not None
+
+    @property
+    def area(self):
+        return self.box[2] * self.box[3]
+
+
+class FaceTracker:
+    """Greedy IoU tracker over the boxes of a cheap face detector.
+
+    update() is fed every checked frame's boxes and keeps track IDs stable
+    while a face stays in view. record() adds one nearest-template result to
+    a track and decides it once the configured criterion is met:
+
+    - "vote": ``min_votes`` results name the same user within the threshold.
+    - "average": ``min_votes`` results name the same user and their mean
+      distance is within the threshold, so one noisy frame can't reject.
+
+    A track with ``max_observations`` results and no decision is rejected;
+    it is retried after ``reject_cooldown`` seconds if it is still in view.
+    """
+
+    def __init__(self, threshold, criterion="average", min_votes=MIN_VOTES,
+                 max_observations=MAX_OBSERVATIONS, iou_threshold=IOU_THRESHOLD,
+                 max_age=MAX_AGE, reject_cooldown=REJECT_COOLDOWN):
+        if criterion not in DECISION_CRITERIA:
+            raise ValueError(f"Unsupported decision criterion: {criterion}")
+        self.threshold = threshold
+        self.criterion = criterion
+        self.min_votes = min_votes
+        self.max_observations = max_observations
+        self.iou_threshold = iou_threshold
+        self.max_age = max_age
+        self.reject_cooldown = reject_cooldown
+        self.tracks = {}
+        self._ids = itertools.count(1)
+
+    def update(self, boxes, now):
+        """Assign boxes to tracks; returns the tracks seen in this frame."""
+        for track_id in [t for t, track in self.tracks.items() if now - track.last_seen > self.max_age]:
+            del self.tracks[track_id]  # Left the frame; a face seen again starts afresh
+        pairs = sorted(
+            ((iou(track.box, box), track_id, i)
+             for track_id, track in self.tracks.items() for i, box in enumerate(boxes)),
+            reverse=True,
+        )
+        seen, used = [], set()
+        for overlap, track_id, i in pairs:
+            if overlap < self.iou_threshold:
+                break
+            track = self.tracks[track_id]
+            if track in seen or i in used:
+                continue
+            track.box = boxes[i]
+            track.last_seen = now
+            seen.append(track)
+            used.add(i)
+
+        for i, box in enumerate(boxes):
+            if i not in used:
+                track = Track(next(self._ids), box, now)
+                self.tracks[track.id] = track
+                seen.append(track)
+
+        for track in seen:
+            if track.decision is Track.REJECTED and now - track.decided_at >= self.reject_cooldown:
+                track.decision, track.decided_at = None, None
+                track.observations = []
+        return seen
+
+    def record(self, track, result, now):
+        """Add a (user, pose, distance) result (or None) to a track; returns its decision."""
+        if track.decided:
+            return track.decision
+        if result is not None:
+            track.observations.append((result[0], result[2]))
+            distances = [d for user, d in track.observations if user == result[0]]
+            if self.criterion == "vote":
+                distances = [d for d in distances if d <= self.threshold]
+                accepted = len(distances) >= self.min_votes
+            else:
+                accepted = (len(distances) >= self.min_votes
+                            and sum(distances) / len(distances) <= self.threshold)
+            if accepted:
+                track.decision = (result[0], result[1], sum(distances) / len(distances))
+                track.decided_at = now
+                return track.decision
+        else:
+            track.observations.append((None, None))
+        if len(track.observations) >= self.max_observations:
+            track.decision = Track.REJECTED
+            track.decided_at = now
+        return track.decision
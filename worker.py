@@ -0,0 +1,261 @@
+import time
+import queue
+import logging
+import threading
+import itertools
+import multiprocessing
+from concurrent.futures import Future
+from multiprocessing import shared_memory
+import numpy as np
+from gallery import MODEL_NAME
+from matcher import FUSION_STRATEGIES, THRESHOLDS
+from pipeline import DETECTOR_BACKEND
+from hotset import HOT_SIZE
+
+logger = logging.getLogger("unlockx")
+
+MAX_FRAME_SHAPE = (1080, 1920, 3)  # Largest frame a shared-memory slot can hold
+RESTART_DELAY = 1.0  # Seconds before restarting a crashed worker, doubling per crash
+MAX_RESTART_DELAY = 30.0
+POLL_INTERVAL = 0.2
+
+
+def _worker_main(slot_names, requests, results, model_name, detector_backend, fusion, screen_model, hot_size):
+    """Worker process: load the engine once, then serve requests until told to stop."""
+    from engine import RecognitionEngine
+    from template_store import TemplateStore
+
+    slots = [shared_memory.SharedMemory(name=name) for name in slot_names]
+    engine = RecognitionEngine(model_name, detector_backend, fusion, screen_model=screen_model, hot_size=hot_size)
+    engine.load()
+    if engine.error is not None:
+        results.put(("failed", None, str(engine.error), None))
+        return
+    results.put(("ready", None, engine.timings, None))
+
+    # Requests are (kind, request_id, payload); payload is the store path for
+    # "reload" and (slot, shape, dtype) of the shared frame otherwise.
+    while True:
+        message = requests.get()
+        if message is None:
+            break
+        kind, request_id, payload = message
+        try:
+            timings = None
+            if kind == "reload":
+                engine.reload(TemplateStore(payload))
+                value = engine.gallery_size()
+            else:
+                slot, shape, dtype = payload
+                frame = np.ndarray(shape, dtype=dtype, buffer=slots[slot].buf)
+                timings = {}
+                if kind == "identify":
+                    value = engine.identify(frame, timings)
+                elif kind == "nearest":
+                    value = engine.nearest(frame, timings)
+                elif kind == "enroll":
+                    value = engine.enroll(frame)
+                else:
+                    value = engine.embed(frame)
+            results.put(("ok", request_id, value, timings))
+        except Exception as e:
+            results.put(("error", request_id, str(e), None))
+
+    engine.stop()  # Saves the hot set snapshot
+    for shm in slots:
+        shm.close()
+
+
+class InferenceWorker:
+    """Runs detection, embedding and matching in a supervised child process.
+
+    Frames are copied into preallocated ``multiprocessing.shared_memory``
+    slots and only the slot number travels over the request queue; results
+    come back as small tuples. A supervisor thread dispatches results to
+    futures and restarts the process if it dies, failing whatever was in
+    flight. Exposes the same interface as engine.RecognitionEngine.
+    """
+
+    def __init__(self, model_name=MODEL_NAME, detector_backend=DETECTOR_BACKEND, fusion=FUSION_STRATEGIES[0],
+                 slots=4, max_frame_shape=MAX_FRAME_SHAPE, started_at=None, screen_model=None,
+                 hot_size=HOT_SIZE):
+        self.model_name = model_name
+        self.detector_backend = detector_backend
+        self.fusion = fusion
+        self.screen_model = screen_model
+        self.hot_size = hot_size
+        self.threshold = THRESHOLDS["cosine"]  # The worker's matcher uses the default metric
+        self.started_at = time.perf_counter() if started_at is None else started_at
+        self.timings = {}
+        self.error = None
+        self.restarts = 0
+        self._restart_delay = RESTART_DELAY
+        self._context = multiprocessing.get_context("spawn")  # Never fork a process running Qt
+        self._slot_bytes = int(np.prod(max_frame_shape))
+        self._slots = [shared_memory.SharedMemory(create=True, size=self._slot_bytes)
+                       for _ in range(slots)]
+        self._free_slots = queue.Queue()
+        self._pending = {}  # request id -> (future, slot)
+        self._ids = itertools.count()
+        self._lock = threading.Lock()
+        self._ready = threading.Event()
+        self._gallery_size = 0
+        self._store_path = None
+        self._process = None
+        self._requests = None
+        self._results = None
+        self._supervisor = None
+        self._stopping = False
+
+    @property
+    def is_ready(self):
+        return self._ready.is_set()
+
+    def wait(self, timeout=None):
+        return self._ready.wait(timeout)
+
+    def start(self):
+        if self._supervisor is None:
+            self._spawn()
+            self._supervisor = threading.Thread(target=self._supervise, daemon=True)
+            self._supervisor.start()
+
+    def _spawn(self):
+        self._ready.clear()
+        self._requests = self._context.Queue()
+        self._results = self._context.Queue()
+        self._free_slots = queue.Queue()
+        for slot in range(len(self._slots)):
+            self._free_slots.put(slot)
+        self._process = self._context.Process(
+            target=_worker_main,
+            args=([shm.name for shm in self._slots], self._requests, self._results,
+                  self.model_name, self.detector_backend, self.fusion, self.screen_model, self.hot_size),
+            daemon=True,
+        )
+        self._process.start()
+        logger.info("Inference worker started (pid %s)", self._process.pid)
+
+    def _supervise(self):
+        while not self._stopping:
+            try:
+                status, request_id, value, timings = self._results.get(timeout=POLL_INTERVAL)
+            except queue.Empty:
+                # A worker that failed to load exits on purpose; don't respawn it
+                if not self._process.is_alive() and not self._stopping and self.error is None:
+                    self._restart()
+                continue
+            except (EOFError, OSError):
+                continue
+
+            if status == "ready":
+                self.timings = value
+                self.timings["first_unlock_possible"] = time.perf_counter() - self.started_at
+                logger.info("Inference worker ready; first unlock possible %.2f s after launch",
+                            self.timings["first_unlock_possible"])
+                self._restart_delay = RESTART_DELAY
+                self._ready.set()
+                if self._store_path is not None:
+                    self._request("reload", self._store_path).add_done_callback(self._reloaded)
+                continue
+            if status == "failed":
+                self.error = RuntimeError(value)
+                logger.error("Inference worker failed to load: %s", value)
+                continue
+
+            with self._lock:
+                future, slot = self._pending.pop(request_id, (None, None))
+            if slot is not None:
+                self._free_slots.put(slot)
+            if future is not None:
+                if status == "ok":
+                    future.set_result((value, timings))
+                else:
+                    future.set_exception(RuntimeError(value))
+
+    def _restart(self):
+        logger.warning("Inference worker exited with code %s; restarting", self._process.exitcode)
+        self._ready.clear()
+        self.restarts += 1
+        time.sleep(self._restart_delay)
+        self._restart_delay = min(self._restart_delay * 2, MAX_RESTART_DELAY)
+        # Everything sent so far went to the dead process's queue
+        with self._lock:
+            pending, self._pending = self._pending, {}
+        for future, _ in pending.values():
+            future.set_exception(RuntimeError("Inference worker crashed"))
+        if not self._stopping:
+            self._spawn()
+
+    def _request(self, kind, payload, slot=None):
+        future = Future()
+        request_id = next(self._ids)
+        with self._lock:
+            self._pending[request_id] = (future, slot)
+        try:
+            self._requests.put((kind, request_id, payload))
+        except (ValueError, OSError) as e:
+            with self._lock:
+                self._pending.pop(request_id, None)
+            if slot is not None:
+                self._free_slots.put(slot)
+            future.set_exception(RuntimeError(f"Could not reach inference worker: {e}"))
+        return future
+
+    def submit(self, kind, frame, timeout=1.0):
+        """Copy a frame into a free slot and queue it; returns a Future of (value, timings)."""
+        if frame.nbytes > self._slot_bytes:
+            raise ValueError(f"Frame of {frame.nbytes} bytes exceeds the shared-memory slot size")
+        slot = self._free_slots.get(timeout=timeout)
+        np.ndarray(frame.shape, dtype=frame.dtype, buffer=self._slots[slot].buf)[...] = frame
+        return self._request(kind, (slot, frame.shape, frame.dtype.str), slot)
+
+    def identify(self, frame, timings=None, timeout=30.0):
+        """Best (user, pose, distance) match for a frame, or None."""
+        match, worker_timings = self.submit("identify", frame).result(timeout)
+        if timings is not None and worker_timings:
+            timings.update(worker_timings)
+        return match
+
+    def nearest(self, frame, timings=None, timeout=30.0):
+        """Closest (user, pose, distance) for a frame whatever the threshold, or None."""
+        result, worker_timings = self.submit("nearest", frame).result(timeout)
+        if timings is not None and worker_timings:
+            timings.update(worker_timings)
+        return result
+
+    def embed(self, frame, timeout=30.0):
+        """Enrollment embedding of a captured frame."""
+        return self.submit("embed", frame).result(timeout)[0]
+
+    def enroll(self, frame, timeout=30.0):
+        """(face crop, {model name: embedding}) of a captured frame."""
+        return self.submit("enroll", frame).result(timeout)[0]
+
+    def reload(self, store):
+        """Have the worker reopen the template store from disk."""
+        self._store_path = store.path
+        if self.is_ready:
+            self._request("reload", store.path).add_done_callback(self._reloaded)
+
+    def _reloaded(self, future):
+        if future.exception() is None:
+            self._gallery_size = future.result()[0]
+
+    def gallery_size(self):
+        return self._gallery_size
+
+    def stop(self):
+        """Stop the worker process and free the shared-memory slots."""
+        self._stopping = True
+        if self._process is not None and self._process.is_alive():
+            self._requests.put(None)
+            self._process.join(timeout=2.0)
+            if self._process.is_alive():
+                self._process.terminate()
+        if self._supervisor is not None:
+            self._supervisor.join(timeout=1.0)
+        for shm in self._slots:
+            shm.close()
+            shm.unlink()
+        self._slots = []